@@ -0,0 +1,64 @@
+# django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+
+# third party
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+# local
+from .cache import LRUCache
+
+User = get_user_model()
+
+# user fields kept in the principal cache, the others are loaded on access
+PRINCIPAL_FIELDS = [
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {'id', 'is_active', 'is_staff', 'is_superuser'}]
+
+principal_cache = LRUCache(
+    max_size=settings.PRINCIPAL_CACHE['MAX_SIZE'],
+    timeout=settings.PRINCIPAL_CACHE['TIMEOUT'],
+    backend=settings.PRINCIPAL_CACHE['BACKEND'],
+    key_prefix='core:principal')
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication resolving the token user from `principal_cache`, so
+    authenticated requests don't query the user. The user has only the
+    `PRINCIPAL_FIELDS` loaded, the others are deferred.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        values = principal_cache.get(user_id)
+        if values is None:
+            values = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values_list(
+                *PRINCIPAL_FIELDS).first()
+            if values is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+            principal_cache.set(user_id, values)
+
+        user = User.from_db(User.objects.db, PRINCIPAL_FIELDS, values)
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed_receiver(sender, instance, **kwargs):
+    # other processes keep their in-process entries until they expire
+    principal_cache.delete(getattr(instance, api_settings.USER_ID_FIELD))
@@ -0,0 +1,118 @@
+# python
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import Optional
+
+# django
+from django.core.cache import caches
+
+MISSING = object()
+
+
+class LRUCache:
+    """
+    In-process least recently used cache with expiration, optionally backed
+    by a shared django cache, useful for memoizing pure computations.
+    """
+
+    def __init__(self, max_size: int = 1024, timeout: Optional[float] = None,
+                 backend: Optional[str] = None, key_prefix: str = ''):
+        # Entries kept in-process, the least recently used are evicted first.
+        self.max_size = max_size
+
+        # Seconds before an entry expires, `None` means it never expires.
+        self.timeout = timeout
+
+        # Alias of a cache in `settings.CACHES` shared between processes,
+        # `None` keeps the entries in-process only.
+        self.backend = backend
+        self.key_prefix = key_prefix
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'timeout': self.timeout,
+            'backend': self.backend,
+            'hits': self.hits,
+            'backend_hits': self.backend_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def make_key(self, key: Hashable) -> str:
+        items = key if isinstance(key, tuple) else (key,)
+        return ':'.join([self.key_prefix, *map(str, items)])
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is not MISSING:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._entries[key]
+                self.expirations += 1
+
+        if self.backend is not None:
+            value = caches[self.backend].get(self.make_key(key), MISSING)
+            if value is not MISSING:
+                self.backend_hits += 1
+                self._store(key, value)
+                return value
+
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._store(key, value)
+
+        if self.backend is not None:
+            caches[self.backend].set(self.make_key(key), value, self.timeout)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+        if self.backend is not None:
+            caches[self.backend].delete(self.make_key(key))
+
+    def get_or_set(self, key: Hashable, default: Callable[[], Any]) -> Any:
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            value = default()
+            self.set(key, value)
+        return value
+
+    def _store(self, key: Hashable, value: Any):
+        expires = None if self.timeout is None else time.monotonic() + self.timeout
+
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
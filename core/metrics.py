@@ -0,0 +1,151 @@
+# python
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+# django
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# database queries and seconds of the request being handled, the context
+# is copied to the threads running the sync code under ASGI so their
+# queries count too
+request_queries = ContextVar('request_queries', default=None)
+
+
+class Histogram:
+    """
+    Prometheus histogram, the bucket counts are kept per bucket and added
+    up when rendered.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> List[str]:
+        lines = []
+        total = 0
+        for bucket, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {total}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process request metrics by url name, rendered in the Prometheus text
+    format. Each process keeps its own, so with many workers each one is
+    scraped on its own or the series are added up by the scraper.
+    """
+
+    def __init__(self, latency_buckets: Sequence[float], query_buckets: Sequence[float], prefix: str = 'oniloan'):
+        self.prefix = prefix
+        self.latency_buckets = latency_buckets
+        self.query_buckets = query_buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests: Dict[Tuple[str, str, str], int] = {}
+            self.latency: Dict[str, Histogram] = {}
+            self.queries: Dict[str, Histogram] = {}
+            self.db_time: Dict[str, float] = {}
+
+    def observe(self, view: str, method: str, status: int, duration: float, queries: int, db_time: float):
+        key = (view, method, str(status))
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if view not in self.latency:
+                self.latency[view] = Histogram(self.latency_buckets)
+                self.queries[view] = Histogram(self.query_buckets)
+                self.db_time[view] = 0.0
+            self.latency[view].observe(duration)
+            self.queries[view].observe(queries)
+            self.db_time[view] += db_time
+
+    def render(self) -> str:
+        name = self.prefix
+        with self._lock:
+            lines = [
+                f'# HELP {name}_requests_total Requests by url name, method and status.',
+                f'# TYPE {name}_requests_total counter',
+                *(f'{name}_requests_total{{view="{escape(view)}",method="{method}",status="{status}"}} {count}'
+                  for (view, method, status), count in sorted(self.requests.items())),
+                f'# HELP {name}_request_duration_seconds Request latency by url name.',
+                f'# TYPE {name}_request_duration_seconds histogram',
+                *(line for view, histogram in sorted(self.latency.items())
+                  for line in histogram.render(f'{name}_request_duration_seconds', f'view="{escape(view)}"')),
+                f'# HELP {name}_db_queries Database queries per request by url name.',
+                f'# TYPE {name}_db_queries histogram',
+                *(line for view, histogram in sorted(self.queries.items())
+                  for line in histogram.render(f'{name}_db_queries', f'view="{escape(view)}"')),
+                f'# HELP {name}_db_duration_seconds_total Time spent in database queries by url name.',
+                f'# TYPE {name}_db_duration_seconds_total counter',
+                *(f'{name}_db_duration_seconds_total{{view="{escape(view)}"}} {seconds}'
+                  for view, seconds in sorted(self.db_time.items()))]
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    database execute wrapper adding the queries and their time to the
+    request being handled, if any
+    """
+    stats = request_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+
+def install_query_recorder(connection):
+    # first, `connection.execute_wrapper` pops the last one on exit
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@receiver(connection_created)
+def connection_created_receiver(sender, connection, **kwargs):
+    if settings.METRICS['ENABLED']:
+        install_query_recorder(connection)
+
+
+registry = MetricsRegistry(
+    latency_buckets=settings.METRICS['LATENCY_BUCKETS'],
+    query_buckets=settings.METRICS['QUERY_BUCKETS'])
+
+
+def install():
+    """
+    records the queries of the connections already open, the new ones are
+    handled by `connection_created_receiver`
+    """
+    for connection in connections.all():
+        install_query_recorder(connection)
@@ -0,0 +1,70 @@
+# python
+import asyncio
+import time
+
+# django
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# local
+from . import metrics
+
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, database queries and database time of each request
+    by resolved url name, eg `loans:list`, see `core.metrics`. It should be
+    the first middleware so the whole request is measured. Runs in async
+    mode under ASGI, without taking a thread for the whole request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # marks the instance as a coroutine function, like `MiddlewareMixin`
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        metrics.install()
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        stats = [0, 0.0]
+        token = metrics.request_queries.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.request_queries.reset(token)
+        self.observe(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        # the context is copied to the threads of the sync middleware and
+        # views, they count their queries in the same `stats`
+        stats = [0, 0.0]
+        token = metrics.request_queries.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.request_queries.reset(token)
+        self.observe(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def observe(self, request, response, duration, stats):
+        match = request.resolver_match
+        metrics.registry.observe(
+            view=match.view_name if match else 'unmatched',
+            method=request.method if request.method in METHODS else 'other',
+            status=response.status_code,
+            duration=duration,
+            queries=stats[0],
+            db_time=stats[1])
@@ -1,15 +1,161 @@
 # python
+import json
+import math
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
 from collections import OrderedDict
 
 # django
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
 
 # third party
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
 from rest_framework.pagination import PageNumberPagination as BasePageNumberPagination
 from rest_framework.settings import api_settings
 from rest_framework.views import Response
 
 
+def estimate_count(queryset) -> int:
+    """
+    Row count estimated by the postgres planner, without scanning the rows.
+    Other databases fall back to the exact count.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination on ('-created', '-id'), pages are fetched with
+    a WHERE on the last seen key instead of OFFSET, so deep pages cost the same
+    as the first one. Keeps the envelope of `PageNumberPagination`, with
+    cursors instead of page numbers.
+    """
+
+    page_size = api_settings.PAGE_SIZE or settings.DEFAULT_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(api_settings, 'MAX_PAGE_SIZE', 100)
+
+    # Client can control the cursor using this query parameter.
+    cursor_query_param = 'cursor'
+
+    # Client can control the totals using this query parameter:
+    # 'exact' counts the rows, 'estimate' uses the database planner estimate
+    # and 'none' omits `total` and `page_count`.
+    count_query_param = 'count'
+    count_modes = ('exact', 'estimate', 'none')
+
+    # Descending key fields, the last one must be unique.
+    ordering = ('created', 'id')
+
+    invalid_cursor_message = _('Cursor inválido')
+
+    get_page_size = BasePageNumberPagination.get_page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.cursor = request.query_params.get(self.cursor_query_param)
+        self.count_mode = request.query_params.get(self.count_query_param)
+        if self.count_mode not in self.count_modes:
+            self.count_mode = self.count_modes[0]
+
+        self.queryset = queryset
+        keys, reverse = self.decode_cursor(queryset.model) if self.cursor else (None, False)
+
+        if reverse:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*[f'-{field}' for field in self.ordering])
+        if keys:
+            queryset = queryset.filter(self.make_keyset_filter(keys, reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_cursor = self.prev_cursor = None
+        if results:
+            if has_more or reverse:
+                self.next_cursor = self.encode_cursor(results[-1], reverse=False)
+            if has_more or (keys and not reverse):
+                self.prev_cursor = self.encode_cursor(results[0], reverse=True)
+        elif keys:
+            self.prev_cursor = self.cursor if reverse else self.encode_keys(keys, reverse=True)
+        return results
+
+    def make_keyset_filter(self, keys, reverse):
+        """
+        rows after the keys in the pagination order, the leading `lte`/`gte`
+        keeps the filter usable by an index on the first key field
+        """
+        lookup = 'gt' if reverse else 'lt'
+        first, value = self.ordering[0], keys[0]
+
+        after = Q()
+        for index in reversed(range(len(self.ordering))):
+            equal = {field: keys[i] for i, field in enumerate(self.ordering[:index])}
+            after = Q(**{f'{self.ordering[index]}__{lookup}': keys[index]}, **equal) | after
+        return Q(**{f'{first}__{lookup}e': value}) & after
+
+    def encode_keys(self, keys, reverse):
+        data = json.dumps([[str(key) for key in keys], reverse])
+        return urlsafe_b64encode(data.encode()).decode()
+
+    def encode_cursor(self, obj, reverse):
+        # model instances or `.values()` rows
+        if isinstance(obj, dict):
+            return self.encode_keys([obj[field] for field in self.ordering], reverse)
+        return self.encode_keys([getattr(obj, field) for field in self.ordering], reverse)
+
+    def decode_cursor(self, model):
+        try:
+            keys, reverse = json.loads(urlsafe_b64decode(self.cursor.encode()).decode())
+            assert len(keys) == len(self.ordering)
+            keys = [model._meta.get_field(field).to_python(key) for field, key in zip(self.ordering, keys)]
+        except (TypeError, ValueError, AssertionError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return keys, bool(reverse)
+
+    def get_count(self):
+        if self.count_mode == 'estimate':
+            return estimate_count(self.queryset)
+        return self.queryset.count()
+
+    def get_paginated_response(self, data):
+        envelope = OrderedDict()
+        if self.count_mode != 'none':
+            total = self.get_count()
+            envelope['total'] = total
+            envelope['page_count'] = max(math.ceil(total / self.page_size), 1)
+
+        envelope.update([
+            ('page_size', self.page_size),
+            ('current_page', self.cursor),
+            ('prev_page', self.prev_cursor),
+            ('next_page', self.next_cursor),
+            ('results', data)
+        ])
+        return Response(envelope)
+
+
 class PageNumberPagination(BasePageNumberPagination):
     """
     Adds extra attributes to response, useful for building
@@ -28,6 +174,23 @@ class PageNumberPagination(BasePageNumberPagination):
     # Only relevant if 'page_size_query_param' has also been set.
     max_page_size = getattr(api_settings, 'MAX_PAGE_SIZE', 100)
 
+    # Client can switch to keyset pagination using this query parameter,
+    # eg '?pagination=cursor', or by sending a cursor.
+    pagination_query_param = 'pagination'
+    keyset_pagination_class = KeysetPagination
+
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        cursor = self.keyset_pagination_class.cursor_query_param in request.query_params
+        self.keyset = None
+        # lists, eg the packed loan installments, are paginated by page number
+        keyset = cursor or request.query_params.get(self.pagination_query_param) == 'cursor'
+        if keyset and hasattr(queryset, 'order_by'):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
     def current_page(self):
         return self.request.query_params.get(self.page_query_param, 1)
 
@@ -38,6 +201,9 @@ class PageNumberPagination(BasePageNumberPagination):
         return self.page.previous_page_number() if self.page.has_previous() else None
 
     def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+
         return Response(OrderedDict([
             ('total', self.page.paginator.count),
             ('page_count', self.page.paginator.num_pages),
@@ -0,0 +1,79 @@
+# python
+import csv
+import json
+from decimal import Decimal
+from typing import Iterable
+from typing import Iterator
+from typing import Sequence
+
+# third party
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class DecimalJSONEncoder(JSONEncoder):
+    """
+    Encodes decimals as strings, keeping their exact value.
+    """
+
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return super().default(obj)
+
+
+class Echo:
+    """
+    File-like object that returns what is written, used to stream csv rows.
+    """
+
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renders rows as csv. `stream` yields the rows one at a time, for
+    responses that don't fit in memory.
+    """
+
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = [data]
+        header = list(data[0]) if data else []
+        rows = ([row.get(field) for field in header] for row in data)
+        return ''.join(self.stream(header, rows)).encode(self.charset)
+
+    def stream(self, header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders rows as newline delimited json, one object per line. `stream`
+    yields the rows one at a time, for responses that don't fit in memory.
+    """
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = [data]
+        return ''.join(json.dumps(row, cls=DecimalJSONEncoder) + '\n' for row in data).encode(self.charset)
+
+    def stream(self, header: Sequence[str], rows: Iterable[Sequence]) -> Iterator[str]:
+        for row in rows:
+            yield json.dumps(dict(zip(header, row)), cls=DecimalJSONEncoder) + '\n'
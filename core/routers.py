@@ -0,0 +1,77 @@
+# python
+import random
+from contextvars import ContextVar
+from typing import Hashable
+from typing import Optional
+
+# django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+# local
+from .cache import LRUCache
+
+# database alias the reads of the request being handled go to, `None` reads
+# from the primary. Set by the views, see `loans.mixins.ReplicaMixin`
+read_database = ContextVar('read_database', default=None)
+
+
+def make_pins() -> LRUCache:
+    """
+    users that wrote recently, their reads stay on the primary. With
+    replicas the pins must be seen by every process, or the next request
+    of the user may land on another one and read from a lagging replica.
+    """
+    backend = settings.REPLICAS['PIN_BACKEND']
+    if settings.REPLICAS['DATABASES'] and (
+            backend is None or isinstance(caches[backend], (LocMemCache, DummyCache))):
+        raise ImproperlyConfigured(
+            "REPLICAS['PIN_BACKEND'] must be a cache shared between processes when REPLICAS['DATABASES'] is set")
+
+    return LRUCache(
+        max_size=10000,
+        timeout=settings.REPLICAS['PIN_SECONDS'],
+        backend=backend,
+        key_prefix='core:replica-pin')
+
+
+pins = make_pins()
+
+
+def get_replica() -> Optional[str]:
+    replicas = settings.REPLICAS['DATABASES']
+    return random.choice(replicas) if replicas else None
+
+
+def pin(user_id: Hashable):
+    pins.set(user_id, True)
+
+
+def is_pinned(user_id: Hashable) -> bool:
+    return pins.get(user_id, False)
+
+
+class ReplicaRouter:
+    """
+    Routes the reads to `read_database` when it is set, and everything
+    else to the primary. The replicas are never migrated, they replicate
+    the primary schema.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas have the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.REPLICAS['DATABASES']:
+            return False
+        return None
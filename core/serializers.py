@@ -1,8 +1,12 @@
 # django
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # third party
+from rest_framework import ISO_8601
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -11,3 +15,45 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name',
                   'is_staff', 'is_superuser']
+
+
+class ValuesSerializer(serializers.BaseSerializer):
+    """
+    Read-only serializer of `.values()` rows, for list endpoints where the
+    serializer fields cost more than the queries. Subclasses select the
+    `values_fields` of the queryset and build the output of each row in
+    `to_representation`, the same output of the model serializer they
+    stand for.
+    """
+
+    values_fields = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the datetimes are shown in the timezone active when serializing
+        self.timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    @classmethod
+    def get_values(cls, queryset):
+        return queryset.values(*cls.values_fields)
+
+    def format_datetime(self, value, output_format=None):
+        """
+        `serializers.DateTimeField(format=output_format)` output, the
+        DATETIME_FORMAT setting by default
+        """
+        output_format = output_format or api_settings.DATETIME_FORMAT
+        if not value:
+            return None
+        if output_format is None:
+            return value
+
+        if self.timezone is not None:
+            value = value.astimezone(self.timezone)
+
+        if output_format.lower() == ISO_8601:
+            value = value.isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return value.strftime(output_format)
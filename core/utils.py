@@ -1,5 +1,17 @@
+# python
+import hashlib
+
+
 def get_ip_address(request):
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
     if x_forwarded_for:
         return x_forwarded_for.split(',')[0]
     return request.META.get('REMOTE_ADDR')
+
+
+def make_etag(*parts) -> str:
+    """
+    strong quoted etag of the parts, eg the fields a response is built from
+    """
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
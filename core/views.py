@@ -0,0 +1,28 @@
+# python
+import hmac
+
+# django
+from django.conf import settings
+from django.http import HttpResponse
+from django.http import HttpResponseForbidden
+from django.views.decorators.http import require_GET
+
+# local
+from .metrics import registry
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Request metrics in the Prometheus text format
+
+    * Only admin users or scrapers with the `METRICS['TOKEN']` bearer token
+      can access this view
+    """
+    token = settings.METRICS['TOKEN']
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    scraper = bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+
+    if not scraper and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
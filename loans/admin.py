@@ -7,8 +7,8 @@ from .models import Payment
 
 
 class LoanAdmin(admin.ModelAdmin):
-    list_display = ['id', 'client', 'ip_address', 'value', 'amount_due', 'interest_rate', 'financing',
-                    'created', 'modified']
+    list_display = ['id', 'client', 'ip_address', 'value', 'amount_due', 'paid_total', 'balance_due',
+                    'interest_rate', 'financing', 'created', 'modified']
 
 
 class PaymentAdmin(admin.ModelAdmin):
@@ -10,6 +10,20 @@ LOAN_FINANCING_CHOICES = (
 
 LOAN_FINANCING_MAP = dict(LOAN_FINANCING_CHOICES)
 
+# longest loan period in months, it also keeps the installment numbers of
+# the packed payment ids within their 16 bits
+MAX_PERIOD = 600
+
+# how the installments of a loan are stored: a payment row each, or packed
+# in one loan column, see `loans.utils.PackedSchedule`
+ROW_STORAGE = 1
+PACKED_STORAGE = 2
+
+LOAN_STORAGE_CHOICES = (
+    (ROW_STORAGE, _('Parcelas em linhas')),
+    (PACKED_STORAGE, _('Parcelas compactadas'))
+)
+
 IN_ANALYSIS = 1
 APPROVED = 2
 DISAPPROVED = 3
@@ -33,3 +47,6 @@ PAYMENT_STATUS_CHOICES = (
     (DUE, _('Vencido')),
     (CANCELED, _('Cancelado'))
 )
+
+# payments still expected to be paid
+PAYMENT_OPEN_STATUSES = (AWAITING_PAYMENT, PROCESSING, DUE)
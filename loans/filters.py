@@ -1,7 +1,23 @@
+# python
+import operator
+from functools import reduce
+
+# django
+from django.contrib.postgres.search import SearchQuery
+from django.contrib.postgres.search import SearchRank
+from django.contrib.postgres.search import SearchVector
+from django.db import connections
+from django.db.models import BooleanField
+from django.db.models import Func
+from django.db.models import Q
+
 # third party
 import django_filters
+from rest_framework.filters import SearchFilter
+from rest_framework.settings import api_settings
 
 # local
+from .constants import LOAN_FINANCING_CHOICES
 from .models import Loan
 from .models import Payment
 
@@ -18,3 +34,103 @@ class PaymentFilterSet(django_filters.FilterSet):
     class Meta:
         model = Payment
         fields = ['created', 'modified', 'status']
+
+    def get_row_filters(self) -> dict:
+        """
+        the filters as field values, to match the payment rows not stored
+        in the table, eg the packed installments
+        """
+        return {
+            name: Payment._meta.get_field(name).to_python(value)
+            for name, value in self.form.cleaned_data.items() if value not in (None, '')}
+
+
+class PaymentAnalyticsFilterSet(django_filters.FilterSet):
+
+    start = django_filters.DateTimeFilter(field_name='due_date', lookup_expr='gte')
+    end = django_filters.DateTimeFilter(field_name='due_date', lookup_expr='lt')
+    financing = django_filters.ChoiceFilter(field_name='loan__financing', choices=LOAN_FINANCING_CHOICES)
+    bank = django_filters.CharFilter(field_name='loan__bank')
+
+    class Meta:
+        model = Payment
+        fields = ['start', 'end', 'financing', 'bank', 'client']
+
+
+class SearchMatch(Func):
+    """
+    `vector @@ query`, usable in `filter` and in `Q` objects
+    """
+
+    arg_joiner = ' @@ '
+    template = '%(expressions)s'
+    output_field = BooleanField()
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    `SearchFilter` on the postgres full-text GIN indexes of the
+    `search_fields` (see the loans 0007 migration), the rows are ordered by
+    rank unless the request sets an `ordering`. Each search term matches the
+    words starting with it, eg `bra` matches `Banco do Brasil`, instead of
+    any substring. Terms without letters or digits, eg `%` or `(`, have no
+    words to look up and match as substrings. Other databases get the
+    `SearchFilter` `icontains`.
+
+    The search fields are plain text fields, at most one relation away. The
+    related rows are searched on their own index first, so the OR of the
+    fields can be answered from the indexes.
+    """
+
+    search_config = 'simple'
+
+    # Related rows matched by a term at most, more than that are searched with
+    # a subquery instead of their primary keys.
+    max_related_matches = 1000
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+        if not search_fields or not search_terms or connections[queryset.db].vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+
+        queries = []
+        for term in search_terms:
+            if self.has_words(term):
+                queries.append(self.make_query(term))
+                matches = (self.make_match(queryset, field, queries[-1]) for field in search_fields)
+            else:
+                # a term without words has no lexemes to look up in the
+                # indexes, it matches as a substring like in `SearchFilter`
+                matches = (Q(**{self.construct_search(str(field)): term}) for field in search_fields)
+            queryset = queryset.filter(reduce(operator.or_, matches))
+
+        if not queries or api_settings.ORDERING_PARAM in request.query_params:
+            return queryset
+        vector = reduce(operator.add, (self.make_vector(field) for field in search_fields))
+        rank = SearchRank(vector, reduce(operator.and_, queries))
+        return queryset.order_by(rank.desc(), *(queryset.query.order_by or queryset.model._meta.ordering))
+
+    def has_words(self, term):
+        # the text search parser only keeps letters and digits as words
+        return any(char.isalnum() for char in term)
+
+    def make_query(self, term):
+        # the quoted term is split into words like the indexed text and
+        # each word matches as a prefix
+        quoted = term.replace('\\', '\\\\').replace("'", "''")
+        return SearchQuery(f"'{quoted}':*", search_type='raw', config=self.search_config)
+
+    def make_vector(self, field):
+        return SearchVector(field, config=self.search_config)
+
+    def make_match(self, queryset, field, query):
+        relation, _, name = field.rpartition('__')
+        if not relation:
+            return Q(SearchMatch(self.make_vector(name), query))
+
+        related = queryset.model._meta.get_field(relation).related_model
+        matches = related._default_manager.using(queryset.db).filter(
+            SearchMatch(self.make_vector(name), query)).values_list('pk', flat=True)
+        pks = list(matches[:self.max_related_matches + 1])
+        return Q(**{f'{relation}__in': matches if len(pks) > self.max_related_matches else pks})
@@ -0,0 +1,24 @@
+# python
+import time
+
+# django
+from django.core.management.base import BaseCommand
+
+# project
+from loans.services import advance_schedules
+
+
+class Command(BaseCommand):
+    help = ('Stores the installments entering the schedule window of the loans with one, '
+            'run it before mark_overdue so the installments due are stored')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def report(loan, rows):
+            self.stdout.write(f'{loan.pk}: {rows} installments stored')
+
+        total = advance_schedules(callback=report if options['verbosity'] > 1 else None)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f'{total} installments stored in {elapsed:.1f} s'))
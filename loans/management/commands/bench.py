@@ -0,0 +1,293 @@
+# python
+import json
+import platform
+import statistics
+import time
+from decimal import Decimal
+
+# django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+# third party
+import numpy as np
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# project
+from loans.constants import PRICE_SYSTEM
+from loans.constants import SAC_SYSTEM
+from loans.models import Loan
+from loans.models import Payment
+from loans.serializers import LoanListSerializer
+from loans.serializers import LoanSerializer
+from loans.serializers import PaymentListSerializer
+from loans.serializers import PaymentSerializer
+from loans.services import create_loans
+from loans.utils import make_amortization
+from loans.utils import make_amount_due
+from loans.utils import make_installment
+from loans.utils import make_due_dates
+from loans.utils import make_schedule
+from loans.utils import make_schedules
+from loans.views import LoanListAPIView
+from loans.views import PaymentListAPIView
+
+BENCH_BANK = 'bench'
+
+# usernames of the clients it creates
+BENCH_USERNAME = 'bench-suite'
+
+FINANCING = {'price': PRICE_SYSTEM, 'sac': SAC_SYSTEM}
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(',')]
+
+
+def make_float_schedule(financing, value, interest_rate, period):
+    """
+    reference schedule in closed form on floats, each amount rounded to
+    the cent instead of carrying the exact cents of `make_schedule`, the
+    speed the exact schedules are compared with
+    """
+    months = np.arange(period, dtype=np.float64)
+    if financing == PRICE_SYSTEM:
+        installment = make_installment(value, interest_rate, period)
+        exact = value * interest_rate / (1 - (1 + interest_rate) ** -period)
+        annuity = exact * (1 - (1 + interest_rate) ** (months - period))
+        rounding = (installment - exact) * ((1 + interest_rate) ** months - 1)
+        interest_amounts = np.round((annuity - rounding) / interest_rate * interest_rate, 2)
+        amortizations = np.round(installment - interest_amounts, 2)
+    else:
+        amortizations = np.full(period, make_amortization(value, period))
+        interest_amounts = np.round((value - amortizations[0] * months) * interest_rate, 2)
+    return amortizations + interest_amounts, interest_amounts, amortizations, value - np.cumsum(amortizations)
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the schedule math, the loan creation and the loan and payment list endpoints, '
+            'reporting latency percentiles and query counts. The data it creates is rolled back. '
+            'With --baseline, fails when a case is slower or makes more queries than the baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--periods', type=parse_ints, default=[12, 60, 120, 360],
+            help='Loan periods of the schedule and creation cases, comma separated')
+        parser.add_argument(
+            '--table-sizes', type=parse_ints, default=[100, 1000],
+            help='Loans seeded for the list cases, on top of the existing ones, comma separated')
+        parser.add_argument(
+            '--page-sizes', type=parse_ints, default=[10, 20, 100],
+            help='Page sizes of the list cases, comma separated')
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help='Timed runs of each case')
+        parser.add_argument(
+            '--output',
+            help='Writes the results as json, eg to store a baseline')
+        parser.add_argument(
+            '--baseline',
+            help='Results json to compare with')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Slowdown of the p50 latency over the baseline taken as a regression')
+
+    def handle(self, *args, **options):
+        self.repeat = options['repeat']
+        self.results = {}
+
+        self.bench_schedules(options['periods'])
+
+        with transaction.atomic():
+            self.bench_create(options['periods'])
+            self.bench_lists(options['table_sizes'], options['page_sizes'])
+            self.bench_serializers(max(options['page_sizes']))
+            transaction.set_rollback(True)
+
+        results = {
+            'created': now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'repeat': self.repeat,
+            'cases': self.results}
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if options['baseline']:
+            self.compare(options['baseline'], options['tolerance'])
+
+    def run(self, name, func, rows=None):
+        """
+        times `func` and counts the queries of one of its calls, with `rows`
+        the p50 latency is also reported per row
+        """
+        with CaptureQueriesContext(connection) as context:
+            func()
+
+        timings = []
+        for i in range(self.repeat):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        result = {
+            'p50': statistics.median(timings),
+            'p95': self.percentile(timings, 95),
+            'p99': self.percentile(timings, 99),
+            'mean': statistics.mean(timings),
+            'queries': len(context.captured_queries)}
+        if rows:
+            result['p50_per_row'] = result['p50'] / rows
+        self.results[name] = result
+
+        per_row = f'  {result["p50_per_row"] * 1000:8.2f} us/row' if rows else ''
+        self.stdout.write(
+            f'{name:<48} p50 {result["p50"]:8.3f} ms  p95 {result["p95"]:8.3f} ms  '
+            f'p99 {result["p99"]:8.3f} ms  {result["queries"]:3d} queries{per_row}')
+
+    def percentile(self, timings, percent):
+        return timings[min(len(timings) - 1, int(len(timings) * percent / 100))]
+
+    def bench_schedules(self, periods):
+        self.stdout.write(self.style.MIGRATE_HEADING('Schedules'))
+        for label, financing in FINANCING.items():
+            for period in periods:
+                self.run(f'make_amount_due {label} {period}',
+                         lambda: make_amount_due(financing, 120000.0, 0.01, period))
+                self.run(f'make_schedule {label} {period}',
+                         lambda: make_schedule(financing, 120000.0, 0.01, period))
+                self.run(f'make_schedule float reference {label} {period}',
+                         lambda: make_float_schedule(financing, 120000.0, 0.01, period))
+
+        scenarios = [
+            [FINANCING[label] for label in FINANCING for period in periods for i in range(50)],
+            [1000.0 + i * 100 for label in FINANCING for period in periods for i in range(50)],
+            [0.01 for label in FINANCING for period in periods for i in range(50)],
+            [period for label in FINANCING for period in periods for i in range(50)]]
+        self.run(f'make_schedules {len(scenarios[0])} scenarios', lambda: make_schedules(*scenarios))
+
+    def bench_create(self, periods):
+        self.stdout.write(self.style.MIGRATE_HEADING('Loan creation'))
+        client = User.objects.create(username=f'{BENCH_USERNAME}-create')
+
+        def make_loans(financing, period, count=1):
+            return [
+                Loan(client=client, bank=BENCH_BANK, value=Decimal('120000.00'),
+                     interest_rate=Decimal('0.01'), period=period, financing=financing)
+                for index in range(count)]
+
+        for label, financing in FINANCING.items():
+            for period in periods:
+                self.run(f'loan create {label} {period}', lambda: create_loans(make_loans(financing, period)))
+                self.run(f'loan orm create {label} {period}', lambda: Loan.objects.create(
+                    client=client, bank=BENCH_BANK, value=Decimal('120000.00'),
+                    interest_rate=Decimal('0.01'), period=period, financing=financing))
+        self.run('loan bulk create 100', lambda: create_loans(make_loans(PRICE_SYSTEM, 12, 100)), rows=100)
+
+    def seed(self, clients, loans, period=12):
+        """
+        bulk creates `loans` loans and their payments, split among `clients`
+        """
+        schedule = make_schedule(PRICE_SYSTEM, 10000, 0.01, period)
+        due_dates = make_due_dates(now(), period)
+
+        seeded = [
+            Loan(client=clients[index % len(clients)], bank=BENCH_BANK, value=Decimal('10000.00'),
+                 interest_rate=Decimal('0.01'), period=period, financing=PRICE_SYSTEM,
+                 amount_due=schedule.amount_due, balance_due=schedule.amount_due)
+            for index in range(loans)]
+        Loan.objects.bulk_create(seeded, batch_size=1000)
+        Payment.objects.bulk_create(
+            [payment for loan in seeded for payment in loan.make_payments(schedule, due_dates)], batch_size=5000)
+
+    def bench_lists(self, table_sizes, page_sizes):
+        clients = User.objects.bulk_create([User(username=f'{BENCH_USERNAME}-{index}') for index in range(10)])
+        admin = User.objects.create(username=f'{BENCH_USERNAME}-admin', is_staff=True)
+        # the payments list of the client loan with the longest schedule
+        loan = Loan.objects.create(client=clients[0], bank=BENCH_BANK, value=Decimal('120000.00'),
+                                   interest_rate=Decimal('0.01'), period=360, financing=PRICE_SYSTEM)
+
+        seeded = 0
+        for table_size in sorted(table_sizes):
+            self.seed(clients, table_size - seeded)
+            seeded = table_size
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE loans_loan, loans_payment')
+
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'Lists with {Loan.objects.count()} loans, {Payment.objects.count()} payments'))
+            for page_size in page_sizes:
+                params = {'page_size': page_size}
+                for user in (clients[0], admin):
+                    role = 'admin' if user.is_staff else 'client'
+                    self.run(f'loans:list {role} {table_size}/{page_size}',
+                             self.get_request(LoanListAPIView, user, params))
+                    self.run(f'loans:payments-list {role} {table_size}/{page_size}',
+                             self.get_request(PaymentListAPIView, user, params, loan_pk=loan.pk))
+                # the full-text search, on the username of a client
+                self.run(f'loans:list search {table_size}/{page_size}',
+                         self.get_request(LoanListAPIView, admin, {**params, 'search': clients[3].username}))
+
+    def bench_serializers(self, rows):
+        """
+        serialization of list pages already fetched, the model serializers
+        against the `.values()` ones of the list endpoints
+        """
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Serializers with {rows} rows'))
+        cases = [
+            ('loans', Loan.objects.select_related('client'), LoanSerializer, LoanListSerializer),
+            ('payments', Payment.objects.all(), PaymentSerializer, PaymentListSerializer)]
+        for label, queryset, serializer_class, values_serializer_class in cases:
+            instances = list(queryset[:rows])
+            values = list(values_serializer_class.get_values(queryset)[:rows])
+            self.run(f'serialize {label} {serializer_class.__name__}',
+                     lambda: serializer_class(instances, many=True).data, rows=len(instances))
+            self.run(f'serialize {label} {values_serializer_class.__name__}',
+                     lambda: values_serializer_class(values, many=True).data, rows=len(values))
+
+    def get_request(self, view_class, user, params, **kwargs):
+        """
+        a view call authenticated with a JWT token, like the API requests
+        """
+        view = view_class.as_view()
+        factory = APIRequestFactory()
+        token = RefreshToken.for_user(user).access_token
+
+        def request():
+            response = view(factory.get('/', params, HTTP_AUTHORIZATION=f'Bearer {token}'), **kwargs)
+            response.render()
+            if response.status_code != 200:
+                raise CommandError(f'{view_class.__name__} responded {response.status_code}')
+        return request
+
+    def compare(self, path, tolerance):
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)['cases']
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Compared with {path}'))
+        regressions = []
+        for name, result in self.results.items():
+            if name not in baseline:
+                continue
+            ratio = result['p50'] / baseline[name]['p50'] if baseline[name]['p50'] else 1
+            message = (f'{name:<48} p50 {ratio:6.2f}x  '
+                       f'queries {baseline[name]["queries"]} -> {result["queries"]}')
+            if ratio > 1 + tolerance or result['queries'] > baseline[name]['queries']:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(message))
+            else:
+                self.stdout.write(message)
+
+        if regressions:
+            raise CommandError(f'{len(regressions)} regressions: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,157 @@
+# python
+import statistics
+import time
+
+# django
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.timezone import now
+
+# project
+from loans.constants import AWAITING_PAYMENT
+from loans.constants import DUE
+from loans.constants import PAID
+from loans.constants import ROW_STORAGE
+from loans.models import Loan
+from loans.models import Payment
+
+BENCH_BANK = 'bench'
+
+SEED_CLIENTS_SQL = """
+INSERT INTO auth_user (password, is_superuser, username, first_name, last_name, email, is_staff, is_active,
+                       date_joined)
+SELECT '', false, 'bench-' || g, '', '', '', false, true, now()
+FROM generate_series(1, %(clients)s) g
+ON CONFLICT (username) DO NOTHING
+"""
+
+SEED_LOANS_SQL = """
+WITH clients AS (SELECT array_agg(id) AS ids FROM auth_user WHERE username LIKE 'bench-%%')
+INSERT INTO loans_loan (id, created, modified, client_id, ip_address, bank, value, amount_due, interest_rate,
+                        period, financing, paid_total, balance_due, storage)
+SELECT md5(random()::text || g)::uuid, now() - (g %% 1500) * interval '1 day', now(),
+       clients.ids[1 + g %% array_length(clients.ids, 1)], '127.0.0.1', %(bank)s, 10000, 12000, 0.01,
+       %(period)s, 1, 0, 12000, %(storage)s
+FROM generate_series(1, %(loans)s) g, clients
+"""
+
+SEED_PAYMENTS_SQL = """
+INSERT INTO loans_payment (id, created, modified, client_id, loan_id, value, interest_amount, amortization,
+                           due_date, pay_date, status)
+SELECT md5(random()::text || l.id || p)::uuid, l.created + p * interval '1 microsecond', l.created,
+       l.client_id, l.id, 120, 20, 100, l.created + p * interval '1 month', NULL,
+       CASE WHEN l.created + p * interval '1 month' > now() THEN %(awaiting)s
+            WHEN random() < 0.02 THEN %(awaiting)s
+            ELSE %(paid)s END
+FROM loans_loan l CROSS JOIN generate_series(1, l.period) p
+WHERE l.bank = %(bank)s
+"""
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the payment and loan access paths with and without the loans indexes, '
+            'optionally seeding a benchmark dataset first. Meant for a disposable postgres database: '
+            'the indexes are dropped inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', action='store_true',
+            help='Seeds the benchmark clients, loans and payments before running')
+        parser.add_argument(
+            '--payments', type=int, default=1000000,
+            help='Payments seeded, split in loans of --period installments')
+        parser.add_argument(
+            '--period', type=int, default=100,
+            help='Installments of each seeded loan')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Runs of each query')
+        parser.add_argument(
+            '--plans', action='store_true',
+            help='Prints the query plans')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The benchmark runs on postgres only')
+
+        if options['seed']:
+            self.seed(options['payments'], options['period'])
+
+        loan = Loan.objects.filter(bank=BENCH_BANK).select_related('client').first()
+        if loan is None:
+            raise CommandError('There is no benchmark data, run it with --seed')
+
+        self.stdout.write(f'{Payment.objects.count()} payments, {Loan.objects.count()} loans')
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for model in (Loan, Payment):
+                    for index in model._meta.indexes:
+                        cursor.execute(f'DROP INDEX "{index.name}"')
+            before = self.run(loan, options)
+            transaction.set_rollback(True)
+
+        after = self.run(loan, options)
+
+        for name in before:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, (timings, plan) in (('before', before[name]), ('after', after[name])):
+                self.stdout.write(
+                    f'  {label}: p50 {statistics.median(timings):.2f} ms, '
+                    f'p95 {self.percentile(timings, 95):.2f} ms')
+                if options['plans']:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+
+    def seed(self, payments, period):
+        params = {
+            'clients': max(payments // period // 10, 1),
+            'loans': max(payments // period, 1),
+            'period': period,
+            'bank': BENCH_BANK,
+            'awaiting': AWAITING_PAYMENT,
+            'paid': PAID,
+            'storage': ROW_STORAGE}
+
+        start = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(SEED_CLIENTS_SQL, params)
+            cursor.execute(SEED_LOANS_SQL, params)
+            cursor.execute(SEED_PAYMENTS_SQL, params)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE auth_user, loans_loan, loans_payment')
+
+        self.stdout.write(f'Seeded in {time.perf_counter() - start:.1f} s')
+
+    def get_querysets(self, loan, page_size):
+        return {
+            'loans:list (client)': Loan.objects.select_related('client').filter(
+                client=loan.client_id).order_by('-created', '-id')[:page_size],
+            'loans:list (admin)': Loan.objects.select_related('client').order_by('-created', '-id')[:page_size],
+            'loans:payments-list': Payment.objects.filter(
+                loan=loan, client=loan.client_id).order_by('-created', '-id')[:page_size],
+            'loans:payments-list (cursor)': Payment.objects.filter(
+                loan=loan, created__lte=loan.created).order_by('-created', '-id')[:page_size],
+            'paid total': Payment.objects.filter(
+                loan=loan, status=PAID).order_by().values('loan').annotate(paid=Sum('value')),
+            'open payments by due date': Payment.objects.filter(
+                status__in=[AWAITING_PAYMENT, DUE], due_date__lt=now()).order_by('due_date')[:1000]}
+
+    def run(self, loan, options):
+        results = {}
+        for name, queryset in self.get_querysets(loan, page_size=20).items():
+            timings = []
+            for i in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+
+            plan = queryset.explain(analyze=True) if options['plans'] else ''
+            results[name] = (timings, plan)
+        return results
+
+    def percentile(self, timings, percent):
+        timings = sorted(timings)
+        return timings[min(len(timings) - 1, int(len(timings) * percent / 100))]
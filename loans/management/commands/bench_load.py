@@ -0,0 +1,65 @@
+# python
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# django
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ('Load test of an endpoint of a running server, eg to compare the views under WSGI '
+            '(gunicorn oniloan.wsgi) and ASGI (uvicorn oniloan.asgi:application) at high concurrency.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='+', help='Endpoint urls, requested in turns')
+        parser.add_argument(
+            '--concurrency', type=int, default=100,
+            help='Requests in flight at a time')
+        parser.add_argument(
+            '--requests', type=int, default=2000,
+            help='Requests sent in total')
+        parser.add_argument(
+            '--token',
+            help='JWT access token sent in the Authorization header')
+        parser.add_argument(
+            '--timeout', type=float, default=30,
+            help='Seconds before a request fails')
+
+    def handle(self, *args, **options):
+        headers = {'Authorization': f'Bearer {options["token"]}'} if options['token'] else {}
+        urls = options['url']
+
+        def fetch(index):
+            request = urllib.request.Request(urls[index % len(urls)], headers=headers)
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as err:
+                status = err.code
+            except OSError:
+                status = None
+            return status, (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(fetch, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        timings = sorted(timing for status, timing in results if status == 200)
+        errors = len(results) - len(timings)
+        if not timings:
+            self.stderr.write(f'All {errors} requests failed')
+            return
+
+        def percentile(percent):
+            return timings[min(len(timings) - 1, int(len(timings) * percent / 100))]
+
+        self.stdout.write(
+            f'{len(results)} requests, {options["concurrency"]} concurrent, {errors} errors\n'
+            f'{len(results) / elapsed:.0f} req/s, '
+            f'p50 {statistics.median(timings):.1f} ms, p95 {percentile(95):.1f} ms, p99 {percentile(99):.1f} ms')
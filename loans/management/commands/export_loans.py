@@ -0,0 +1,73 @@
+# python
+from itertools import chain
+
+# django
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import models
+
+# project
+from core.renderers import CSVRenderer
+from core.renderers import NDJSONRenderer
+from loans.filters import LoanFilterSet
+from loans.filters import PaymentFilterSet
+from loans.models import Loan
+from loans.models import Payment
+
+EXPORTS = {
+    'loans': (Loan, LoanFilterSet),
+    'payments': (Payment, PaymentFilterSet)
+}
+
+RENDERERS = {
+    'csv': CSVRenderer,
+    'ndjson': NDJSONRenderer
+}
+
+
+class Command(BaseCommand):
+    help = 'Streams loans or payments as csv or ndjson, reading them from the database in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('export', choices=list(EXPORTS))
+        parser.add_argument(
+            '--format', choices=list(RENDERERS), default='csv')
+        parser.add_argument(
+            '--output',
+            help='Output file, defaults to the standard output')
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='FIELD=VALUE',
+            help='Loan or payment list filter, eg --filter financing=1 (repeatable)')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        model, filterset_class = EXPORTS[options['export']]
+
+        try:
+            data = dict(item.split('=', 1) for item in options['filter'])
+        except ValueError:
+            raise CommandError('Filters must be FIELD=VALUE')
+
+        filterset = filterset_class(data=data, queryset=model.objects.all())
+        if not filterset.is_valid():
+            raise CommandError(dict(filterset.errors))
+
+        # the binary fields are left out, like in `ExportMixin`
+        fields = [
+            field.attname for field in model._meta.concrete_fields if not isinstance(field, models.BinaryField)]
+        rows = filterset.qs.values_list(*fields).iterator(chunk_size=options['chunk_size'])
+        if model is Payment:
+            # the packed installments follow the stored payments
+            rows = chain(rows, Loan.objects.packed_payment_values(fields, **filterset.get_row_filters()))
+        renderer = RENDERERS[options['format']]()
+
+        lines = renderer.stream(fields, rows)
+        if not options['output']:
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        with open(options['output'], 'w', newline='') as output:
+            output.writelines(lines)
@@ -0,0 +1,158 @@
+# python
+import csv
+import json
+import os
+import time
+import uuid
+from itertools import islice
+
+# django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+# project
+from loans.models import Loan
+from loans.serializers import LoanImportSerializer
+from loans.services import create_loans
+
+# namespace of the loan ids derived from the import id and the row number
+IMPORT_NAMESPACE = uuid.UUID('6f1c9a52-0a8e-4c57-9a53-4f0c2b7f9e61')
+
+
+class Command(BaseCommand):
+    help = ('Imports loans and their payments from a CSV or JSON lines file, in chunks and without the per '
+            'loan signals. Each row has the loan create fields (client, bank, value, interest_rate, period, '
+            'financing) and optionally ip_address and id.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='CSV or JSON lines file')
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='Source format, guessed by the file extension by default')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Loans inserted per transaction')
+        parser.add_argument(
+            '--skip-invalid', action='store_true',
+            help='Skips the invalid rows instead of stopping the import')
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Continues from the checkpoint of a previous import of the same source, skipping the loans '
+                 'it already inserted')
+        parser.add_argument(
+            '--checkpoint',
+            help='Checkpoint file, defaults to the source path with a .checkpoint suffix')
+
+    def handle(self, *args, **options):
+        source = options['source']
+        file_format = options['format'] or ('csv' if source.endswith('.csv') else 'jsonl')
+        checkpoint = options['checkpoint'] or f'{source}.checkpoint'
+
+        # the loan ids are derived from the import id, so another import of
+        # the same source or of a file with the same name gets new ones
+        import_id = str(uuid.uuid4())
+        done = 0
+        if options['resume'] and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+            import_id, done = state['import_id'], state['done']
+            self.stdout.write(f'Resuming after row {done}')
+
+        imported = skipped = 0
+        start = time.perf_counter()
+
+        with open(source, newline='') as f:
+            rows = enumerate(self.read_rows(f, file_format), start=1)
+            rows = islice(rows, done, None)
+
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+
+                chunk_imported, chunk_skipped = self.import_chunk(
+                    import_id, chunk, options['skip_invalid'], options['resume'])
+                imported += chunk_imported
+                skipped += chunk_skipped
+                done = chunk[-1][0]
+
+                with open(checkpoint, 'w') as c:
+                    json.dump({'import_id': import_id, 'done': done}, c)
+
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f'{done} rows, {imported} loans imported, {imported / elapsed:.0f} loans/s')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{imported} loans imported and {skipped} skipped in {elapsed:.1f} s '
+            f'({imported / elapsed if elapsed else 0:.0f} loans/s)'))
+
+    def read_rows(self, f, file_format):
+        """
+        the source rows as dicts, the malformed JSON lines as their error
+        message instead
+        """
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+            return
+
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as err:
+                yield f'malformed JSON, {err}'
+                continue
+            yield row if isinstance(row, dict) else 'not a JSON object'
+
+    def get_errors(self, row, client_ids):
+        """
+        errors of the `row`, with its serializer when there are none
+        """
+        if isinstance(row, str):
+            return row, None
+        if row.get('id'):
+            try:
+                uuid.UUID(str(row['id']))
+            except ValueError:
+                return {'id': [f'"{row["id"]}" is not a valid UUID']}, None
+
+        serializer = LoanImportSerializer(data=row, context={'client_ids': client_ids})
+        if not serializer.is_valid():
+            return serializer.errors, None
+        return None, serializer
+
+    def import_chunk(self, import_id, chunk, skip_invalid, resume):
+        client_ids = set(User.objects.filter(
+            pk__in=[row['client'] for _, row in chunk
+                    if isinstance(row, dict) and str(row.get('client', '')).isdigit()]
+        ).values_list('pk', flat=True))
+
+        # validate rows
+        loans = []
+        skipped = 0
+        for line, row in chunk:
+            errors, serializer = self.get_errors(row, client_ids)
+            if errors:
+                if not skip_invalid:
+                    raise CommandError(f'Row {line}: {errors}')
+                self.stderr.write(f'Row {line}: {errors}')
+                skipped += 1
+                continue
+
+            data = serializer.validated_data
+            loan_id = row.get('id') or uuid.uuid5(IMPORT_NAMESPACE, f'{import_id}:{line}')
+            loans.append(Loan(id=loan_id, client_id=data.pop('client'), **data))
+
+        if resume:
+            # the chunk may have been inserted before the checkpoint was
+            # written, its loans are skipped
+            existing = set(Loan.objects.filter(pk__in=[loan.pk for loan in loans]).values_list('pk', flat=True))
+            loans = [loan for loan in loans if uuid.UUID(str(loan.pk)) not in existing]
+        if not loans:
+            return 0, skipped
+
+        create_loans(loans)
+        return len(loans), skipped
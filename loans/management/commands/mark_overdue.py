@@ -0,0 +1,38 @@
+# python
+import time
+
+# django
+from django.core.management.base import BaseCommand
+
+# project
+from loans.services import mark_overdue_packed_payments
+from loans.services import mark_overdue_payments
+
+
+class Command(BaseCommand):
+    help = ('Sets the payments awaiting payment with due date in the past as due, in batches, '
+            'the installments of the packed loans too')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Payments updated per transaction')
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help='Seconds to wait between batches')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+
+        def report(rows, total):
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'{total} payments set as due, {total / elapsed:.0f} rows/s')
+
+        stored = mark_overdue_payments(batch_size=options['batch_size'], sleep=options['sleep'], callback=report)
+        # the installments of the packed loans, reported after the stored ones
+        packed = mark_overdue_packed_payments(callback=lambda rows, total: report(rows, stored + total))
+        total = stored + packed
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} payments set as due in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)'))
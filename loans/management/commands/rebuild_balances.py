@@ -0,0 +1,55 @@
+# django
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+
+# project
+from loans.constants import PACKED_STORAGE
+from loans.models import Loan
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds (or only verifies) the denormalized paid total and balance due of the loans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only reports the loans with wrong balances, fails when there is any')
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Loans updated per transaction')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+
+        batch_size = options['batch_size']
+        loans = Loan.objects.order_by('pk').values_list('pk', flat=True)
+
+        updated = 0
+        last_pk = None
+        while True:
+            batch = loans.filter(pk__gt=last_pk) if last_pk else loans
+            pks = list(batch[:batch_size])
+            if not pks:
+                break
+
+            with transaction.atomic():
+                updated += Loan.objects.filter(pk__in=pks).update_balances()
+            last_pk = pks[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} loans rebuilt'))
+
+    def verify(self):
+        wrong = list(Loan.objects.with_wrong_balances().values_list('pk', flat=True))
+        wrong += [
+            loan.pk for loan in Loan.objects.filter(storage=PACKED_STORAGE).iterator()
+            if loan.paid_total != loan.packed.get_paid_total() or loan.balance_due != loan.amount_due - loan.paid_total]
+
+        count = len(wrong)
+        if count:
+            for pk in wrong[:20]:
+                self.stderr.write(f'{pk}')
+            raise CommandError(f'{count} loans with wrong balances, run rebuild_balances to fix them')
+
+        self.stdout.write(self.style.SUCCESS('All loan balances are right'))
@@ -0,0 +1,52 @@
+# python
+from itertools import chain
+
+# django
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+# project
+from loans.models import Loan
+from loans.models import Payment
+from loans.models import PaymentSummary
+from loans.models import make_month
+from loans.models import summarize_payments
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds (or only verifies) the payment summary by due month, financing and status, from the '
+            'payments, the packed installments and the ones the windowed loans have not stored')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only reports the summary rows that differ from the payments, fails when there is any')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            return self.verify()
+
+        rows = PaymentSummary.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{rows} summary rows rebuilt'))
+
+    def verify(self):
+        fields = ['count', 'value', 'interest_amount', 'amortization']
+        summary = PaymentSummary.objects.exclude(**dict.fromkeys(fields, 0))
+        stored = {
+            (row['month'], row['financing'], row['status']): [row[field] for field in fields]
+            for row in summary.values('month', 'financing', 'status', *fields)}
+        expected = {}
+        packed = summarize_payments(Loan.objects.packed_payments())
+        projected = Loan.objects.summarize_projected()
+        for row in chain(Payment.objects.summarize(), packed, projected):
+            totals = expected.setdefault((make_month(row['month']), row['financing'], row['status']), [0] * 4)
+            for index, field in enumerate(fields):
+                totals[index] += row[field]
+
+        wrong = sorted(key for key in stored.keys() | expected.keys() if stored.get(key) != expected.get(key))
+        if wrong:
+            for month, financing, status in wrong[:20]:
+                self.stderr.write(f'{month:%m/%Y} financing {financing} status {status}')
+            raise CommandError(f'{len(wrong)} wrong summary rows, run rebuild_payment_summary to fix them')
+
+        self.stdout.write(self.style.SUCCESS('The payment summary is right'))
@@ -0,0 +1,38 @@
+# Generated by Django 3.1.7 on 2026-10-17 12:47
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def update_balances(apps, schema_editor):
+    Loan = apps.get_model('loans', 'Loan')
+    Payment = apps.get_model('loans', 'Payment')
+
+    paid = Payment.objects.filter(loan=OuterRef('pk'), status=3).order_by().values('loan')
+    paid_total = Coalesce(
+        Subquery(paid.annotate(total=Sum('value')).values('total')),
+        Value(Decimal('0.00')), output_field=models.DecimalField())
+    Loan.objects.update(paid_total=paid_total, balance_due=F('amount_due') - paid_total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='balance_due',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=18, null=True, verbose_name='Saldo Devedor'),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='paid_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=18, verbose_name='Total Pago'),
+        ),
+        migrations.RunPython(update_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.7 on 2026-10-17 12:50
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # indexes are built concurrently, without locking the tables for writes
+    atomic = False
+
+    dependencies = [
+        ('loans', '0002_loan_balances'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(fields=['client', '-created', '-id'], name='loan_client_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='loan',
+            index=models.Index(fields=['-created', '-id'], name='loan_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['loan', '-created', '-id'], name='payment_loan_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(condition=models.Q(status=3), fields=['loan'], name='payment_loan_paid_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(condition=models.Q(status__in=[1, 4]), fields=['due_date'], name='payment_open_due_date_idx'),
+        ),
+    ]
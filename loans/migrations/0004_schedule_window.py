@@ -0,0 +1,24 @@
+# Generated by Django 3.1.7 on 2026-10-17 13:01
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0003_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='schedule_window',
+            field=models.PositiveIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Janela de Parcelas'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='installment',
+            field=models.PositiveIntegerField(editable=False, null=True, verbose_name='Parcela'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.7 on 2026-10-17 18:20
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # indexes are built concurrently, without locking the tables for writes
+    atomic = False
+
+    dependencies = [
+        ('loans', '0004_schedule_window'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['loan', 'modified'], name='payment_loan_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.14 on 2026-10-17 13:25
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+# summarizes the stored payments, like `PaymentSummaryQuerySet.rebuild`
+SUMMARIZE_PAYMENTS = '''
+INSERT INTO loans_paymentsummary (month, financing, status, count, value, interest_amount, amortization)
+SELECT date_trunc('month', p.due_date AT TIME ZONE %s)::date, l.financing, p.status,
+       count(*), sum(p.value), sum(p.interest_amount), sum(p.amortization)
+FROM loans_payment p
+JOIN loans_loan l ON l.id = p.loan_id
+GROUP BY 1, 2, 3
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0005_payment_loan_modified_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Mês do Vencimento')),
+                ('financing', models.PositiveIntegerField(choices=[(1, 'Sistema Price'), (2, 'Sistema SAC')], verbose_name='Tipo de Financiamento')),
+                ('status', models.PositiveIntegerField(choices=[(1, 'Aguardando Pagamento'), (2, 'Processando'), (3, 'Pago'), (4, 'Vencido'), (5, 'Cancelado')], verbose_name='status')),
+                ('count', models.IntegerField(default=0, verbose_name='Pagamentos')),
+                ('value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18, verbose_name='Valor')),
+                ('interest_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18, verbose_name='Juros')),
+                ('amortization', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18, verbose_name='Amortização sobre saldo devedor')),
+            ],
+            options={
+                'ordering': ['month', 'financing', 'status'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='paymentsummary',
+            constraint=models.UniqueConstraint(fields=('month', 'financing', 'status'), name='payment_summary_uniq'),
+        ),
+        migrations.RunSQL([(SUMMARIZE_PAYMENTS, [settings.TIME_ZONE])], migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.14 on 2026-10-17 21:40
+
+from django.conf import settings
+from django.db import migrations
+
+# the expressions of `loans.filters.FullTextSearchFilter`, the planner only
+# uses the indexes for the very same expressions
+SEARCH_INDEXES = [
+    ('loan_bank_search_idx', 'loans_loan', 'bank'),
+    ('user_username_search_idx', 'auth_user', 'username'),
+]
+
+
+class Migration(migrations.Migration):
+
+    # indexes are built concurrently, without locking the tables for writes
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('loans', '0006_payment_summary'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} "
+            f"USING gin (to_tsvector('simple'::regconfig, COALESCE({column}, '')))",
+            f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+        for name, table, column in SEARCH_INDEXES
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-17 13:42
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0007_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='loan',
+            name='created',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, editable=False, verbose_name='created'),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='packed_schedule',
+            field=models.BinaryField(null=True, verbose_name='Parcelas Compactadas'),
+        ),
+        migrations.AddField(
+            model_name='loan',
+            name='storage',
+            field=models.PositiveIntegerField(choices=[(1, 'Parcelas em linhas'), (2, 'Parcelas compactadas')], default=1, verbose_name='Armazenamento das Parcelas'),
+        ),
+    ]
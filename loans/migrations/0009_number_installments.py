@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db import transaction
+
+# numbers the stored payments of a batch of loans by due date, the rows
+# already numbered are left untouched
+NUMBER_INSTALLMENTS = '''
+UPDATE loans_payment SET installment = numbered.installment
+FROM (
+    SELECT id, row_number() OVER (PARTITION BY loan_id ORDER BY due_date, id) AS installment
+    FROM loans_payment
+    WHERE loan_id = ANY(%s)
+) AS numbered
+WHERE loans_payment.id = numbered.id AND loans_payment.installment IS DISTINCT FROM numbered.installment
+'''
+
+BATCH_SIZE = 1000
+
+
+def number_installments(apps, schema_editor):
+    db = schema_editor.connection.alias
+    loans = apps.get_model('loans', 'Loan').objects.using(db).order_by('pk').values_list('pk', flat=True)
+
+    last_pk = None
+    while True:
+        pks = list((loans.filter(pk__gt=last_pk) if last_pk else loans)[:BATCH_SIZE])
+        if not pks:
+            return
+
+        with transaction.atomic(using=db), schema_editor.connection.cursor() as cursor:
+            cursor.execute(NUMBER_INSTALLMENTS, [pks])
+        last_pk = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    # a transaction per batch of loans instead of one UPDATE of the whole
+    # payment table, the unique constraint is only added afterwards
+    atomic = False
+
+    dependencies = [
+        ('loans', '0008_packed_schedule'),
+    ]
+
+    operations = [
+        migrations.RunPython(number_installments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+# the databases migrated before the installment numbering moved out of
+# 0004_schedule_window already have the constraint
+ADD_CONSTRAINT = '''
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'payment_loan_installment_uniq') THEN
+        ALTER TABLE loans_payment ADD CONSTRAINT payment_loan_installment_uniq
+            UNIQUE USING INDEX payment_loan_installment_uniq;
+    END IF;
+END
+$$
+'''
+
+
+class Migration(migrations.Migration):
+
+    # the index is built concurrently, without locking the table for writes
+    atomic = False
+
+    dependencies = [
+        ('loans', '0009_number_installments'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS payment_loan_installment_uniq '
+                    'ON loans_payment (loan_id, installment)',
+                    'DROP INDEX CONCURRENTLY IF EXISTS payment_loan_installment_uniq'),
+                migrations.RunSQL(
+                    ADD_CONSTRAINT,
+                    'ALTER TABLE loans_payment DROP CONSTRAINT IF EXISTS payment_loan_installment_uniq'),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='payment',
+                    constraint=models.UniqueConstraint(
+                        fields=('loan', 'installment'), name='payment_loan_installment_uniq'),
+                ),
+            ],
+        ),
+    ]
@@ -1,16 +1,60 @@
+# python
+from calendar import timegm
+
+# django
+from django.db import models
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
 # third party
 from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import SAFE_METHODS
+
+# project
+from core.renderers import CSVRenderer
+from core.renderers import NDJSONRenderer
+from core.routers import get_replica
+from core.routers import is_pinned
+from core.routers import pin
+from core.routers import read_database
 
 # local
 from .models import Loan
 
 
+class ReplicaMixin:
+    """
+    Safe method requests read from a replica, picked per request, unless
+    the user wrote something in the last `REPLICAS['PIN_SECONDS']`. The
+    successful writes pin the user to the primary.
+    """
+
+    read_database_token = None
+
+    def initial(self, request, *args, **kwargs):
+        # the pins are per user, so it authenticates before the other checks
+        self.perform_authentication(request)
+        if request.method in SAFE_METHODS and not (request.user.pk and is_pinned(request.user.pk)):
+            self.read_database_token = read_database.set(get_replica())
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self.read_database_token is not None:
+            read_database.reset(self.read_database_token)
+            self.read_database_token = None
+        elif request.method not in SAFE_METHODS and response.status_code < 400 and request.user.pk:
+            pin(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
 class LoanMixin:
 
     lookup_url_kwarg = 'loan_pk'
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # the packed schedules are read by the payment views only
+        queryset = super().get_queryset().select_related('client').defer('packed_schedule')
         if not self.request.user.is_staff:
             return queryset.filter(client=self.request.user)
         return queryset
@@ -27,3 +71,73 @@ class PaymentMixin:
         if not self.request.user.is_staff:
             return queryset.filter(client=self.request.user)
         return queryset
+
+
+class ConditionalGetMixin:
+    """
+    Conditional GET, the `ETag` and `Last-Modified` validators are computed
+    by `get_validators` after the authentication and permission checks. A
+    request with a matching `If-None-Match` or `If-Modified-Since` gets a
+    304 without fetching or serializing the rows.
+    """
+
+    def get_validators(self):
+        """
+        etag and last modified datetime of the response
+        """
+        raise NotImplementedError('`get_validators()` must be implemented.')
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        last_modified = last_modified and timegm(last_modified.utctimetuple())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ExportMixin:
+    """
+    Streams the filtered queryset rows as csv (`?format=csv`) or newline
+    delimited json (`?format=ndjson`), reading them from the database in
+    chunks so memory stays flat regardless of the result size.
+    """
+
+    renderer_classes = [CSVRenderer, NDJSONRenderer]
+    pagination_class = None
+
+    # Rows fetched from the database at a time.
+    export_chunk_size = 2000
+
+    # Exported columns, all the model concrete fields by default but the
+    # binary ones, eg the packed loan schedules.
+    export_fields = None
+
+    export_filename = 'export'
+
+    def get_export_fields(self, queryset):
+        return self.export_fields or [
+            field.attname for field in queryset.model._meta.concrete_fields
+            if not isinstance(field, models.BinaryField)]
+
+    def get_export_rows(self, queryset, fields):
+        return queryset.values_list(*fields).iterator(chunk_size=self.export_chunk_size)
+
+    def get(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        fields = self.get_export_fields(queryset)
+        # the rows are streamed after the view returns, binds the database
+        # it would read now
+        rows = self.get_export_rows(queryset.using(queryset.db), fields)
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(fields, rows), content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="{self.export_filename}.{renderer.format}"'
+        return response
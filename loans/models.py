@@ -1,38 +1,492 @@
 # python
+import operator
 import uuid
+from bisect import bisect_right
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date
+from datetime import datetime
 from decimal import Decimal
+from functools import reduce
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
 
 # django
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
+from django.db import connections
 from django.db import models
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import F
+from django.db.models import Max
+from django.db.models import OuterRef
 from django.db.models import Q
+from django.db.models import Subquery
 from django.db.models import Sum
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.db.models.functions import TruncMonth
 from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.db.models.sql.where import WhereNode
 from django.dispatch import receiver
+from django.utils.functional import cached_property
+from django.utils.timezone import get_default_timezone
+from django.utils.timezone import localtime
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
 # third party
-from dateutil.relativedelta import relativedelta
+from django_extensions.db.fields import ModificationDateTimeField
 from django_extensions.db.models import TimeStampedModel
+import numpy as np
 
 # local
 from .constants import AWAITING_PAYMENT
+from .constants import DUE
 # from .constants import IN_ANALYSIS
 from .constants import LOAN_FINANCING_CHOICES
 # from .constants import LOAN_STATUS_CHOICES
+from .constants import LOAN_STORAGE_CHOICES
+from .constants import PACKED_STORAGE
 from .constants import PAID
 from .constants import PAYMENT_STATUS_CHOICES
 from .constants import PRICE_SYSTEM
-from .constants import SAC_SYSTEM
-from .utils import make_amortization
-from .utils import make_amount_due
-from .utils import make_installment
+from .constants import ROW_STORAGE
+from .utils import PackedSchedule
+from .utils import Schedule
+from .utils import make_due_dates
+from .utils import make_schedule
+
+
+# payment fields the payment summary is grouped or summed by
+SUMMARY_FIELDS = {'loan', 'status', 'due_date', 'value', 'interest_amount', 'amortization'}
+
+# the packed payment ids are the loan id mixed with `PACKED_ID_MASK`, so they
+# differ from it, with the low `PACKED_ID_BITS` replaced by the installment
+PACKED_ID_BITS = 16
+PACKED_ID_MASK = uuid.UUID('5d1e0c3a-8f27-0b41-0c93-b94e61a70000').int
+
+# summary deltas of the `PaymentSummary.objects.batch` block being run,
+# upserted together when it ends
+summary_batch = ContextVar('summary_batch', default=None)
+
+
+def get_filtered_fields(where: WhereNode) -> Optional[Set[str]]:
+    """
+    names of the payment fields `where` filters on, `None` when it filters
+    on anything else, eg related fields or expressions
+    """
+    fields = set()
+    for child in where.children:
+        if isinstance(child, WhereNode):
+            child_fields = get_filtered_fields(child)
+            if child_fields is None:
+                return None
+            fields |= child_fields
+            continue
+
+        target = getattr(getattr(child, 'lhs', None), 'target', None)
+        if target is None or target.model is not Payment:
+            return None
+        fields.add(target.name)
+    return fields
+
+
+def make_month(at: datetime) -> date:
+    """
+    first day of the month of `at` in the default timezone, like the
+    `TruncMonth` of `PaymentQuerySet.summarize`
+    """
+    if not isinstance(at, datetime):
+        return at.replace(day=1)
+    return localtime(at, get_default_timezone()).date().replace(day=1)
+
+
+def summarize_payments(payments: Iterable['Payment']) -> List[dict]:
+    """
+    `PaymentQuerySet.summarize` rows of unsaved payments with their loan
+    set, without querying
+    """
+    rows = {}
+    for payment in payments:
+        key = (make_month(payment.due_date), payment.status, payment.loan.financing)
+        row = rows.setdefault(key, {
+            'month': key[0], 'status': key[1], 'financing': key[2],
+            'count': 0, 'value': 0, 'interest_amount': 0, 'amortization': 0})
+        row['count'] += 1
+        for field in ('value', 'interest_amount', 'amortization'):
+            row[field] += Decimal(str(getattr(payment, field))).quantize(Decimal('0.01'))
+    return list(rows.values())
+
+
+def make_month_numbers(due_dates: Sequence[datetime]) -> np.ndarray:
+    """
+    `make_month` of the `make_due_dates` dates as year * 12 + month - 1,
+    only the ones in the first or last days of their month can be in
+    another one in the default timezone
+    """
+    if due_dates and 1 < due_dates[0].day < 28:
+        # then every due date is on that same day
+        return due_dates[0].year * 12 + due_dates[0].month - 1 + np.arange(len(due_dates))
+    return np.array([month.year * 12 + month.month - 1 for month in map(make_month, due_dates)], dtype=np.int64)
+
+
+def summarize_schedules(schedules: Iterable[Tuple[int, Schedule, Sequence[datetime], int, Optional[int]]]
+                        ) -> List[dict]:
+    """
+    `summarize_payments` rows of the installments from `start` until `stop`
+    of the `(financing, schedule, due_dates, start, stop)` schedules,
+    awaiting payment, without making their payments
+    """
+    keys = []
+    amounts = []
+    for financing, schedule, due_dates, start, stop in schedules:
+        keys.append(make_month_numbers(due_dates[start:stop]) * 10 + financing)
+        amounts.append(np.rint(np.stack(schedule[:3])[:, start:stop] * 100).astype(np.int64))
+    if not keys:
+        return []
+
+    keys, inverse, counts = np.unique(np.concatenate(keys), return_inverse=True, return_counts=True)
+    amounts = np.concatenate(amounts, axis=1)
+    totals = np.zeros((3, len(keys)), dtype=np.int64)
+    for total, amount in zip(totals, amounts):
+        np.add.at(total, inverse, amount)
+
+    return [
+        {'month': date(key // 120, key // 10 % 12 + 1, 1), 'status': AWAITING_PAYMENT, 'financing': key % 10,
+         'count': count, 'value': Decimal(value).scaleb(-2), 'interest_amount': Decimal(interest_amount).scaleb(-2),
+         'amortization': Decimal(amortization).scaleb(-2)}
+        for key, count, value, interest_amount, amortization in zip(
+            keys.tolist(), counts.tolist(), *totals.tolist())]
+
+
+def get_packed_loan_range(payment_id: uuid.UUID) -> Tuple[uuid.UUID, uuid.UUID]:
+    """
+    bounds of the id of the loan a packed payment id may belong to, see
+    `Loan.get_packed_payment_id`
+    """
+    base = (payment_id.int ^ PACKED_ID_MASK) >> PACKED_ID_BITS << PACKED_ID_BITS
+    return uuid.UUID(int=base), uuid.UUID(int=base | (1 << PACKED_ID_BITS) - 1)
+
+
+def make_paid_total() -> Coalesce:
+    """
+    sum of the loan paid payments, as a subquery expression over loans
+    """
+    paid = Payment.objects.filter(loan=OuterRef('pk'), status=PAID).order_by().values('loan')
+    return Coalesce(
+        Subquery(paid.annotate(total=Sum('value')).values('total')),
+        Value(Decimal('0.00')), output_field=models.DecimalField())
+
+
+class LoanQuerySet(models.QuerySet):
+
+    def delete(self):
+        """
+        deletes the loans with one payment summary upsert for all of them,
+        see `loan_pre_delete`
+        """
+        with transaction.atomic(using=self.db, savepoint=False), PaymentSummary.objects.batch():
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def with_wrong_balances(self):
+        """
+        row storage loans whose paid total or balance due differ from their
+        paid payments
+        """
+        return self.filter(storage=ROW_STORAGE).annotate(paid=make_paid_total()).filter(
+            ~Q(paid_total=F('paid')) | ~Q(balance_due=F('amount_due') - F('paid')) | Q(balance_due__isnull=True))
+
+    def update_balances(self, packed: bool = True) -> int:
+        """
+        rebuild paid total and balance due from the paid payments, or the
+        packed schedule, only of the loans where they differ so the others
+        keep their `modified`. `packed=False` skips the packed loans, eg for
+        the loans of stored payments
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            paid_total = make_paid_total()
+            updated = self.filter(pk__in=self.with_wrong_balances().values('pk')).update(
+                paid_total=paid_total, balance_due=F('amount_due') - paid_total, modified=now())
+
+            loans = self.filter(storage=PACKED_STORAGE).select_for_update().only(
+                'amount_due', 'paid_total', 'balance_due', 'packed_schedule')
+            for loan in loans if packed else ():
+                paid_total = loan.packed.get_paid_total() if loan.packed else Decimal('0.00')
+                if loan.paid_total != paid_total or loan.balance_due != loan.amount_due - paid_total:
+                    updated += Loan.objects.filter(pk=loan.pk).update(
+                        paid_total=paid_total, balance_due=F('amount_due') - paid_total, modified=now())
+        return updated
+
+    def update_paid_total(self, paid: Decimal) -> int:
+        """
+        add paid value to paid total and discount it from balance due
+        """
+        return self.update(
+            paid_total=F('paid_total') + paid, balance_due=F('balance_due') - paid, modified=now())
+
+    def packed_payments(self) -> Iterator['Payment']:
+        """
+        unsaved payments of the packed installments of the loans, fetched
+        one chunk of loans at a time
+        """
+        for loan in self.filter(storage=PACKED_STORAGE).iterator():
+            yield from loan.make_packed_payments()
+
+    def projected_schedules(self) -> Iterator[Tuple['Loan', Schedule, List[datetime]]]:
+        """
+        schedule and due dates of the windowed loans with installments not
+        stored yet, the loans are fetched with their stored installments
+        (`stored`) in one query
+        """
+        loans = self.filter(schedule_window__isnull=False).annotate(
+            stored=Coalesce(Max('payment__installment'), 0)).filter(stored__lt=F('period'))
+        for loan in loans.defer('packed_schedule').iterator():
+            schedule = make_schedule(loan.financing, loan.value, loan.interest_rate, loan.period)
+            yield loan, schedule, make_due_dates(loan.created, loan.period)
+
+    def summarize_projected(self) -> List[dict]:
+        """
+        `summarize_payments` rows of the installments the windowed loans have
+        not stored yet, without making their payments
+        """
+        return summarize_schedules(
+            (loan.financing, schedule, due_dates, loan.stored, None)
+            for loan, schedule, due_dates in self.projected_schedules())
+
+    def packed_payment_values(self, fields: Sequence[str], **filters) -> Iterator[tuple]:
+        """
+        `values_list(*fields)` of the packed installments of the loans
+        matching the payment field `filters`, in installment order by loan
+        """
+        names = [Payment._meta.get_field(field).name for field in fields]
+        for loan in self.filter(storage=PACKED_STORAGE).iterator():
+            for row in loan.get_packed_payments():
+                if all(row[name] == value for name, value in filters.items()):
+                    yield tuple(row[name] for name in names)
+
+    def packed_overdue(self, at: datetime, since: Optional[datetime] = None) -> dict:
+        """
+        `PaymentQuerySet.overdue` of the packed installments of the loans,
+        the ones due from `since` if set
+        """
+        count = 0
+        total = Decimal('0.00')
+        for loan in self.filter(storage=PACKED_STORAGE, balance_due__gt=0).only(
+                'created', 'packed_schedule').iterator():
+            indexes = [index for status in (AWAITING_PAYMENT, DUE)
+                       for index in loan.packed.get_due_before(loan.created, at, status, since)]
+            count += len(indexes)
+            total += loan.packed.get_value_total(indexes)
+        return {'count': count, 'total': total}
+
+    def filter_packed_payments(self, payment_ids: Iterable[uuid.UUID]) -> 'LoanQuerySet':
+        """
+        the packed loans the `payment_ids` may belong to, one index range
+        per loan
+        """
+        ranges = {get_packed_loan_range(payment_id) for payment_id in payment_ids}
+        return self.filter(storage=PACKED_STORAGE).filter(
+            reduce(operator.or_, (Q(pk__range=bounds) for bounds in ranges), Q(pk__in=[])))
+
+
+class PaymentQuerySet(models.QuerySet):
+
+    def summarize(self):
+        """
+        payment count and totals grouped by due month, status and loan
+        financing, the rows of the payment summary
+        """
+        month = TruncMonth('due_date', tzinfo=get_default_timezone())
+        return self.order_by().annotate(month=month).values(
+            'month', 'status', financing=F('loan__financing')).annotate(
+            count=Count('pk'),
+            value=Sum('value'),
+            interest_amount=Sum('interest_amount'),
+            amortization=Sum('amortization'))
+
+    def overdue(self, at: datetime) -> dict:
+        """
+        count and total of the payments awaiting payment or due before `at`
+        """
+        return self.filter(due_date__lt=at, status__in=[AWAITING_PAYMENT, DUE]).aggregate(
+            count=Count('pk'), total=Coalesce(Sum('value'), Value(Decimal('0.00'))))
+
+    def bulk_create(self, objs, *args, summarize: bool = True, **kwargs):
+        """
+        adds the created payments to the payment summary, in the caller
+        transaction when there is one, unless they are already in it
+        (`summarize=False`), eg the installments of a schedule window
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            if not summarize:
+                return objs
+
+            # with conflicts ignored only the stored ones are summarized
+            if kwargs.get('ignore_conflicts') or not all(Payment.loan.is_cached(obj) for obj in objs):
+                rows = Payment.objects.filter(pk__in=[obj.pk for obj in objs]).summarize()
+            else:
+                rows = summarize_payments(objs)
+            PaymentSummary.objects.add(rows)
+        return objs
+
+    def delete(self):
+        """
+        removes the payments from the payment summary and the balances of
+        their loans, the loan deletions cascade without it, see
+        `loan_pre_delete`
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            loans = set(self.filter(status=PAID).order_by().values_list('loan', flat=True).distinct())
+            with PaymentSummary.objects.track(self):
+                deleted = super().delete()
+            Loan.objects.filter(pk__in=loans).update_balances(packed=False)
+        return deleted
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def update(self, **kwargs) -> int:
+        """
+        keeps the balances of the affected loans when paid values may
+        change, and the payment summary
+        """
+        if not SUMMARY_FIELDS & set(kwargs):
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            # the updated rows are summarized again by the same filter, unless
+            # the update changes what it matches, eg a `status` filter
+            filtered = get_filtered_fields(self.query.where)
+            payments = self
+            if filtered is None or filtered & set(kwargs):
+                payments = Payment.objects.filter(pk__in=list(self.values_list('pk', flat=True)))
+            with PaymentSummary.objects.track(payments):
+                return self._update_with_balances(**kwargs)
+
+    def _update_with_balances(self, **kwargs) -> int:
+        if not {'loan', 'status', 'value'} & set(kwargs):
+            return super().update(**kwargs)
+
+        # only the paid rows count when they can't become paid, expressions
+        # like the bulk_update cases may set any status
+        affected = self
+        status = kwargs.get('status')
+        if not {'loan', 'value'} & set(kwargs) and isinstance(status, int) and status != PAID:
+            affected = self.filter(status=PAID)
+
+        loans = set(affected.order_by().values_list('loan', flat=True).distinct())
+        if 'loan' in kwargs:
+            loans.add(getattr(kwargs['loan'], 'pk', kwargs['loan']))
+
+        rows = super().update(**kwargs)
+        Loan.objects.filter(pk__in=loans).update_balances(packed=False)
+        return rows
+
+
+class PaymentSummaryQuerySet(models.QuerySet):
+
+    def add(self, added: Iterable[dict], removed: Iterable[dict] = ()):
+        """
+        adds the `summarize` rows of `added` to the summary and subtracts
+        the ones of `removed`, with one upsert, or with the others of the
+        `batch` block being run
+        """
+        batched = summary_batch.get()
+        deltas = {} if batched is None else batched
+        for sign, rows in ((1, added), (-1, removed)):
+            for row in rows:
+                month = row['month'].date() if isinstance(row['month'], datetime) else row['month']
+                delta = deltas.setdefault((month, row['financing'], row['status']), [0, 0, 0, 0])
+                for index, field in enumerate(('count', 'value', 'interest_amount', 'amortization')):
+                    delta[index] += sign * row[field]
+        if batched is None:
+            self._upsert(deltas)
+
+    def _upsert(self, deltas: dict):
+        # sorted, concurrent upserts lock the rows in the same order
+        values = [(*key, *delta) for key, delta in sorted(deltas.items()) if any(delta)]
+        if not values:
+            return
+
+        table = self.model._meta.db_table
+        placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(values))
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (month, financing, status, count, value, interest_amount, amortization) '
+                f'VALUES {placeholders} ON CONFLICT (month, financing, status) DO UPDATE SET '
+                f'count = {table}.count + EXCLUDED.count, '
+                f'value = {table}.value + EXCLUDED.value, '
+                f'interest_amount = {table}.interest_amount + EXCLUDED.interest_amount, '
+                f'amortization = {table}.amortization + EXCLUDED.amortization',
+                [item for row in values for item in row])
+
+    @contextmanager
+    def batch(self):
+        """
+        applies the `add` calls of the block together when it ends, with
+        one upsert, instead of updating the same rows once per call
+        """
+        if summary_batch.get() is not None:
+            yield
+            return
+
+        deltas = {}
+        token = summary_batch.set(deltas)
+        try:
+            yield
+        finally:
+            summary_batch.reset(token)
+        self._upsert(deltas)
+
+    @contextmanager
+    def track(self, payments: PaymentQuerySet):
+        """
+        applies the changes the block makes to `payments` to the summary,
+        they are summarized before and after it
+        """
+        before = list(payments.summarize())
+        yield
+        self.add(payments.summarize(), before)
+
+    def rebuild(self) -> int:
+        """
+        replaces the summary with the one of the stored payments, the
+        packed installments and the ones the windowed loans have not stored
+        """
+        with transaction.atomic(using=self.db):
+            # waits for the transactions updating the summary, and blocks the
+            # new ones until the payments are summarized again
+            with connections[self.db].cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {self.model._meta.db_table} IN EXCLUSIVE MODE')
+
+            self.all().delete()
+            self.add(Payment.objects.summarize())
+            self.add(summarize_payments(Loan.objects.packed_payments()))
+            self.add(Loan.objects.summarize_projected())
+            return self.count()
 
 
 class Loan(TimeStampedModel):
 
+    # set when the loan is instantiated instead of inserted, the due dates
+    # are counted from it before the insert, see `services.create_loans`
+    created = models.DateTimeField(
+        _('created'), default=now, editable=False, blank=True)
+    # after `created`, like in `TimeStampedModel`
+    modified = ModificationDateTimeField(_('modified'))
+
     id = models.UUIDField(
         primary_key=True, default=uuid.uuid4, editable=False)
 
@@ -63,24 +517,204 @@ class Loan(TimeStampedModel):
     financing = models.PositiveIntegerField(
         _('Tipo de Financiamento'), choices=LOAN_FINANCING_CHOICES, default=PRICE_SYSTEM)
 
+    # installments stored ahead of the current date, `None` stores the whole
+    # schedule at creation. Later installments are materialized as the window
+    # advances, see `advance_schedule`
+    schedule_window = models.PositiveIntegerField(
+        _('Janela de Parcelas'), null=True, blank=True,
+        validators=[MinValueValidator(1)])
+
+    # packed loans keep their installments in `packed_schedule` instead of
+    # payment rows, read through `packed` and presented as the payments
+    storage = models.PositiveIntegerField(
+        _('Armazenamento das Parcelas'), choices=LOAN_STORAGE_CHOICES, default=ROW_STORAGE)
+
+    packed_schedule = models.BinaryField(
+        _('Parcelas Compactadas'), null=True, editable=False)
+
+    # denormalized from the paid payments, see `Payment.save`. Updating them
+    # touches `modified` too, it validates the conditional loan requests
+    paid_total = models.DecimalField(
+        _('Total Pago'), decimal_places=2, max_digits=18, default=Decimal('0.00'), editable=False)
+
+    balance_due = models.DecimalField(
+        _('Saldo Devedor'), decimal_places=2, max_digits=18, null=True, editable=False)
+
+    objects = LoanQuerySet.as_manager()
+
     # status = models.PositiveIntegerField(
     #     _('status'), choices=LOAN_STATUS_CHOICES, default=IN_ANALYSIS)
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # client loan list and keyset pagination
+            models.Index(fields=['client', '-created', '-id'], name='loan_client_created_idx'),
+            # admin loan list and keyset pagination
+            models.Index(fields=['-created', '-id'], name='loan_created_idx')
+        ]
 
     def __str__(self):
         return f'{self.bank} - {self.get_financing_display()}'
 
     def make_balance_due(self) -> float:
         """
-        calculate balance due
+        calculate balance due from the payments, the denormalized
+        `balance_due` field is kept equal to it
         """
+        if self.storage == PACKED_STORAGE:
+            return self.amount_due - self.packed.get_paid_total()
+
         paid = self.payment_set.aggregate(paid=Sum('value', filter=Q(status=PAID))).get('paid')
         if paid:
             return self.amount_due - paid
         return self.amount_due
 
+    def make_payments(self, schedule: Schedule, due_dates: List[datetime], start: int = 0,
+                      stop: Optional[int] = None) -> List['Payment']:
+        """
+        unsaved payments of the schedule installments from `start` until
+        `stop`, all by default
+        """
+        window = slice(start, stop)
+        return [
+            Payment(
+                client_id=self.client_id,
+                loan=self,
+                value=installment,
+                due_date=due_date,
+                interest_amount=interest_amount,
+                amortization=amortization,
+                installment=number)
+            for number, (installment, interest_amount, amortization, due_date) in enumerate(zip(
+                schedule.installments[window].tolist(), schedule.interest_amounts[window].tolist(),
+                schedule.amortizations[window].tolist(), due_dates[window]), start=start + 1)]
+
+    def make_schedule_payments(self, start: int = 0, stop: Optional[int] = None) -> List['Payment']:
+        """
+        unsaved payments of the installments from `start` until `stop`,
+        generated from the loan terms with the due dates counted from its
+        creation, so they are the same whenever they are materialized
+        """
+        schedule = make_schedule(self.financing, self.value, self.interest_rate, self.period)
+        due_dates = make_due_dates(self.created, self.period)
+        return self.make_payments(schedule, due_dates, start, stop)
+
+    def get_stored_installments(self) -> int:
+        return self.payment_set.aggregate(stored=Max('installment')).get('stored') or 0
+
+    def get_window_end(self, at: Optional[datetime] = None) -> int:
+        """
+        installments that should be stored at `at` (now by default), the
+        ones already due plus the next `schedule_window`
+        """
+        if not self.schedule_window:
+            return self.period
+        due = bisect_right(make_due_dates(self.created, self.period), at or now())
+        return min(self.period, due + self.schedule_window)
+
+    def advance_schedule(self, at: Optional[datetime] = None) -> int:
+        """
+        materialize the installments entering the schedule window at `at`,
+        returns how many were stored
+        """
+        stored = self.get_stored_installments()
+        window_end = self.get_window_end(at)
+        if stored >= window_end:
+            return 0
+
+        # concurrent requests materialize the same installments, the unique
+        # loan installment constraint keeps only one of them. The summary
+        # has them since the loan creation, see `loan_post_save`
+        payments = Payment.objects.bulk_create(
+            self.make_schedule_payments(stored, window_end), ignore_conflicts=True, summarize=False)
+        return len(payments)
+
+    @cached_property
+    def packed(self) -> Optional[PackedSchedule]:
+        """
+        the packed installments, decoded as they are read
+        """
+        if self.packed_schedule is None:
+            return None
+        return PackedSchedule(self.packed_schedule)
+
+    def get_packed_payment_id(self, installment: int) -> uuid.UUID:
+        """
+        payment id of a packed installment, the same every time, the
+        installment is decoded back by `get_packed_index`
+        """
+        loan_id = uuid.UUID(str(self.pk)).int ^ PACKED_ID_MASK
+        return uuid.UUID(int=loan_id >> PACKED_ID_BITS << PACKED_ID_BITS | installment)
+
+    def get_packed_index(self, payment_id) -> Optional[int]:
+        """
+        index of the packed installment with `payment_id`, if any
+        """
+        try:
+            payment_id = uuid.UUID(str(payment_id))
+        except ValueError:
+            return None
+        installment = payment_id.int & (1 << PACKED_ID_BITS) - 1
+        if not 0 < installment <= len(self.packed) or self.get_packed_payment_id(installment) != payment_id:
+            return None
+        return installment - 1
+
+    def get_packed_payments(self, indexes: Optional[Sequence[int]] = None) -> List[dict]:
+        """
+        `PaymentListSerializer` rows of the packed installments at
+        `indexes`, all by default, with the fields of the stored payments
+        """
+        rows = self.packed.get_rows(self.created, indexes)
+        for row in rows:
+            row.update(
+                id=self.get_packed_payment_id(row['installment']), created=self.created, client=self.client_id,
+                loan=self.pk)
+        return rows
+
+    def make_packed_payments(self, indexes: Optional[Sequence[int]] = None) -> List['Payment']:
+        """
+        unsaved payments of the packed installments at `indexes`, all by
+        default
+        """
+        return [
+            Payment(loan=self, **{'client_id' if field == 'client' else field: value
+                                  for field, value in row.items() if field != 'loan'})
+            for row in self.get_packed_payments(indexes)]
+
+    def update_packed(self, indexes: Sequence[int], **fields) -> int:
+        """
+        set the `status` and `pay_date` of the packed installments at
+        `indexes`, together with the balances, the loan must be locked
+        (`select_for_update`) in the current transaction. The payment
+        summary is updated too.
+        """
+        if not len(indexes):
+            return 0
+
+        before = summarize_payments(self.make_packed_payments(indexes))
+        packed = self.packed.replace(indexes, modified=now(), **fields)
+        paid_total = packed.get_paid_total()
+
+        Loan.objects.filter(pk=self.pk).update(
+            packed_schedule=packed.data, paid_total=paid_total, balance_due=F('amount_due') - paid_total,
+            modified=now())
+        self.packed_schedule = packed.data
+        self.__dict__.pop('packed', None)
+
+        PaymentSummary.objects.add(summarize_payments(self.make_packed_payments(indexes)), before)
+        return len(indexes)
+
+    def make_projected_payments(self) -> List['Payment']:
+        """
+        unsaved payments of the installments not stored yet, without ids
+        or timestamps
+        """
+        payments = self.make_schedule_payments(self.get_stored_installments())
+        for payment in payments:
+            payment.id = payment.created = payment.modified = None
+        return payments
+
 
 class Payment(TimeStampedModel):
 
@@ -114,64 +748,157 @@ class Payment(TimeStampedModel):
     status = models.PositiveIntegerField(
         _('status'), choices=PAYMENT_STATUS_CHOICES, default=AWAITING_PAYMENT)
 
+    installment = models.PositiveIntegerField(
+        _('Parcela'), null=True, editable=False)
+
+    objects = PaymentQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created']
+        indexes = [
+            # loan payment list and keyset pagination
+            models.Index(fields=['loan', '-created', '-id'], name='payment_loan_created_idx'),
+            # loan payment list validators, see `PaymentListAPIView.get_validators`
+            models.Index(fields=['loan', 'modified'], name='payment_loan_modified_idx'),
+            # paid total of a loan
+            models.Index(fields=['loan'], condition=Q(status=PAID), name='payment_loan_paid_idx'),
+            # open payments by due date, eg to find the overdue ones
+            models.Index(fields=['due_date'], condition=Q(status__in=[AWAITING_PAYMENT, DUE]),
+                         name='payment_open_due_date_idx')
+        ]
+        constraints = [
+            # an installment is materialized once, see `Loan.advance_schedule`
+            models.UniqueConstraint(fields=['loan', 'installment'], name='payment_loan_installment_uniq')
+        ]
 
     def __str__(self):
         return f'R$ {self.value:.2f} - {self.get_status_display()}'
 
+    @property
+    def paid_value(self) -> Decimal:
+        if self.status != PAID:
+            return Decimal('0.00')
+        return self._meta.get_field('value').to_python(self.value)
+
+    def get_stored_paid_value(self, using: Optional[str] = None) -> Decimal:
+        """
+        paid value of the stored row, locked until the end of the
+        transaction so concurrent saves of the payment apply their paid
+        value changes one after the other
+        """
+        if self._state.adding:
+            return Decimal('0.00')
+        stored = Payment.objects.using(using).select_for_update().filter(pk=self.pk).values_list('status', 'value')
+        status, value = next(iter(stored), (None, None))
+        return value if status == PAID else Decimal('0.00')
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using')
+        with transaction.atomic(using=using):
+            stored_paid_value = self.get_stored_paid_value(using)
+            with PaymentSummary.objects.track(Payment.objects.filter(pk=self.pk)):
+                super().save(*args, **kwargs)
+
+            if self.paid_value != stored_paid_value:
+                Loan.objects.filter(pk=self.loan_id).update_paid_total(self.paid_value - stored_paid_value)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using')
+        with transaction.atomic(using=using):
+            stored_paid_value = self.get_stored_paid_value(using)
+            with PaymentSummary.objects.track(Payment.objects.filter(pk=self.pk)):
+                deleted = super().delete(*args, **kwargs)
+
+            if stored_paid_value:
+                Loan.objects.filter(pk=self.loan_id).update_paid_total(-stored_paid_value)
+        return deleted
+
+
+class PaymentSummary(models.Model):
+    """
+    Payment count and totals by due month, loan financing and status, kept
+    up to date by the payment creations, updates and deletions. Rebuilt
+    with the `rebuild_payment_summary` command.
+    """
+
+    month = models.DateField(
+        _('Mês do Vencimento'))
+
+    financing = models.PositiveIntegerField(
+        _('Tipo de Financiamento'), choices=LOAN_FINANCING_CHOICES)
+
+    status = models.PositiveIntegerField(
+        _('status'), choices=PAYMENT_STATUS_CHOICES)
+
+    # may go negative while the summary is out of sync, see `rebuild`
+    count = models.IntegerField(
+        _('Pagamentos'), default=0)
+
+    value = models.DecimalField(
+        _('Valor'), decimal_places=2, max_digits=18, default=Decimal('0.00'))
+
+    interest_amount = models.DecimalField(
+        _('Juros'), decimal_places=2, max_digits=18, default=Decimal('0.00'))
+
+    amortization = models.DecimalField(
+        _('Amortização sobre saldo devedor'), decimal_places=2, max_digits=18, default=Decimal('0.00'))
+
+    objects = PaymentSummaryQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['month', 'financing', 'status']
+        constraints = [
+            models.UniqueConstraint(fields=['month', 'financing', 'status'], name='payment_summary_uniq')
+        ]
+
+    def __str__(self):
+        return f'{self.month:%m/%Y} - {self.get_financing_display()} - {self.get_status_display()}'
+
 
 @receiver(post_save, sender=Loan)
 def loan_post_save(sender, instance, created, **kwargs):
+    # loans saved through the ORM, eg in the admin, `services.create_loans`
+    # computes the same before inserting without sending the signal
     if not created:
         return
 
-    instance.amount_due = make_amount_due(
+    schedule = make_schedule(
         instance.financing, instance.value, instance.interest_rate, instance.period)
-    instance.save(update_fields=['amount_due'])
-
-    value = float(instance.value)
-    interest_rate = float(instance.interest_rate)
-    period = instance.period
-    due_date = now()
-
-    payments_bulk = []
-
-    if instance.financing == PRICE_SYSTEM:
-        installment = make_installment(value, interest_rate, period)
 
-        for p in range(period):
-            due_date += relativedelta(months=1)
-            interest_amount = round(value * interest_rate, 2)
-            amortization = round(installment - interest_amount, 2)
-            value -= amortization
+    instance.amount_due = schedule.amount_due
+    instance.balance_due = instance.amount_due
+    due_dates = make_due_dates(instance.created, instance.period)
 
-            payment = Payment(
-                client=instance.client,
-                loan=instance,
-                value=installment,
-                due_date=due_date,
-                interest_amount=interest_amount,
-                amortization=amortization)
-            payments_bulk.append(payment)
-
-    elif instance.financing == SAC_SYSTEM:
-        amortization = make_amortization(value, period)
+    if instance.storage == PACKED_STORAGE:
+        instance.packed_schedule = PackedSchedule.pack(schedule, instance.created, due_dates).data
+        instance.__dict__.pop('packed', None)
+        instance.save(update_fields=['amount_due', 'balance_due', 'packed_schedule'])
+        PaymentSummary.objects.add(summarize_payments(instance.make_packed_payments()))
+        return
 
-        for p in range(period):
-            due_date += relativedelta(months=1)
-            interest_amount = round(value * interest_rate, 2)
-            installment = amortization + interest_amount
-            value -= amortization
+    instance.save(update_fields=['amount_due', 'balance_due'])
 
-            payment = Payment(
-                client=instance.client,
-                loan=instance,
-                value=installment,
-                due_date=due_date,
-                interest_amount=interest_amount,
-                amortization=amortization)
-            payments_bulk.append(payment)
+    window_end = instance.get_window_end()
+    payments_bulk = instance.make_payments(schedule, due_dates, stop=window_end)
 
     if payments_bulk:
         Payment.objects.bulk_create(payments_bulk)
+    # the installments out of the window are summarized ahead of being stored
+    PaymentSummary.objects.add(summarize_schedules([(instance.financing, schedule, due_dates, window_end, None)]))
+
+
+@receiver(pre_delete, sender=Loan)
+def loan_pre_delete(sender, instance, **kwargs):
+    # every installment of the loan leaves the summary at once, the stored
+    # payments are deleted by the cascade without signals of their own
+    if instance.storage == PACKED_STORAGE:
+        removed = summarize_payments(instance.make_packed_payments()) if instance.packed_schedule else []
+    else:
+        removed = list(instance.payment_set.summarize())
+
+    if instance.schedule_window:
+        schedule = make_schedule(instance.financing, instance.value, instance.interest_rate, instance.period)
+        removed += summarize_schedules([(
+            instance.financing, schedule, make_due_dates(instance.created, instance.period),
+            instance.get_stored_installments(), None)])
+    PaymentSummary.objects.add([], removed)
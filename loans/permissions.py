@@ -7,4 +7,4 @@ class LoanPermission(BasePermission):
     def has_permission(self, request, view):
         if request.user.is_staff:
             return True
-        return view.loan.client == request.user
+        return view.loan.client_id == request.user.pk
@@ -1,13 +1,21 @@
+# django
+from django.utils.translation import gettext_lazy as _
+
 # third party
 from rest_framework import serializers
 
 # project
 from core.constants import DATETIME_FORMAT
 from core.serializers import UserSerializer
+from core.serializers import ValuesSerializer
 
 # local
+from .constants import MAX_PERIOD
+from .constants import PACKED_STORAGE
+from .constants import PAYMENT_STATUS_CHOICES
 from .models import Loan
 from .models import Payment
+from .services import create_loans
 
 
 # Loans
@@ -16,7 +24,50 @@ class LoanCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Loan
-        fields = ['client', 'bank', 'value', 'interest_rate', 'period', 'financing']
+        fields = ['client', 'bank', 'value', 'interest_rate', 'period', 'financing', 'schedule_window', 'storage']
+
+    def validate_period(self, value):
+        if value > MAX_PERIOD:
+            raise serializers.ValidationError(_('O prazo máximo é de %(months)d meses') % {'months': MAX_PERIOD})
+        return value
+
+    def validate(self, data):
+        if data.get('storage') == PACKED_STORAGE and data.get('schedule_window'):
+            raise serializers.ValidationError(
+                {'schedule_window': _('As parcelas compactadas são armazenadas de uma vez, sem janela')})
+        return data
+
+    def create(self, validated_data):
+        return create_loans([Loan(**validated_data)])[0]
+
+
+class LoanImportSerializer(LoanCreateSerializer):
+    """
+    LoanCreateSerializer rules for bulk imports, the clients are checked
+    against the `client_ids` in context instead of a query per row
+    """
+
+    client = serializers.IntegerField()
+
+    class Meta(LoanCreateSerializer.Meta):
+        fields = [*LoanCreateSerializer.Meta.fields, 'ip_address']
+        extra_kwargs = {'ip_address': {'required': False}}
+
+    def validate_client(self, value):
+        if value not in self.context['client_ids']:
+            message = serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist']
+            raise serializers.ValidationError(message.format(pk_value=value))
+        return value
+
+
+class LoanBulkCreateSerializer(LoanImportSerializer):
+    """
+    an item of the loan bulk create, the LoanImportSerializer rules without
+    the `ip_address`, which is the request one
+    """
+
+    class Meta(LoanImportSerializer.Meta):
+        fields = LoanCreateSerializer.Meta.fields
 
 
 class LoanSerializer(serializers.ModelSerializer):
@@ -27,11 +78,12 @@ class LoanSerializer(serializers.ModelSerializer):
     value = serializers.SerializerMethodField()
     amount_due = serializers.SerializerMethodField()
     interest_rate = serializers.SerializerMethodField()
+    paid_total = serializers.SerializerMethodField()
     balance_due = serializers.SerializerMethodField()
 
     class Meta:
         model = Loan
-        fields = '__all__'
+        exclude = ['packed_schedule']
 
     def get_value(self, obj):
         return f'R$ {obj.value:.2f}'
@@ -42,8 +94,41 @@ class LoanSerializer(serializers.ModelSerializer):
     def get_interest_rate(self, obj):
         return f'{100.0 * float(obj.interest_rate):.2f}%'
 
+    def get_paid_total(self, obj):
+        return f'R$ {obj.paid_total:.2f}'
+
     def get_balance_due(self, obj):
-        return f'R$ {obj.make_balance_due():.2f}'
+        return f'R$ {obj.balance_due:.2f}'
+
+
+class LoanListSerializer(ValuesSerializer):
+    """
+    LoanSerializer output built from `.values()` rows, for the loan list
+    """
+
+    client_fields = UserSerializer.Meta.fields
+    values_fields = [
+        'id', 'created', 'modified', *(f'client__{field}' for field in client_fields), 'value', 'amount_due',
+        'interest_rate', 'paid_total', 'balance_due', 'ip_address', 'bank', 'period', 'financing',
+        'schedule_window', 'storage']
+
+    def to_representation(self, row):
+        return {
+            'id': str(row['id']),
+            'created': self.format_datetime(row['created'], DATETIME_FORMAT),
+            'modified': self.format_datetime(row['modified'], DATETIME_FORMAT),
+            'client': {field: row[f'client__{field}'] for field in self.client_fields},
+            'value': f'R$ {row["value"]:.2f}',
+            'amount_due': f'R$ {row["amount_due"]:.2f}',
+            'interest_rate': f'{100.0 * float(row["interest_rate"]):.2f}%',
+            'paid_total': f'R$ {row["paid_total"]:.2f}',
+            'balance_due': f'R$ {row["balance_due"]:.2f}',
+            'ip_address': row['ip_address'],
+            'bank': row['bank'],
+            'period': row['period'],
+            'financing': row['financing'],
+            'schedule_window': row['schedule_window'],
+            'storage': row['storage']}
 
 
 # Payments
@@ -63,8 +148,49 @@ class PaymentSerializer(serializers.ModelSerializer):
         return f'R$ {obj.value:.2f}'
 
 
+class PaymentListSerializer(ValuesSerializer):
+    """
+    PaymentSerializer output built from `.values()` rows, for the payment
+    list
+    """
+
+    values_fields = [
+        'id', 'created', 'modified', 'value', 'status', 'interest_amount', 'amortization', 'due_date',
+        'pay_date', 'installment', 'client', 'loan']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # translated in the language active when serializing
+        self.status_labels = {status: str(label) for status, label in PAYMENT_STATUS_CHOICES}
+
+    def to_representation(self, row):
+        return {
+            'id': str(row['id']),
+            'created': self.format_datetime(row['created'], DATETIME_FORMAT),
+            'modified': self.format_datetime(row['modified'], DATETIME_FORMAT),
+            'value': f'R$ {row["value"]:.2f}',
+            'status': str(self.status_labels.get(row['status'], row['status'])),
+            'interest_amount': f'{row["interest_amount"]:f}',
+            'amortization': f'{row["amortization"]:f}',
+            'due_date': self.format_datetime(row['due_date']),
+            'pay_date': self.format_datetime(row['pay_date']),
+            'installment': row['installment'],
+            'client': row['client'],
+            'loan': row['loan']}
+
+
 class PaymentUpdateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Payment
         fields = ['status']
+
+
+class PaymentBulkUpdateSerializer(serializers.Serializer):
+    """
+    an item of the payment bulk update, `pay_date` is kept when omitted
+    """
+
+    id = serializers.UUIDField()
+    status = serializers.ChoiceField(choices=PAYMENT_STATUS_CHOICES)
+    pay_date = serializers.DateTimeField(required=False, allow_null=True)
@@ -0,0 +1,155 @@
+# python
+import time
+from datetime import datetime
+from itertools import chain
+from typing import Callable
+from typing import List
+from typing import Optional
+
+# django
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Max
+from django.db.models import Q
+from django.utils.timezone import now
+
+# local
+from .constants import AWAITING_PAYMENT
+from .constants import DUE
+from .constants import PACKED_STORAGE
+from .models import Loan
+from .models import Payment
+from .models import PaymentSummary
+from .models import summarize_payments
+from .models import summarize_schedules
+from .utils import PackedSchedule
+from .utils import Schedule
+from .utils import make_due_dates
+from .utils import make_period_groups
+from .utils import make_schedules
+
+
+def create_loans(loans: List[Loan], batch_size: int = 5000) -> List[Loan]:
+    """
+    insert the unsaved `loans` with their amount due and the payments of
+    their schedule window computed beforehand, in one transaction with a
+    single INSERT of the loans and one of the payments per `batch_size`.
+    The packed loans get their installments packed instead of payment rows.
+    The schedules are computed in groups of similar periods, see
+    `make_period_groups`. No `post_save` is sent, unlike `Loan.objects.create`.
+    """
+    if not loans:
+        return loans
+
+    start = now()
+    due_dates = make_due_dates(start, max(loan.period for loan in loans))
+
+    payments = []
+    packed = []
+    projected = []
+    for rows in make_period_groups([loan.period for loan in loans]):
+        group = [loans[row] for row in rows]
+        schedules = make_schedules(
+            [loan.financing for loan in group], [loan.value for loan in group],
+            [loan.interest_rate for loan in group], [loan.period for loan in group])
+
+        for index, loan in enumerate(group):
+            # the due dates are counted from the loan creation, see `Loan.make_schedule_payments`
+            loan.created = loan.modified = start
+            loan.amount_due = loan.balance_due = schedules.amount_due[index].item()
+            schedule = Schedule(*(array[index, :loan.period] for array in schedules[:4]), loan.amount_due)
+            if loan.storage == PACKED_STORAGE:
+                loan.packed_schedule = PackedSchedule.pack(schedule, start, due_dates).data
+                packed += loan.make_packed_payments()
+            else:
+                # none of the installments is due yet, only the schedule window
+                # is stored, the rest is summarized ahead of being stored
+                payments += loan.make_payments(schedule, due_dates, stop=loan.schedule_window)
+                if loan.schedule_window:
+                    projected.append((loan.financing, schedule, due_dates, loan.schedule_window, None))
+
+    with transaction.atomic():
+        Loan.objects.bulk_create(loans)
+        Payment.objects.bulk_create(payments, batch_size=batch_size, summarize=False)
+        PaymentSummary.objects.add([*summarize_payments(chain(payments, packed)), *summarize_schedules(projected)])
+    return loans
+
+
+def mark_overdue_payments(until: Optional[datetime] = None, batch_size: int = 5000, sleep: float = 0,
+                          callback: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    set the payments awaiting payment with due date before `until` (now by
+    default) as due, with one short transaction per batch so the row locks
+    are held briefly. `callback` receives the batch and total updated rows.
+    """
+    until = until or now()
+    total = 0
+    after = Q()
+
+    while True:
+        with transaction.atomic():
+            # walks the partial index of open payments by due date from where
+            # the last batch stopped, past the due ones it already marked.
+            # The rows are locked, so they are still awaiting payment
+            batch = list(Payment.objects.select_for_update().filter(
+                after, status=AWAITING_PAYMENT, due_date__lt=until).order_by('due_date', 'pk').values_list(
+                'due_date', 'pk')[:batch_size])
+            rows = Payment.objects.filter(pk__in=[pk for due_date, pk in batch]).update(status=DUE, modified=now())
+
+        total += rows
+        if callback:
+            callback(rows, total)
+        if len(batch) < batch_size:
+            return total
+
+        due_date, pk = batch[-1]
+        after = Q(due_date__gt=due_date) | Q(due_date=due_date, pk__gt=pk)
+        if sleep:
+            time.sleep(sleep)
+
+
+def mark_overdue_packed_payments(until: Optional[datetime] = None, batch_size: int = 1000,
+                                 callback: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    `mark_overdue_payments` of the packed installments, the loans not paid
+    off are locked and updated in batches. `callback` receives the batch and
+    total updated installments.
+    """
+    until = until or now()
+    total = 0
+    loans = Loan.objects.filter(storage=PACKED_STORAGE, balance_due__gt=0).order_by('pk')
+
+    last_pk = None
+    while True:
+        with transaction.atomic():
+            batch = list((loans.filter(pk__gt=last_pk) if last_pk else loans).select_for_update()[:batch_size])
+            rows = sum(loan.update_packed(loan.packed.get_due_before(loan.created, until), status=DUE)
+                       for loan in batch)
+
+        total += rows
+        if callback:
+            callback(rows, total)
+        if len(batch) < batch_size:
+            return total
+        last_pk = batch[-1].pk
+
+
+def advance_schedules(at: Optional[datetime] = None,
+                      callback: Optional[Callable[[Loan, int], None]] = None) -> int:
+    """
+    materialize the installments entering the schedule window at `at` (now
+    by default) of the loans not fully stored yet. `callback` receives each
+    loan and its stored installments.
+    """
+    at = at or now()
+    total = 0
+
+    loans = Loan.objects.filter(schedule_window__isnull=False).annotate(
+        stored=Max('payment__installment')).exclude(stored__gte=F('period'))
+
+    for loan in loans.iterator():
+        rows = loan.advance_schedule(at)
+        total += rows
+        if callback and rows:
+            callback(loan, rows)
+    return total
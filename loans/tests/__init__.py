@@ -1,24 +1,71 @@
 # python
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
 from model_bakery import baker
 
 # django
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
 from django.forms.models import model_to_dict
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
 from django.urls import reverse
+from django.utils.timezone import now
 
 # third party
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 
 # project
+from core import metrics
+from core.authentication import CachedJWTAuthentication
+from core.authentication import principal_cache
 from core.constants import DATETIME_FORMAT
+from core.middleware import MetricsMiddleware
+from core.pagination import PageNumberPagination
+from core.routers import ReplicaRouter
+from core.routers import make_pins
+from core.routers import pins
 from core.serializers import UserSerializer
 
 # local
 from loans.models import Loan
 from loans.models import Payment
+from loans.models import PaymentSummary
+from loans.models import summarize_payments
+from loans.models import summarize_schedules
+from loans.serializers import LoanSerializer
+from loans.serializers import PaymentSerializer
+from loans.services import create_loans
+from loans.services import mark_overdue_packed_payments
+from loans.utils import make_amount_due
+from loans.utils import make_due_dates
+from loans.utils import make_schedule
+from loans.constants import AWAITING_PAYMENT
+from loans.constants import DUE
+from loans.constants import MAX_PERIOD
+from loans.constants import PACKED_STORAGE
+from loans.constants import PAID
 from loans.constants import PRICE_SYSTEM
 from loans.constants import SAC_SYSTEM
 from .utils import utc_to_local
@@ -117,7 +164,30 @@ class TestLoanCreateAPIView(BaseAPITestCase):
 
         loan = Loan.objects.get()
         self.assertEqual(loan.ip_address, '192.168.0.10')
-        self.assertEqual(loan.amount_due, Decimal('23764.48'))
+        self.assertEqual(loan.amount_due, Decimal('23764.45'))
+        self.assertEqual(loan.balance_due, loan.amount_due)
+
+    def test_create_loan_statements(self):
+        data = {'client': self.user.id, 'bank': 'testbank', 'value': 20000.00, 'interest_rate': 0.04,
+                'period': 8, 'financing': PRICE_SYSTEM}
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.get_url(), data, **self.admin_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        writes = [query['sql'].split(' (')[0] for query in context.captured_queries
+                  if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(writes, [
+            'INSERT INTO "loans_loan"', 'INSERT INTO "loans_payment"', 'INSERT INTO loans_paymentsummary'])
+
+        # the same loan and payments as the ones created by the ORM
+        created = Loan.objects.create(**{**data, 'client': self.user})
+        created.refresh_from_db()
+        loan = Loan.objects.exclude(pk=created.pk).get()
+        self.assertEqual(loan.amount_due, created.amount_due)
+        fields = ['installment', 'value', 'interest_amount', 'amortization']
+        self.assertEqual(list(loan.payment_set.order_by('installment').values_list(*fields)),
+                         list(created.payment_set.order_by('installment').values_list(*fields)))
 
     def test_create_loan_with_empty_data(self):
         reponse_error = {
@@ -157,6 +227,75 @@ class TestLoanCreateAPIView(BaseAPITestCase):
         self.assertEqual(Payment.objects.count(), 0)
 
 
+class TestLoanBulkCreateAPIView(BaseAPITestCase):
+
+    url = reverse('loans:bulk-create')
+
+    def make_item(self, **data):
+        return {'client': self.user.id, 'bank': 'testbank', 'value': '20000.00', 'interest_rate': '0.04',
+                'period': 8, 'financing': PRICE_SYSTEM, **data}
+
+    def test_bulk_create_by_client(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        response = self.client.post(self.url, {'loans': [self.make_item()]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(Loan.objects.count(), 0)
+
+    def test_bulk_create(self):
+        items = [
+            self.make_item(),
+            self.make_item(client=self.admin.id, value='120000.00', interest_rate='0.05', period=10,
+                           financing=SAC_SYSTEM, schedule_window=3),
+            self.make_item(client=10 ** 6, value='0.00')]
+
+        with self.assertNumQueries(7):
+            response = self.client.post(self.url, {'loans': items}, format='json', **self.admin_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(data['results'][2], {'errors': {
+            'client': ['Pk inválido "1000000" - objeto não existe.'],
+            'value': ['Certifque-se de que este valor seja maior ou igual a 0.01.']}})
+
+        price = Loan.objects.get(pk=data['results'][0]['id'])
+        sac = Loan.objects.get(pk=data['results'][1]['id'])
+        self.assertEqual(price.ip_address, '192.168.0.10')
+        self.assertEqual((price.amount_due, price.balance_due), (Decimal('23764.45'), Decimal('23764.45')))
+        self.assertEqual(sac.amount_due, Decimal('153000.00'))
+        self.assertEqual(price.payment_set.count(), 8)
+        self.assertEqual(sac.payment_set.count(), 3)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_bulk_create_with_mixed_periods(self):
+        items = [self.make_item(period=8), self.make_item(value='350000.00', interest_rate='0.01', period=360),
+                 self.make_item(period=MAX_PERIOD + 1)]
+
+        response = self.client.post(self.url, {'loans': items}, format='json', **self.admin_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.json()
+        self.assertEqual(data['created'], 2)
+        self.assertEqual(data['results'][2], {'errors': {'period': ['O prazo máximo é de 600 meses']}})
+
+        # the schedules of each period group are the single loan ones
+        for result, period in zip(data['results'], (8, 360)):
+            loan = Loan.objects.get(pk=result['id'])
+            amount_due = make_amount_due(PRICE_SYSTEM, loan.value, loan.interest_rate, period)
+            self.assertEqual(float(loan.amount_due), amount_due)
+            self.assertEqual(loan.payment_set.count(), period)
+
+    def test_bulk_create_with_wrong_list(self):
+        for loans in ([], {}, [self.make_item()] * 1001):
+            response = self.client.post(self.url, {'loans': loans}, format='json')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.json(), {'loans': 'Deve ser uma lista com 1 a 1000 empréstimos'})
+        self.assertEqual(Loan.objects.count(), 0)
+
+
 class TestLoanListAPIView(BaseLoanAPITestCase):
 
     def get_url(self):
@@ -184,6 +323,87 @@ class TestLoanListAPIView(BaseLoanAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json().get('results')), 2)
 
+    def test_list_loan_queries_dont_grow_with_page_size(self):
+        for p in range(PageNumberPagination.max_page_size):
+            Loan.objects.create(client=baker.make(User), bank='testbank', value=1000.00,
+                                interest_rate=0.01, period=1, financing=PRICE_SYSTEM)
+
+        # caches the user
+        self.client.get(self.get_url())
+
+        queries = set()
+        for page_size in (1, 10, PageNumberPagination.max_page_size):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.get_url(), {'page_size': page_size})
+
+            self.assertEqual(len(response.json().get('results')), page_size)
+            queries.add(len(context))
+
+        self.assertEqual(len(queries), 1)
+
+    def test_list_loan_same_output_as_loan_serializer(self):
+        self.loan_price.payment_set.update(status=PAID, pay_date=now())
+        loans = Loan.objects.order_by('-created')
+
+        response = self.client.get(self.get_url())
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(JSONRenderer().render(response.data['results']),
+                         JSONRenderer().render(LoanSerializer(loans, many=True).data))
+
+    def test_list_loan_search(self):
+        self.loan_sac.client.username = 'maria.souza'
+        self.loan_sac.client.save()
+        ranked = Loan.objects.create(client=baker.make(User, username='brasileiro'), bank='Brasil', value=1000.00,
+                                     interest_rate=0.01, period=1, financing=PRICE_SYSTEM)
+        loan = Loan.objects.create(client=self.loan_sac.client, bank='Banco do Brasil', value=1000.00,
+                                   interest_rate=0.01, period=1, financing=PRICE_SYSTEM)
+
+        def search(term, **params):
+            response = self.client.get(self.get_url(), {'search': term, **params})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [item['id'] for item in response.json()['results']]
+
+        # ranked, the loan matching on both fields first
+        self.assertEqual(search('bras'), [str(ranked.id), str(loan.id)])
+        self.assertEqual(search('testb'), [str(self.loan_sac.id), str(self.loan_price.id)])
+        self.assertEqual(search('mar'), [str(loan.id), str(self.loan_sac.id)])
+        self.assertEqual(search('maria.souza testbank'), [str(self.loan_sac.id)])
+        self.assertEqual(search("o'brien"), [])
+        # words are matched from their start
+        self.assertEqual(search('rasil'), [])
+        self.assertEqual(search('maria brasil'), [str(loan.id)])
+        self.assertEqual(search('mar', ordering='created'), [str(self.loan_sac.id), str(loan.id)])
+
+    def test_list_loan_search_punctuation(self):
+        loan = Loan.objects.create(client=self.user, bank='Banco (SP) 100%', value=1000.00,
+                                   interest_rate=0.01, period=1, financing=PRICE_SYSTEM)
+
+        def search(term):
+            response = self.client.get(self.get_url(), {'search': term})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [item['id'] for item in response.json()['results']]
+
+        # the terms without words match as substrings
+        self.assertEqual(search('%'), [str(loan.id)])
+        self.assertEqual(search('('), [str(loan.id)])
+        self.assertEqual(search('% banc'), [str(loan.id)])
+        self.assertEqual(search('% testbank'), [])
+        self.assertEqual(search('!'), [])
+
+    def test_list_loan_search_by_client(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        response = self.client.get(self.get_url(), {'search': 'testbank'})
+
+        self.assertEqual([item['id'] for item in response.json()['results']], [str(self.loan_price.id)])
+
+    def test_list_loan_search_fallback(self):
+        with mock.patch.object(connection, 'vendor', 'sqlite'):
+            response = self.client.get(self.get_url(), {'search': 'stban'})
+
+        self.assertEqual(len(response.json()['results']), 2)
+
 
 class TestLoanRetrieveAPIView(BaseLoanAPITestCase):
 
@@ -202,6 +422,7 @@ class TestLoanRetrieveAPIView(BaseLoanAPITestCase):
             'value': f'R$ {loan.value:.2f}',
             'amount_due': f'R$ {loan.amount_due:.2f}',
             'interest_rate': f'{100.0 * float(loan.interest_rate):.2f}%',
+            'paid_total': f'R$ {loan.paid_total:.2f}',
             'balance_due': f'R$ {loan.make_balance_due():.2f}'}
 
     def test_retrieve_loan_price_without_authentication(self):
@@ -243,6 +464,36 @@ class TestLoanRetrieveAPIView(BaseLoanAPITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertDictEqual(response.json(), response_json)
 
+    def test_retrieve_loan_conditional(self):
+        response = self.client.get(self.get_url(self.loan_price))
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        response = self.client.get(self.get_url(self.loan_price), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(self.get_url(self.loan_price), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # paying changes the balances and so the loan
+        payment = self.loan_price.payment_set.first()
+        payment.status = PAID
+        payment.save()
+
+        response = self.client.get(self.get_url(self.loan_price), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_retrieve_loan_conditional_without_permission(self):
+        response = self.client.get(self.get_url(self.loan_sac))
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get(self.get_url(self.loan_sac), HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertNotIn('ETag', response)
+
 
 class TestPaymentListAPIView(BaseLoanAPITestCase):
 
@@ -284,3 +535,1180 @@ class TestPaymentListAPIView(BaseLoanAPITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json().get('results')), 10)
+
+    def test_list_payment_same_output_as_payment_serializer(self):
+        payment = self.loan_sac.payment_set.order_by('installment').first()
+        payment.status = PAID
+        payment.pay_date = now()
+        payment.save()
+        payments = self.loan_sac.payment_set.order_by('-created')
+
+        response = self.client.get(self.get_url(self.loan_sac), {'page_size': 10})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(JSONRenderer().render(response.data['results']),
+                         JSONRenderer().render(PaymentSerializer(payments, many=True).data))
+
+    def test_list_payment_conditional(self):
+        response = self.client.get(self.get_url(self.loan_sac))
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.get_url(self.loan_sac), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith('SELECT "loans_payment"')])
+
+        # other pages or filters have their own etag
+        response = self.client.get(self.get_url(self.loan_sac), {'page_size': 5}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.loan_sac.payment_set.filter(pk=self.loan_sac.payment_set.first().pk).update(
+            status=PAID, modified=now())
+        response = self.client.get(self.get_url(self.loan_sac), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # a deleted payment changes the count
+        etag = response['ETag']
+        self.loan_sac.payment_set.exclude(status=PAID).first().delete()
+        response = self.client.get(self.get_url(self.loan_sac), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()['results']), 9)
+
+    def test_list_loan_sac_payment_with_cursor_pagination(self):
+        payments = sorted(self.loan_sac.payment_set.all(), key=lambda p: (p.created, p.id), reverse=True)
+        expected = [str(p.id) for p in payments]
+
+        ids = []
+        params = {'pagination': 'cursor', 'page_size': 3}
+        while True:
+            response = self.client.get(self.get_url(self.loan_sac), params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json()['total'], 10)
+            self.assertEqual(response.json()['page_count'], 4)
+
+            ids += [p['id'] for p in response.json()['results']]
+            if not response.json()['next_page']:
+                break
+            params = {'cursor': response.json()['next_page'], 'page_size': 3}
+
+        self.assertEqual(ids, expected)
+
+        response = self.client.get(self.get_url(self.loan_sac), {'cursor': response.json()['prev_page'],
+                                                                 'page_size': 3})
+        self.assertEqual([p['id'] for p in response.json()['results']], expected[6:9])
+
+    def test_list_loan_sac_payment_with_cursor_pagination_count(self):
+        params = {'pagination': 'cursor', 'count': 'none'}
+        response = self.client.get(self.get_url(self.loan_sac), params)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('total', response.json())
+        self.assertNotIn('page_count', response.json())
+
+        params = {'pagination': 'cursor', 'count': 'estimate'}
+        response = self.client.get(self.get_url(self.loan_sac), params)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(response.json()['total'], int)
+
+    def test_list_loan_sac_payment_with_invalid_cursor(self):
+        response = self.client.get(self.get_url(self.loan_sac), {'cursor': 'invalid'})
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class TestPaymentUpdateAPIView(BaseLoanAPITestCase):
+
+    def get_url(self, payment):
+        return reverse('loans:payments-update', args=[payment.loan_id, payment.id])
+
+    def assertBalances(self, loan, paid_total):
+        loan.refresh_from_db()
+        self.assertEqual(loan.paid_total, paid_total)
+        self.assertEqual(loan.balance_due, loan.amount_due - paid_total)
+        self.assertEqual(loan.balance_due, loan.make_balance_due())
+
+    def test_update_payment_by_client(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        payment = self.loan_price.payment_set.first()
+
+        response = self.client.patch(self.get_url(payment), {'status': PAID})
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertBalances(self.loan_price, Decimal('0.00'))
+
+    def test_update_payment_status_updates_balances(self):
+        payment = self.loan_price.payment_set.first()
+
+        response = self.client.patch(self.get_url(payment), {'status': PAID})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertBalances(self.loan_price, payment.value)
+
+        response = self.client.patch(self.get_url(payment), {'status': PAID})
+        self.assertBalances(self.loan_price, payment.value)
+
+        response = self.client.patch(self.get_url(payment), {'status': 5})
+        self.assertBalances(self.loan_price, Decimal('0.00'))
+
+    def test_bulk_update_payment_status_updates_balances(self):
+        paid = {loan: list(loan.payment_set.order_by('due_date')[:3]) for loan in (self.loan_price, self.loan_sac)}
+
+        Payment.objects.filter(pk__in=[p.pk for payments in paid.values() for p in payments]).update(status=PAID)
+
+        for loan, payments in paid.items():
+            self.assertBalances(loan, sum(p.value for p in payments))
+
+    def test_concurrent_payment_updates_count_once(self):
+        # both copies were loaded before either was saved, like two requests
+        # updating the same payment at once
+        payment = self.loan_price.payment_set.first()
+        first, second = Payment.objects.get(pk=payment.pk), Payment.objects.get(pk=payment.pk)
+        first.status = second.status = PAID
+
+        first.save()
+        second.save()
+
+        self.assertBalances(self.loan_price, payment.value)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_delete_paid_payment_updates_balances(self):
+        payment = self.loan_sac.payment_set.first()
+        payment.status = PAID
+        payment.save()
+        self.assertBalances(self.loan_sac, payment.value)
+
+        Payment.objects.get(pk=payment.pk).delete()
+
+        self.assertBalances(self.loan_sac, Decimal('0.00'))
+
+    def test_bulk_delete_payments_updates_balances(self):
+        self.loan_sac.payment_set.filter(pk__in=self.loan_sac.payment_set.order_by('due_date')[:3]).update(
+            status=PAID)
+
+        self.loan_sac.payment_set.filter(status=PAID).delete()
+
+        self.assertBalances(self.loan_sac, Decimal('0.00'))
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_delete_loan_deletes_payments_at_once(self):
+        with CaptureQueriesContext(connection) as context:
+            self.loan_price.delete()
+
+        deletes = [query for query in context.captured_queries
+                   if query['sql'].startswith('DELETE FROM "loans_payment"')]
+        self.assertEqual(len(deletes), 1)
+        self.assertLess(len(context.captured_queries), 10)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_bulk_delete_loans_updates_summary_once(self):
+        with CaptureQueriesContext(connection) as context:
+            Loan.objects.filter(pk__in=[self.loan_price.pk, self.loan_sac.pk]).delete()
+
+        upserts = [query for query in context.captured_queries
+                   if query['sql'].startswith('INSERT INTO loans_paymentsummary')]
+        self.assertEqual(len(upserts), 1)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_rebuild_balances_command(self):
+        Loan.objects.update(paid_total=Decimal('10.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', verify=True, stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_balances', batch_size=1, stdout=StringIO())
+        call_command('rebuild_balances', verify=True, stdout=StringIO())
+        self.assertBalances(self.loan_price, Decimal('0.00'))
+
+    def test_rebuild_balances_keeps_unchanged_loans(self):
+        Loan.objects.filter(pk=self.loan_price.pk).update(paid_total=Decimal('10.00'))
+        modified = Loan.objects.get(pk=self.loan_sac.pk).modified
+        stdout = StringIO()
+
+        call_command('rebuild_balances', stdout=stdout)
+
+        self.assertIn('1 loans rebuilt', stdout.getvalue())
+        self.assertEqual(Loan.objects.get(pk=self.loan_sac.pk).modified, modified)
+        self.assertBalances(self.loan_price, Decimal('0.00'))
+
+    def test_payment_summary(self):
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+        payment = self.loan_sac.payment_set.order_by('due_date').first()
+        payment.status = PAID
+        payment.save()
+        Payment.objects.filter(loan=self.loan_price).update(due_date=now() + timedelta(days=400))
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+        Payment.objects.get(pk=payment.pk).delete()
+        self.loan_price.delete()
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_rebuild_payment_summary_command(self):
+        PaymentSummary.objects.update(count=5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_payment_summary', verify=True, stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_payment_summary', stdout=StringIO())
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+
+class TestPaymentBulkUpdateAPIView(BaseLoanAPITestCase):
+
+    url = reverse('loans:payments-bulk-update')
+    assertBalances = TestPaymentUpdateAPIView.assertBalances
+
+    def test_bulk_update_by_client(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        payment = self.loan_price.payment_set.first()
+
+        response = self.client.post(self.url, {'payments': [{'id': payment.id, 'status': PAID}]}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_update_updates_balances(self):
+        price = list(self.loan_price.payment_set.order_by('due_date'))
+        sac = list(self.loan_sac.payment_set.order_by('due_date'))
+        Payment.objects.filter(pk=sac[0].pk).update(status=PAID)
+        pay_date = now().replace(microsecond=0)
+
+        items = [
+            *({'id': str(p.id), 'status': PAID, 'pay_date': pay_date.isoformat()} for p in price[:3]),
+            {'id': str(sac[0].id), 'status': DUE},
+            {'id': str(sac[1].id), 'status': PAID}]
+
+        with self.assertNumQueries(10):
+            response = self.client.post(self.url, {'payments': items}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['updated'], 5)
+        self.assertEqual(response.json()['results'], [{'id': item['id'], 'updated': True} for item in items])
+        self.assertBalances(self.loan_price, sum(p.value for p in price[:3]))
+        self.assertBalances(self.loan_sac, sac[1].value)
+
+        payment = Payment.objects.get(pk=price[0].pk)
+        self.assertEqual(payment.pay_date, pay_date)
+        self.assertGreater(payment.modified, payment.created)
+        self.assertIsNone(Payment.objects.get(pk=sac[1].pk).pay_date)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_bulk_update_results(self):
+        payment = self.loan_price.payment_set.first()
+        missing = '00000000-0000-0000-0000-000000000000'
+        items = [
+            {'id': str(payment.id), 'status': PAID},
+            {'id': str(payment.id), 'status': DUE},
+            {'id': missing, 'status': PAID},
+            {'id': 'invalid', 'status': 99}]
+
+        response = self.client.post(self.url, {'payments': items}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual(results[0], {'id': str(payment.id), 'updated': True})
+        self.assertEqual(results[1], {'id': str(payment.id), 'errors': {'id': ['Pagamento repetido na lista']}})
+        self.assertEqual(results[2], {'id': missing, 'errors': {'id': ['Não encontrado.']}})
+        self.assertEqual(set(results[3]['errors']), {'id', 'status'})
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, PAID)
+        self.assertBalances(self.loan_price, payment.value)
+
+    def test_bulk_update_invalid_list(self):
+        for payments in (None, [], [{}] * 5001):
+            response = self.client.post(self.url, {'payments': payments}, format='json')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TestCachedJWTAuthentication(BaseLoanAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        principal_cache.clear()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def get_user_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [query for query in context.captured_queries if 'FROM "auth_user"' in query['sql']]
+
+    def test_user_is_cached(self):
+        url = reverse('loans:payments-list', args=[self.loan_price.id])
+
+        self.assertEqual(len(self.get_user_queries(url)), 1)
+        # neither the authentication nor the loan permission query the user
+        self.assertEqual(len(self.get_user_queries(url)), 0)
+
+    def test_user_change_invalidates_cache(self):
+        url = reverse('loans:list')
+        self.get_user_queries(url)
+
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_user_deferred_fields(self):
+        self.get_user_queries(reverse('loans:list'))
+        user = CachedJWTAuthentication().get_user({'user_id': self.user.pk})
+
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertFalse(user.is_staff)
+        self.assertEqual(user.username, self.user.username)
+
+
+class TestReplicaRouting(BaseLoanAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        pins.clear()
+
+    def get_read_databases(self, url):
+        """
+        databases each query of the request read from, the replica is the
+        default database
+        """
+        databases = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            databases.append(db_for_read(router, model, **hints))
+            return databases[-1]
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', record), \
+                mock.patch('loans.mixins.get_replica', return_value='default'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return databases
+
+    def test_reads_from_replica(self):
+        self.assertIn('default', self.get_read_databases(reverse('loans:list')))
+        self.assertIn('default', self.get_read_databases(reverse('loans:payments-list', args=[self.loan_sac.id])))
+
+    def test_reads_from_primary_after_write(self):
+        payment = self.loan_price.payment_set.first()
+        response = self.client.patch(reverse('loans:payments-update', args=[payment.loan_id, payment.id]),
+                                     {'status': PAID})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertNotIn('default', self.get_read_databases(reverse('loans:list')))
+
+        # other users still read from the replica
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertIn('default', self.get_read_databases(reverse('loans:list')))
+
+    def test_failed_write_does_not_pin(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        payment = self.loan_price.payment_set.first()
+        response = self.client.patch(reverse('loans:payments-update', args=[payment.loan_id, payment.id]),
+                                     {'status': PAID})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.assertIn('default', self.get_read_databases(reverse('loans:list')))
+
+    @override_settings(REPLICAS={**settings.REPLICAS, 'DATABASES': ['replica1']})
+    def test_router(self):
+        router = ReplicaRouter()
+
+        self.assertIsNone(router.db_for_read(Loan))
+        self.assertEqual(router.db_for_write(Loan), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'loans'))
+        self.assertIsNone(router.allow_migrate('default', 'loans'))
+
+    def test_pins_need_shared_backend(self):
+        caches = {**settings.CACHES, 'local': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                  'shared': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'pins'}}
+        for backend in (None, 'local'):
+            with self.settings(CACHES=caches, REPLICAS={**settings.REPLICAS, 'DATABASES': ['replica1'],
+                                                        'PIN_BACKEND': backend}):
+                with self.assertRaises(ImproperlyConfigured):
+                    make_pins()
+
+        with self.settings(CACHES=caches, REPLICAS={**settings.REPLICAS, 'DATABASES': ['replica1'],
+                                                    'PIN_BACKEND': 'shared'}):
+            self.assertEqual(make_pins().backend, 'shared')
+        self.assertIsNone(make_pins().backend)
+
+
+class TestPaymentAnalyticsAPIView(BaseLoanAPITestCase):
+
+    def get_url(self):
+        return reverse('loans:payments-analytics')
+
+    def test_analytics_by_client(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        response = self.client.get(self.get_url())
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_analytics(self):
+        paid = self.loan_price.payment_set.order_by('due_date').first()
+        paid.status = PAID
+        paid.save()
+        overdue = self.loan_sac.payment_set.order_by('due_date').first()
+        Payment.objects.filter(pk=overdue.pk).update(due_date=now() - timedelta(days=1))
+        payments = Payment.objects.exclude(pk=paid.pk)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.get_url())
+        data = response.json()
+        tables = [query['sql'].split(' FROM ')[1].split()[0] for query in context.captured_queries
+                  if 'loans_payment' in query['sql']]
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the months and the overdue total from the summary, only the current
+        # month overdue payments from the payments
+        self.assertEqual(tables, ['"loans_paymentsummary"', '"loans_payment"', '"loans_paymentsummary"'])
+        self.assertEqual(sum(month['payments'] for month in data['inflow']), 17)
+        self.assertEqual(sum(Decimal(month['expected']) for month in data['inflow']),
+                         sum(payment.value for payment in payments))
+        self.assertEqual(sum(Decimal(month['paid']) for month in data['inflow']), paid.value)
+        self.assertEqual(data['outstanding'][0]['principal'],
+                         f'{sum(payment.amortization for payment in payments.filter(loan=self.loan_price)):.2f}')
+        self.assertEqual(data['outstanding'][1]['payments'], 10)
+        self.assertEqual(data['overdue'], {'payments': 1, 'total': f'{overdue.value:.2f}'})
+
+        # the bank filter reads the payments, with the same figures
+        self.assertEqual(self.client.get(self.get_url(), {'bank': self.loan_price.bank}).json(), data)
+
+    def test_analytics_with_filters(self):
+        due_date = self.loan_sac.payment_set.order_by('due_date').first().due_date
+        params = {'financing': SAC_SYSTEM, 'start': due_date.isoformat(),
+                  'end': (due_date + timedelta(days=1)).isoformat()}
+
+        response = self.client.get(self.get_url(), params)
+        data = response.json()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([month['payments'] for month in data['inflow']], [1])
+        self.assertEqual(data['outstanding'][0]['payments'], 0)
+
+        response = self.client.get(self.get_url(), {'financing': 3})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_analytics_windowed_loans(self):
+        terms = {'client': self.user, 'bank': 'windowbank', 'value': Decimal('120000.00'),
+                 'interest_rate': Decimal('0.05'), 'period': 10, 'financing': SAC_SYSTEM}
+        windowed = Loan.objects.create(schedule_window=3, **terms)
+        self.assertEqual(windowed.payment_set.count(), 3)
+        stored = Loan.objects.create(**terms)
+        at = now() + timedelta(days=130)
+
+        with mock.patch('loans.views.now', return_value=at):
+            data = self.client.get(self.get_url(), {'bank': 'windowbank'}).json()
+        stored.delete()
+        with mock.patch('loans.views.now', return_value=at):
+            windowed_data = self.client.get(self.get_url(), {'bank': 'windowbank'}).json()
+
+        self.assertEqual(sum(month['payments'] for month in data['inflow']), 20)
+        self.assertEqual(data['outstanding'][1]['principal'], '240000.00')
+        self.assertEqual(data['overdue']['payments'], 8)
+        self.assertEqual(windowed_data['outstanding'][1]['principal'], '120000.00')
+        self.assertEqual(windowed_data['overdue'], {
+            'payments': 4, 'total': f'{Decimal(data["overdue"]["total"]) / 2:.2f}'})
+
+        # the summary has the installments the windowed loan has not stored
+        with mock.patch('loans.views.now', return_value=at):
+            summary_data = self.client.get(self.get_url(), {'financing': SAC_SYSTEM}).json()
+        self.assertEqual(summary_data['outstanding'][1]['principal'], '240000.00')
+
+
+class TestPackedLoans(BaseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        terms = {'bank': 'testbank', 'value': Decimal('120000.00'), 'interest_rate': Decimal('0.05'),
+                 'period': 10, 'financing': SAC_SYSTEM}
+        self.stored, self.packed = create_loans([
+            Loan(client=self.user, **terms), Loan(client=self.user, storage=PACKED_STORAGE, **terms)])
+        self.packed.refresh_from_db()
+
+    def get_url(self, loan, **params):
+        return reverse('loans:payments-list', kwargs={'loan_pk': loan.pk})
+
+    def get_update_url(self, payment_id):
+        return reverse('loans:payments-update', kwargs={'loan_pk': self.packed.pk, 'pk': payment_id})
+
+    def get_payments(self, loan, **params):
+        response = self.client.get(self.get_url(loan), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_create_packed_loan(self):
+        response = self.client.post(reverse('loans:create'), {
+            'client': self.user.id, 'bank': 'testbank', 'value': 20000.00, 'interest_rate': 0.04, 'period': 8,
+            'financing': PRICE_SYSTEM, 'storage': PACKED_STORAGE})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        loan = Loan.objects.get(pk=Loan.objects.exclude(pk__in=[self.stored.pk, self.packed.pk]).get().pk)
+        self.assertEqual(loan.payment_set.count(), 0)
+        self.assertEqual(len(loan.packed), 8)
+        self.assertEqual(loan.amount_due, Decimal('23764.45'))
+        self.assertEqual(loan.make_balance_due(), loan.amount_due)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+        response = self.client.post(reverse('loans:create'), {
+            'client': self.user.id, 'bank': 'testbank', 'value': 20000.00, 'interest_rate': 0.04, 'period': 8,
+            'storage': PACKED_STORAGE, 'schedule_window': 2})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('schedule_window', response.json())
+
+    def test_create_packed_loan_with_orm(self):
+        loan = Loan.objects.create(
+            client=self.user, bank='testbank', value=Decimal('120000.00'), interest_rate=Decimal('0.05'),
+            period=10, financing=SAC_SYSTEM, storage=PACKED_STORAGE)
+
+        self.assertEqual(loan.payment_set.count(), 0)
+        self.assertEqual(loan.amount_due, self.packed.amount_due)
+        self.assertEqual(len(Loan.objects.get(pk=loan.pk).packed), 10)
+        self.assertEqual(self.get_payments(loan)['total'], 10)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_update_packed_balances(self):
+        loans = Loan.objects.filter(pk__in=[self.packed.pk, self.stored.pk])
+        self.assertEqual(loans.update_balances(), 0)
+
+        Loan.objects.filter(pk=self.packed.pk).update(paid_total=Decimal('10.00'))
+        self.assertEqual(loans.update_balances(), 1)
+        call_command('rebuild_balances', verify=True, stdout=StringIO())
+
+    def test_delete_packed_loan(self):
+        self.packed.delete()
+
+        self.assertEqual(PaymentSummary.objects.aggregate(count=Sum('count'))['count'], 10)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_list_packed_payments(self):
+        stored = self.get_payments(self.stored)
+        packed = self.get_payments(self.packed)
+
+        self.assertEqual(Payment.objects.filter(loan=self.packed).count(), 0)
+        self.assertEqual(packed['total'], 10)
+        for stored_payment, packed_payment in zip(stored['results'], packed['results']):
+            self.assertEqual(packed_payment, {
+                **stored_payment, 'id': packed_payment['id'], 'loan': str(self.packed.pk)})
+        self.assertEqual(packed['results'][0]['id'], str(self.packed.get_packed_payment_id(10)))
+
+        packed = self.get_payments(self.packed, ordering='created', page_size=3, page=2)
+        self.assertEqual([payment['installment'] for payment in packed['results']], [4, 5, 6])
+        # lists are paginated by page number
+        self.assertEqual(self.get_payments(self.packed, pagination='cursor')['total'], 10)
+
+    def test_update_packed_payment(self):
+        payment_id = self.packed.get_packed_payment_id(2)
+
+        response = self.client.patch(self.get_update_url(payment_id), {'status': PAID})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {'status': PAID})
+        loan = Loan.objects.get(pk=self.packed.pk)
+        self.assertEqual(loan.paid_total, Decimal('17400.00'))
+        self.assertEqual(loan.balance_due, loan.amount_due - loan.paid_total)
+        self.assertGreater(loan.modified, self.packed.modified)
+
+        payments = self.get_payments(self.packed, status=PAID)['results']
+        self.assertEqual([(payment['id'], payment['status']) for payment in payments], [(str(payment_id), 'Pago')])
+        self.assertGreater(loan.make_packed_payments([1])[0].modified, loan.created)
+
+        call_command('rebuild_balances', verify=True, stdout=StringIO())
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+        response = self.client.patch(self.get_update_url(self.stored.payment_set.first().pk), {'status': PAID})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_packed_payment_ids(self):
+        payment_ids = [self.packed.get_packed_payment_id(installment) for installment in range(1, 11)]
+
+        self.assertEqual([self.packed.get_packed_index(payment_id) for payment_id in payment_ids], list(range(10)))
+        self.assertEqual(len(set(payment_ids) | {self.packed.pk}), 11)
+        self.assertIsNone(self.packed.get_packed_index(self.packed.get_packed_payment_id(11)))
+        self.assertIsNone(self.packed.get_packed_index(self.stored.get_packed_payment_id(1)))
+        self.assertIsNone(self.packed.get_packed_index('not-an-uuid'))
+        self.assertEqual(list(Loan.objects.filter_packed_payments(payment_ids[:2])), [self.packed])
+
+    def test_bulk_update_packed_payments(self):
+        pay_date = now().replace(microsecond=0)
+        packed_ids = [str(self.packed.get_packed_payment_id(installment)) for installment in (1, 2, 3)]
+        items = [
+            {'id': packed_ids[0], 'status': PAID, 'pay_date': pay_date.isoformat()},
+            {'id': packed_ids[1], 'status': PAID},
+            {'id': packed_ids[2], 'status': DUE},
+            {'id': packed_ids[0], 'status': DUE},
+            {'id': str(self.stored.payment_set.order_by('due_date').first().pk), 'status': PAID}]
+
+        response = self.client.post(reverse('loans:payments-bulk-update'), {'payments': items}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['updated'], 4)
+        self.assertEqual(response.json()['results'][3]['errors'], {'id': ['Pagamento repetido na lista']})
+        loan = Loan.objects.get(pk=self.packed.pk)
+        self.assertEqual([(payment.status, payment.pay_date) for payment in loan.make_packed_payments([0, 1, 2])],
+                         [(PAID, pay_date), (PAID, None), (DUE, None)])
+        self.assertEqual(loan.paid_total, Loan.objects.get(pk=self.stored.pk).paid_total + Decimal('17400.00'))
+        call_command('rebuild_balances', verify=True, stdout=StringIO())
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_export_packed_payments(self):
+        self.packed.update_packed([0], status=PAID)
+
+        response = self.client.get(reverse('loans:payments-export'), {'format': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1 + 10 + 10)
+        self.assertNotIn('packed_schedule', lines[0])
+
+        response = self.client.get(reverse('loans:payments-export'), {'format': 'ndjson', 'status': PAID})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['id'], row['loan_id'], row['installment']) for row in rows],
+                         [(str(self.packed.get_packed_payment_id(1)), str(self.packed.pk), 1)])
+        self.assertEqual(rows[0]['value'], '18000.00')
+
+        stdout = StringIO()
+        call_command('export_loans', 'payments', format='ndjson', filter=[f'status={PAID}'], stdout=stdout)
+        self.assertEqual([json.loads(line) for line in stdout.getvalue().splitlines()], rows)
+
+    def test_packed_payments_analytics(self):
+        at = now() + timedelta(days=65)
+        stored = Payment.objects.filter(due_date__lt=at)
+        # the summary has the packed installments past due once they are marked
+        mark_overdue_packed_payments(until=at)
+
+        with mock.patch('loans.views.now', return_value=at):
+            data = self.client.get(reverse('loans:payments-analytics')).json()
+            by_bank = self.client.get(reverse('loans:payments-analytics'), {'bank': 'testbank'}).json()
+
+        self.assertEqual(sum(month['payments'] for month in data['inflow']), 20)
+        self.assertEqual(data['outstanding'][1]['principal'], '240000.00')
+        self.assertEqual(data['overdue'], {
+            'payments': 4, 'total': f'{2 * sum(payment.value for payment in stored):.2f}'})
+        self.assertEqual(by_bank, data)
+
+    def test_packed_payments_conditional_get(self):
+        response = self.client.get(self.get_url(self.packed))
+        etag = response['ETag']
+
+        response = self.client.get(self.get_url(self.packed), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(self.get_update_url(self.packed.get_packed_payment_id(1)), {'status': PAID})
+        response = self.client.get(self.get_url(self.packed), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_mark_overdue_packed_payments(self):
+        self.assertEqual(mark_overdue_packed_payments(until=now() + timedelta(days=65), batch_size=1), 2)
+
+        loan = Loan.objects.get(pk=self.packed.pk)
+        self.assertEqual(
+            [payment.status for payment in loan.make_packed_payments()], [DUE] * 2 + [AWAITING_PAYMENT] * 8)
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+    def test_rebuild_packed_balances(self):
+        Loan.objects.update(paid_total=Decimal('10.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', verify=True, stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_balances', stdout=StringIO())
+        call_command('rebuild_balances', verify=True, stdout=StringIO())
+
+        PaymentSummary.objects.all().delete()
+        call_command('rebuild_payment_summary', stdout=StringIO())
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+
+class TestImportLoansCommand(BaseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.source = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        self.source.write('client,bank,value,interest_rate,period,financing\n')
+        for i in range(5):
+            self.source.write(f'{self.user.id},testbank,20000.00,0.04,8,{PRICE_SYSTEM}\n')
+            self.source.write(f'{self.user.id},testbank,120000.00,0.05,10,{SAC_SYSTEM}\n')
+        self.source.close()
+        self.addCleanup(os.remove, self.source.name)
+        self.addCleanup(lambda: os.path.exists(self.checkpoint) and os.remove(self.checkpoint))
+
+    @property
+    def checkpoint(self):
+        return f'{self.source.name}.checkpoint'
+
+    def test_import_loans(self):
+        call_command('import_loans', self.source.name, chunk_size=3, stdout=StringIO())
+
+        self.assertEqual(Loan.objects.count(), 10)
+        self.assertEqual(Payment.objects.count(), 5 * 8 + 5 * 10)
+
+        loan = Loan.objects.create(client=self.user, bank='testbank', value=20000.00, interest_rate=0.04,
+                                   period=8, financing=PRICE_SYSTEM)
+        imported = Loan.objects.filter(financing=PRICE_SYSTEM).exclude(pk=loan.pk).first()
+        self.assertEqual(imported.amount_due, Decimal('23764.45'))
+        self.assertEqual(imported.balance_due, imported.amount_due)
+        self.assertEqual(
+            list(imported.payment_set.order_by('due_date').values_list('value', 'interest_amount')),
+            list(loan.payment_set.order_by('due_date').values_list('value', 'interest_amount')))
+
+    def test_import_loans_resume(self):
+        call_command('import_loans', self.source.name, chunk_size=4, stdout=StringIO())
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        with open(self.checkpoint, 'w') as f:
+            json.dump({**state, 'done': 2}, f)
+
+        call_command('import_loans', self.source.name, chunk_size=4, resume=True, stdout=StringIO())
+
+        self.assertEqual(Loan.objects.count(), 10)
+        self.assertEqual(Payment.objects.count(), 5 * 8 + 5 * 10)
+
+    def test_import_loans_with_wrong_data(self):
+        with open(self.source.name, 'a') as f:
+            f.write('10,testbank,0.00,0.04,8,1\n')
+
+        with self.assertRaises(CommandError):
+            call_command('import_loans', self.source.name, chunk_size=20, stdout=StringIO())
+        self.assertEqual(Loan.objects.count(), 0)
+
+        call_command('import_loans', self.source.name, skip_invalid=True, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(Loan.objects.count(), 10)
+
+    def test_import_loans_same_name(self):
+        call_command('import_loans', self.source.name, stdout=StringIO())
+        # another file with the same name
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, os.path.basename(self.source.name))
+        shutil.copy(self.source.name, source)
+
+        call_command('import_loans', source, stdout=StringIO())
+        call_command('import_loans', self.source.name, stdout=StringIO())
+
+        self.assertEqual(Loan.objects.count(), 30)
+
+    def test_import_loans_with_malformed_jsonl(self):
+        source = os.path.join(tempfile.mkdtemp(), 'loans.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(source))
+        row = {'client': self.user.id, 'bank': 'testbank', 'value': '20000.00', 'interest_rate': '0.04',
+               'period': 8, 'financing': PRICE_SYSTEM}
+        with open(source, 'w') as f:
+            f.write(json.dumps(row) + '\n{"client": \n[]\n')
+            f.write(json.dumps({**row, 'id': 'not-an-uuid'}) + '\n')
+
+        with self.assertRaisesMessage(CommandError, 'Row 2: malformed JSON'):
+            call_command('import_loans', source, stdout=StringIO())
+
+        stderr = StringIO()
+        call_command('import_loans', source, skip_invalid=True, stdout=StringIO(), stderr=stderr)
+        self.assertEqual(Loan.objects.count(), 1)
+        self.assertEqual(
+            [line.split(':')[0] for line in stderr.getvalue().splitlines()], ['Row 2', 'Row 3', 'Row 4'])
+        self.assertIn('not a valid UUID', stderr.getvalue())
+
+
+class TestExportAPIView(BaseLoanAPITestCase):
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_export_loans_csv(self):
+        response = self.client.get(reverse('loans:export'), {'format': 'csv'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = self.read(response)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('created,modified,id,client_id'))
+
+    def test_export_loans_ndjson_with_filter(self):
+        response = self.client.get(reverse('loans:export'), {'format': 'ndjson', 'financing': SAC_SYSTEM})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = [json.loads(line) for line in self.read(response)]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['id'], str(self.loan_sac.id))
+        self.assertEqual(lines[0]['amount_due'], '153000.00')
+
+    def test_export_loans_by_client(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        response = self.client.get(reverse('loans:export'), {'format': 'ndjson'})
+
+        lines = [json.loads(line) for line in self.read(response)]
+        self.assertEqual([line['id'] for line in lines], [str(self.loan_price.id)])
+
+    def test_export_payments(self):
+        response = self.client.get(reverse('loans:payments-export'), {'format': 'csv'})
+        self.assertEqual(len(self.read(response)), 1 + 8 + 10)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        response = self.client.get(reverse('loans:payments-export'), {'format': 'ndjson', 'status': PAID})
+        self.assertEqual(self.read(response), [])
+
+    def test_export_command(self):
+        stdout = StringIO()
+        call_command('export_loans', 'payments', format='ndjson', filter=[f'status={PAID}'], stdout=stdout)
+        self.assertEqual(stdout.getvalue(), '')
+
+        stdout = StringIO()
+        call_command('export_loans', 'loans', filter=[f'financing={PRICE_SYSTEM}'], stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 2)
+        self.assertNotIn('packed_schedule', stdout.getvalue().splitlines()[0])
+
+
+class TestMarkOverdueCommand(BaseLoanAPITestCase):
+
+    def test_mark_overdue(self):
+        payments = list(Payment.objects.order_by('due_date'))
+        overdue = payments[:7]
+        Payment.objects.filter(pk__in=[p.pk for p in overdue]).update(due_date=now() - timedelta(days=1))
+        Payment.objects.filter(pk=overdue[0].pk).update(status=PAID)
+
+        call_command('mark_overdue', batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Payment.objects.filter(status=DUE).count(), 6)
+        self.assertEqual(Payment.objects.filter(status=PAID).count(), 1)
+        self.assertEqual(Payment.objects.filter(status=AWAITING_PAYMENT).count(), len(payments) - 7)
+        for payment in Payment.objects.filter(status=DUE):
+            self.assertGreater(payment.modified, payment.created)
+
+        call_command('rebuild_balances', verify=True, stdout=StringIO())
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+
+
+class TestBenchCommand(BaseAPITestCase):
+
+    def test_bench(self):
+        options = {'periods': [12], 'table_sizes': [5], 'page_sizes': [5], 'repeat': 2, 'stdout': StringIO()}
+        loans = Loan.objects.count()
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('bench', output=output, **options)
+
+            with open(output) as results_file:
+                results = json.load(results_file)
+            self.assertEqual(results['cases']['loans:list client 5/5']['queries'], 3)
+            self.assertEqual(results['cases']['make_schedule price 12']['queries'], 0)
+            self.assertEqual(Loan.objects.count(), loans)
+
+            call_command('bench', baseline=output, tolerance=100, **options)
+
+            for case in results['cases'].values():
+                case['queries'] = 0
+            with open(output, 'w') as results_file:
+                json.dump(results, results_file)
+
+            with self.assertRaisesMessage(CommandError, 'regressions'):
+                call_command('bench', baseline=output, tolerance=100, **options)
+
+
+class TestMetrics(BaseLoanAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.reset()
+
+    def test_metrics_by_url_name(self):
+        self.client.get(reverse('loans:list'))
+        self.client.get(reverse('loans:list'))
+        self.client.get(reverse('loans:payments-list', args=[self.loan_price.id]))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.client.get(reverse('loans:retrieve', args=[self.loan_sac.id]))
+        self.client.credentials()
+
+        self.assertEqual(metrics.registry.requests[('loans:list', 'GET', '200')], 2)
+        self.assertEqual(metrics.registry.requests[('loans:retrieve', 'GET', '404')], 1)
+        self.assertEqual(metrics.registry.latency['loans:list'].count, 2)
+        # the second request finds the user in the principal cache
+        self.assertEqual(metrics.registry.queries['loans:list'].sum, 5)
+        self.assertGreater(metrics.registry.db_time['loans:payments-list'], 0)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('oniloan_requests_total{view="loans:list",method="GET",status="200"} 2', body)
+        self.assertIn('oniloan_request_duration_seconds_bucket{view="loans:list",le="+Inf"} 2', body)
+        self.assertIn('oniloan_db_queries_bucket{view="loans:list",le="2"} 1', body)
+        self.assertIn('oniloan_db_queries_bucket{view="loans:list",le="5"} 2', body)
+        self.assertIn('oniloan_db_queries_count{view="loans:retrieve"} 1', body)
+
+    def test_metrics_async(self):
+        def count_loans():
+            # in a worker thread, with its own connection
+            try:
+                return HttpResponse(str(Loan.objects.count()))
+            finally:
+                connection.close()
+
+        async def get_response(request):
+            return await sync_to_async(count_loans)()
+
+        middleware = MetricsMiddleware(get_response)
+        request = RequestFactory().get(reverse('loans:list'))
+        request.resolver_match = resolve(request.path)
+
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(request))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(metrics.registry.requests[('loans:list', 'GET', '200')], 1)
+        self.assertEqual(metrics.registry.queries['loans:list'].sum, 1)
+
+    def test_metrics_permissions(self):
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.logout()
+
+        with self.settings(METRICS={**settings.METRICS, 'TOKEN': 'scraper'}):
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scraper')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer other')
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class TestScheduleWindow(BaseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        data = {'client': self.user,
+                'bank': 'testbank',
+                'value': 300000.00,
+                'interest_rate': 0.01,
+                'period': 360,
+                'financing': PRICE_SYSTEM}
+        self.loan = Loan.objects.create(**data, schedule_window=12)
+        self.loan_eager = Loan.objects.create(**data)
+
+    def get_url(self, loan):
+        return reverse('loans:payments-list', args=[loan.id])
+
+    def get_terms(self, payments):
+        return [(p.installment, p.value, p.interest_amount, p.amortization, p.due_date - p.loan.created)
+                for p in sorted(payments, key=lambda p: p.installment)]
+
+    def test_create_loan_with_schedule_window(self):
+        data = {'client': self.user.id,
+                'bank': 'testbank',
+                'value': 300000.00,
+                'interest_rate': 0.01,
+                'period': 360,
+                'financing': PRICE_SYSTEM,
+                'schedule_window': 6}
+
+        response = self.client.post(reverse('loans:create'), data, **self.admin_headers)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        loan = Loan.objects.get(schedule_window=6)
+        self.assertEqual(loan.payment_set.count(), 6)
+        self.assertEqual(float(loan.amount_due), self.loan_eager.amount_due)
+
+    def test_stores_only_the_window(self):
+        self.assertEqual(self.loan.payment_set.count(), 12)
+        self.assertEqual(self.loan_eager.payment_set.count(), 360)
+        self.assertEqual(self.loan.amount_due, self.loan_eager.amount_due)
+        self.assertEqual(self.get_terms(self.loan.payment_set.all()),
+                         self.get_terms(self.loan_eager.payment_set.filter(installment__lte=12)))
+
+    def test_advance_schedule(self):
+        at = self.loan.created + timedelta(days=200)
+
+        self.assertEqual(self.loan.advance_schedule(at), 6)
+        self.assertEqual(self.loan.advance_schedule(at), 0)
+        self.assertEqual(self.get_terms(self.loan.payment_set.all()),
+                         self.get_terms(self.loan_eager.payment_set.filter(installment__lte=18)))
+
+        self.assertEqual(self.loan.advance_schedule(self.loan.created + timedelta(days=365 * 40)), 342)
+        self.assertEqual(self.get_terms(self.loan.payment_set.all()),
+                         self.get_terms(self.loan_eager.payment_set.all()))
+
+    def test_advance_schedules_command(self):
+        Loan.objects.filter(pk=self.loan.pk).update(created=self.loan.created - timedelta(days=200))
+
+        call_command('advance_schedules', stdout=StringIO())
+
+        self.assertEqual(self.loan.payment_set.count(), 18)
+        self.assertEqual(self.loan_eager.payment_set.count(), 360)
+
+    def test_payment_summary(self):
+        # the installments out of the window are in the summary from the start
+        windowed = create_loans([Loan(client=self.user, bank='testbank', value=Decimal('1000.00'),
+                                      interest_rate=Decimal('0.01'), period=24, schedule_window=2)])[0]
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+        summary = PaymentSummary.objects.aggregate(count=Sum('count'))
+        self.assertEqual(summary['count'], 360 * 2 + 24)
+
+        self.loan.advance_schedule(self.loan.created + timedelta(days=200))
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+        self.assertEqual(PaymentSummary.objects.aggregate(count=Sum('count')), summary)
+
+        windowed.delete()
+        self.loan.delete()
+        call_command('rebuild_payment_summary', verify=True, stdout=StringIO())
+        self.assertEqual(PaymentSummary.objects.aggregate(count=Sum('count'))['count'], 360)
+
+    def test_summarize_schedules(self):
+        # the first and last days of the months, the default timezone is behind utc
+        schedule = make_schedule(PRICE_SYSTEM, 1000.0, 0.01, 24)
+        schedules = []
+        all_payments = []
+        for created in (datetime(2026, 1, 1, 1, tzinfo=timezone.utc), datetime(2026, 1, 31, 23, tzinfo=timezone.utc),
+                        datetime(2026, 3, 15, 12, tzinfo=timezone.utc)):
+            due_dates = make_due_dates(created, 24)
+            payments = Loan(financing=PRICE_SYSTEM).make_payments(schedule, due_dates)
+
+            for start, stop in ((0, None), (5, 17)):
+                self.assertCountEqual(summarize_schedules([(PRICE_SYSTEM, schedule, due_dates, start, stop)]),
+                                      summarize_payments(payments[start:stop]))
+            schedules.append((PRICE_SYSTEM, schedule, due_dates, 5, 17))
+            all_payments += payments[5:17]
+
+        # the installments of many schedules in the same month are summed
+        self.assertCountEqual(summarize_schedules(schedules), summarize_payments(all_payments))
+
+    def test_list_payments_doesnt_advance_schedule(self):
+        # the installments entering the window are stored by the
+        # `advance_schedules` command, the reads don't write
+        Loan.objects.filter(pk=self.loan.pk).update(created=self.loan.created - timedelta(days=200))
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.get_url(self.loan))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['total'], 12)
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith('INSERT')])
+
+        call_command('advance_schedules', stdout=StringIO())
+        self.assertEqual(self.client.get(self.get_url(self.loan)).json()['total'], 18)
+
+    def test_list_payments(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        response = self.client.get(self.get_url(self.loan))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['total'], 12)
+
+        response = self.client.get(self.get_url(self.loan), {'projected': 'true'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        projected = response.json()
+        self.assertEqual(len(projected), 348)
+        self.assertEqual([p['installment'] for p in projected], list(range(13, 361)))
+        self.assertIsNone(projected[0]['id'])
+        self.assertEqual(projected[0]['status'], 'Aguardando Pagamento')
+
+        stored = self.client.get(self.get_url(self.loan_eager), {'page_size': 100, 'ordering': 'created'})
+        expected = {p['installment']: p for p in stored.json()['results']}[13]
+        fields = ['client', 'value', 'interest_amount', 'amortization', 'status', 'pay_date', 'installment']
+        self.assertEqual({field: projected[0][field] for field in fields},
+                         {field: expected[field] for field in fields})
+
+
+class TestLoanPreviewBatchAPIView(BaseAPITestCase):
+
+    def get_url(self):
+        return reverse('loans:preview-batch')
+
+    def test_preview_batch_without_authentication(self):
+        self.client.logout()
+
+        data = {'scenarios': [{'financing': PRICE_SYSTEM, 'value': 20000, 'interest_rate': 4, 'period': 8}]}
+        response = self.client.post(self.get_url(), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['results'][0]['loan']['amount_due'], 23764.45)
+
+    def test_preview_batch_matches_preview(self):
+        scenarios = [
+            {'financing': PRICE_SYSTEM, 'value': 20000, 'interest_rate': 4, 'period': 8},
+            {'financing': SAC_SYSTEM, 'value': 120000, 'interest_rate': 5, 'period': 10},
+            {'financing': PRICE_SYSTEM, 'value': 350000, 'interest_rate': 1, 'period': 360}]
+        data = {'scenarios': scenarios, 'payments': True}
+        response = self.client.post(self.get_url(), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+
+        for scenario, result in zip(scenarios, results):
+            preview = self.client.get(reverse('loans:preview'), scenario).json()
+
+            self.assertDictEqual(result['loan'], preview['loan'])
+            self.assertEqual(len(result['payments']), scenario['period'])
+            for payment, preview_payment in zip(result['payments'], preview['payments']):
+                self.assertEqual(payment['value'], preview_payment['value'])
+                self.assertEqual(payment['interest_amount'], preview_payment['interest_amount'])
+                self.assertEqual(payment['amortization'], preview_payment['amortization'])
+
+    def test_preview_batch_without_payments(self):
+        data = {'scenarios': [{'financing': SAC_SYSTEM, 'value': 120000, 'interest_rate': 5, 'period': 10}]}
+        response = self.client.post(self.get_url(), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('payments', response.json()['results'][0])
+        self.assertEqual(response.json()['results'][0]['loan']['amount_due'], 153000.0)
+
+    def test_preview_batch_with_wrong_data(self):
+        scenarios = [
+            {'financing': PRICE_SYSTEM, 'value': 20000, 'interest_rate': 4, 'period': 8},
+            {'financing': 0, 'value': 'a', 'interest_rate': 4, 'period': 8}]
+        response = self.client.post(self.get_url(), {'scenarios': scenarios}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()['scenarios']
+        self.assertEqual(errors[0], {})
+        self.assertEqual(set(errors[1]), {'financing', 'value', 'interest_rate', 'period'})
+
+    def test_preview_batch_with_too_long_period(self):
+        scenarios = [
+            {'financing': PRICE_SYSTEM, 'value': 20000, 'interest_rate': 4, 'period': MAX_PERIOD},
+            {'financing': PRICE_SYSTEM, 'value': 20000, 'interest_rate': 4, 'period': MAX_PERIOD + 1}]
+        response = self.client.post(self.get_url(), {'scenarios': scenarios}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()['scenarios']
+        self.assertEqual(errors[0], {})
+        self.assertIn('period', errors[1])
+
+    def test_preview_batch_with_too_many_scenarios(self):
+        scenario = {'financing': PRICE_SYSTEM, 'value': 20000, 'interest_rate': 4, 'period': 8}
+        response = self.client.post(self.get_url(), {'scenarios': [scenario] * 5001}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('scenarios', response.json())
+
+
+class TestLoanPreviewCacheAPIView(BaseAPITestCase):
+
+    def get_url(self):
+        return reverse('loans:preview-cache')
+
+    def test_preview_cache_by_client(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+        response = self.client.get(self.get_url())
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_preview_cache_by_admin(self):
+        data = {'financing': PRICE_SYSTEM, 'value': 20000, 'interest_rate': 4, 'period': 8}
+        self.client.get(reverse('loans:preview'), data)
+        self.client.get(reverse('loans:preview'), data)
+
+        response = self.client.get(self.get_url())
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(response.json()['hits'], 1)
+        self.assertIn('evictions', response.json())
@@ -0,0 +1,273 @@
+# python
+from datetime import datetime
+from decimal import Decimal
+from decimal import ROUND_FLOOR
+from decimal import ROUND_HALF_UP
+from unittest import mock
+
+# django
+from django.test import SimpleTestCase
+from django.test import override_settings
+from django.utils.timezone import utc
+
+# third party
+import numpy as np
+
+# project
+from core.cache import LRUCache
+
+# local
+from loans.constants import AWAITING_PAYMENT
+from loans.constants import DUE
+from loans.constants import PAID
+from loans.constants import PRICE_SYSTEM
+from loans.constants import SAC_SYSTEM
+from loans.utils import PACKED_INSTALLMENT
+from loans.utils import PackedSchedule
+from loans.utils import make_amortization
+from loans.utils import make_amount_due
+from loans.utils import make_cached_schedule
+from loans.utils import make_due_dates
+from loans.utils import make_installment
+from loans.utils import make_schedule
+from loans.utils import make_schedules
+from loans.utils import make_schedules_cents
+from loans.utils import preview_cache
+
+
+class TestMakeSchedule(SimpleTestCase):
+
+    terms = [(20000.0, 0.04, 8), (120000.0, 0.05, 10), (1000.0, 0.01, 3), (50000.0, 0.05, 60),
+             (350000.0, 0.01, 360), (500000.0, 0.01, 420), (0.07, 0.03, 12),
+             # interest products past the float precision
+             (500000000.0, 0.05, 24)]
+
+    def loop_schedule(self, financing, value, interest_rate, period):
+        """
+        reference schedule built one installment at a time with decimals
+        """
+        balance = Decimal(str(value))
+        interest_rate = Decimal(str(interest_rate))
+        cent = Decimal('0.01')
+
+        if financing == PRICE_SYSTEM:
+            installment = Decimal(str(make_installment(value, interest_rate, period)))
+        else:
+            amortization = (balance / period).quantize(cent, ROUND_FLOOR)
+
+        rows = []
+        for p in range(period):
+            interest_amount = (balance * interest_rate).quantize(cent, ROUND_HALF_UP)
+            if p == period - 1:
+                amortization = balance
+            elif financing == PRICE_SYSTEM:
+                amortization = installment - interest_amount
+            balance -= amortization
+            rows.append((amortization + interest_amount, interest_amount, amortization, balance))
+        return rows
+
+    def test_schedule_matches_loop(self):
+        for financing in (PRICE_SYSTEM, SAC_SYSTEM):
+            for value, interest_rate, period in self.terms:
+                schedule = make_schedule(financing, value, interest_rate, period)
+                rows = self.loop_schedule(financing, value, interest_rate, period)
+
+                self.assertEqual(len(schedule.installments), period)
+                self.assertEqual(list(zip(*(array.tolist() for array in schedule[:4]))),
+                                 [tuple(float(amount) for amount in row) for row in rows])
+
+    def test_schedules_match_schedule(self):
+        financing, value, interest_rate, period = zip(
+            *((financing, *terms) for financing in (PRICE_SYSTEM, SAC_SYSTEM) for terms in self.terms))
+        schedules = make_schedules(financing, value, interest_rate, period)
+
+        for index, row in enumerate(zip(financing, value, interest_rate, period)):
+            schedule = make_schedule(*row)
+            for array, batch_array in zip(schedule[:4], schedules[:4]):
+                self.assertEqual(array.tolist(), batch_array[index, :row[3]].tolist())
+            self.assertEqual(schedule.amount_due, schedules.amount_due[index])
+
+    def test_schedules_cents_are_exact(self):
+        # property over a grid of terms: the installments add up to the
+        # amount due and the last one leaves the balance at exactly zero
+        grid = [(financing, value, interest_rate, period)
+                for financing in (PRICE_SYSTEM, SAC_SYSTEM)
+                for value in (0.01, 1.0, 999.99, 20000.0, 123456.78, 1000000.0, 98765432.1)
+                for interest_rate in (0.0001, 0.0075, 0.01, 0.0199, 0.05, 0.1)
+                for period in (1, 2, 7, 12, 60, 180, 360, 420)]
+        schedules = make_schedules_cents(*zip(*grid))
+
+        for index, (financing, value, interest_rate, period) in enumerate(grid):
+            installments = schedules.installments[index, :period]
+            self.assertEqual(installments.dtype, np.int64)
+            self.assertEqual(installments.sum(), schedules.amount_due[index])
+            self.assertEqual(schedules.amortizations[index].sum(), round(value * 100))
+            self.assertEqual(schedules.balances[index, period - 1], 0)
+            parts = schedules.amortizations[index, :period] + schedules.interest_amounts[index, :period]
+            self.assertEqual(installments.tolist(), parts.tolist())
+
+            if financing == PRICE_SYSTEM:
+                # only the last installment takes the rounding residual
+                self.assertEqual(len(set(installments[:-1].tolist())), min(1, period - 1))
+
+    def test_schedule_large_values(self):
+        for financing in (PRICE_SYSTEM, SAC_SYSTEM):
+            schedule = make_schedules_cents([financing], [10 ** 15], [0.05], [12])
+
+            self.assertEqual(schedule.installments.dtype, object)
+            self.assertEqual(schedule.installments.sum(), schedule.amount_due[0])
+            self.assertEqual(schedule.balances[0, -1], 0)
+            self.assertEqual(make_schedule(financing, 10 ** 15, 0.05, 12).amount_due,
+                             schedule.amount_due[0] / 100)
+
+    def test_price_amount_due(self):
+        schedule = make_schedule(PRICE_SYSTEM, 20000.0, 0.04, 8)
+
+        self.assertEqual(schedule.installments.tolist(), [2970.56] * 7 + [2970.53])
+        self.assertEqual(schedule.amount_due, 23764.45)
+        self.assertEqual(make_amount_due(PRICE_SYSTEM, 20000.0, 0.04, 8), 23764.45)
+        self.assertEqual(schedule.balances[-1], 0)
+
+    def test_sac_amount_due(self):
+        schedule = make_schedule(SAC_SYSTEM, 120000.0, 0.05, 10)
+
+        self.assertEqual(schedule.amount_due, 153000.0)
+        self.assertEqual(schedule.balances[-1], 0)
+
+    def test_sac_amortization_remainder(self):
+        schedule = make_schedule(SAC_SYSTEM, 1000.0, 0.01, 3)
+
+        self.assertEqual(make_amortization(1000.0, 3), 333.33)
+        self.assertEqual(schedule.amortizations.tolist(), [333.33, 333.33, 333.34])
+        self.assertEqual(schedule.balances[-1], 0)
+
+    def test_unknown_financing(self):
+        schedule = make_schedule(0, 1000.0, 0.01, 10)
+
+        self.assertEqual(len(schedule.installments), 0)
+        self.assertEqual(schedule.amount_due, 0)
+
+
+class TestMakeDueDates(SimpleTestCase):
+
+    def test_due_dates_clamp_month_end(self):
+        start = datetime(2021, 1, 31, 12, 30, tzinfo=utc)
+
+        due_dates = make_due_dates(start, 4)
+
+        self.assertEqual(due_dates, [
+            datetime(2021, 2, 28, 12, 30, tzinfo=utc),
+            datetime(2021, 3, 31, 12, 30, tzinfo=utc),
+            datetime(2021, 4, 30, 12, 30, tzinfo=utc),
+            datetime(2021, 5, 31, 12, 30, tzinfo=utc)])
+
+    def test_due_dates_year_rollover(self):
+        start = datetime(2021, 11, 15, tzinfo=utc)
+
+        due_dates = make_due_dates(start, 360)
+
+        self.assertEqual(len(due_dates), 360)
+        self.assertEqual(due_dates[1], datetime(2022, 1, 15, tzinfo=utc))
+        self.assertEqual(due_dates[-1], datetime(2051, 11, 15, tzinfo=utc))
+
+
+class TestPackedSchedule(SimpleTestCase):
+
+    def setUp(self):
+        self.start = datetime(2021, 1, 31, 12, 30, tzinfo=utc)
+        self.schedule = make_schedule(PRICE_SYSTEM, 20000.0, 0.04, 8)
+        self.packed = PackedSchedule.pack(self.schedule, self.start, make_due_dates(self.start, 8))
+
+    def test_pack_schedule(self):
+        self.assertEqual(len(self.packed), 8)
+        self.assertEqual(len(self.packed.data), 8 * PACKED_INSTALLMENT.itemsize)
+
+        rows = self.packed.get_rows(self.start)
+
+        self.assertEqual([row['installment'] for row in rows], list(range(1, 9)))
+        self.assertEqual([row['due_date'] for row in rows], make_due_dates(self.start, 8))
+        # the rounding remainder is in the last installment
+        self.assertEqual([row['value'] for row in rows], [Decimal('2970.56')] * 7 + [Decimal('2970.53')])
+        self.assertEqual(sum(row['value'] for row in rows), Decimal(str(self.schedule.amount_due)))
+        self.assertEqual(rows[0]['interest_amount'], Decimal('800.00'))
+        self.assertEqual(rows[0]['amortization'], Decimal('2170.56'))
+        self.assertEqual({row['status'] for row in rows}, {AWAITING_PAYMENT})
+        self.assertEqual({row['pay_date'] for row in rows}, {None})
+        self.assertEqual({row['modified'] for row in rows}, {self.start})
+
+    def test_replace_installments(self):
+        pay_date = datetime(2021, 3, 1, tzinfo=utc)
+
+        paid = self.packed.replace([0, 2], status=PAID, pay_date=pay_date, modified=pay_date)
+
+        self.assertEqual(self.packed.get_paid_total(), Decimal('0.00'))
+        self.assertEqual(paid.get_paid_total(), Decimal('5941.12'))
+        rows = paid.get_rows(self.start, [0, 1, 2])
+        self.assertEqual([row['installment'] for row in rows], [1, 2, 3])
+        self.assertEqual([row['status'] for row in rows], [PAID, AWAITING_PAYMENT, PAID])
+        self.assertEqual([row['pay_date'] for row in rows], [pay_date, None, pay_date])
+
+    def test_due_before(self):
+        until = datetime(2021, 4, 30, 12, 30, tzinfo=utc)
+
+        self.assertEqual(self.packed.get_due_before(self.start, until), [0, 1])
+
+        due = self.packed.replace([0], status=DUE)
+        self.assertEqual(due.get_due_before(self.start, until), [1])
+        self.assertEqual(due.get_due_before(self.start, until, status=DUE), [0])
+
+
+class TestLRUCache(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['hits'], 3)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_expires_entries(self):
+        cache = LRUCache(timeout=10)
+
+        with mock.patch('core.cache.time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('core.cache.time.monotonic', return_value=105):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('core.cache.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('a'))
+
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    @override_settings(CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_backend(self):
+        LRUCache(backend='shared', key_prefix='test').set(('a', 1), 'value')
+        cache = LRUCache(backend='shared', key_prefix='test')
+
+        self.assertEqual(cache.get(('a', 1)), 'value')
+        self.assertEqual(cache.get(('a', 1)), 'value')
+        self.assertEqual(cache.stats()['backend_hits'], 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+
+class TestMakeCachedSchedule(SimpleTestCase):
+
+    def setUp(self):
+        preview_cache.clear()
+        preview_cache.reset_stats()
+
+    def test_cached_schedule(self):
+        schedule = make_cached_schedule(PRICE_SYSTEM, 20000.0, 0.04, 8)
+
+        self.assertIs(make_cached_schedule(PRICE_SYSTEM, 20000.0, 0.04, 8), schedule)
+        self.assertEqual(schedule.amount_due, make_schedule(PRICE_SYSTEM, 20000.0, 0.04, 8).amount_due)
+        self.assertFalse(schedule.installments.flags.writeable)
+        self.assertEqual(preview_cache.stats()['hits'], 1)
+        self.assertEqual(preview_cache.stats()['misses'], 1)
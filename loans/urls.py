@@ -10,7 +10,14 @@ urlpatterns = [
     path('loans/', include([
         path('', views.LoanListAPIView.as_view(), name='list'),
         path('create/', views.LoanCreateAPIView.as_view(), name='create'),
+        path('create/bulk/', views.LoanBulkCreateAPIView.as_view(), name='bulk-create'),
         path('preview/', views.LoanPreviewAPIView.as_view(), name='preview'),
+        path('preview/batch/', views.LoanPreviewBatchAPIView.as_view(), name='preview-batch'),
+        path('preview/cache/', views.LoanPreviewCacheAPIView.as_view(), name='preview-cache'),
+        path('export/', views.LoanExportAPIView.as_view(), name='export'),
+        path('payments/export/', views.PaymentExportAPIView.as_view(), name='payments-export'),
+        path('payments/analytics/', views.PaymentAnalyticsAPIView.as_view(), name='payments-analytics'),
+        path('payments/update/bulk/', views.PaymentBulkUpdateAPIView.as_view(), name='payments-bulk-update'),
 
         path('<loan_pk>/', include([
             path('', views.LoanRetrieveAPIView.as_view(), name='retrieve'),
@@ -1,45 +1,411 @@
 # python
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
 from decimal import Decimal
+from itertools import repeat
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
 from typing import Union
 
+# django
+from django.conf import settings
+from django.utils.functional import cached_property
+
+# third party
+import numpy as np
+
 # project
+from core.cache import LRUCache
+
+# local
+from .constants import AWAITING_PAYMENT
+from .constants import PAID
 from .constants import PRICE_SYSTEM
 from .constants import SAC_SYSTEM
 
 
+preview_cache = LRUCache(
+    max_size=settings.LOAN_PREVIEW_CACHE['MAX_SIZE'],
+    timeout=settings.LOAN_PREVIEW_CACHE['TIMEOUT'],
+    backend=settings.LOAN_PREVIEW_CACHE['BACKEND'],
+    key_prefix='loans:preview')
+
+
+# interest rates are fixed point numbers with 8 decimal places, eg 1% is
+# 1000000, so the interest on a balance in cents is an integer division
+RATE_SCALE = 10 ** 8
+
+
+class Schedule(NamedTuple):
+    """
+    amortization schedule, one array item per installment
+    (or one array row per scenario for batches)
+
+    The amounts are computed in integer cents, see `make_schedules_cents`,
+    and the float arrays hold them divided by 100, which DecimalFields
+    quantize back to the same cents.
+    """
+    installments: np.ndarray
+    interest_amounts: np.ndarray
+    amortizations: np.ndarray
+    balances: np.ndarray
+    amount_due: Union[float, np.ndarray]
+
+
+def to_cents(values: Union[Sequence[Union[Decimal, float]], np.ndarray]) -> np.ndarray:
+    """
+    amounts rounded to integer cents
+    """
+    return np.rint(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+
+
+def to_rate(values: Union[Sequence[Union[Decimal, float]], np.ndarray]) -> np.ndarray:
+    """
+    interest rates as fixed point integers, see `RATE_SCALE`
+    """
+    return np.rint(np.asarray(values, dtype=np.float64) * RATE_SCALE).astype(np.int64)
+
+
+def make_price_installments(value: np.ndarray, rate: np.ndarray, period: np.ndarray) -> np.ndarray:
+    """
+    fixed installments in cents for price system, from the values in cents
+    and the fixed point rates
+    """
+    value = value.astype(np.float64)
+    interest_rate = rate.astype(np.float64) / RATE_SCALE
+    period = np.maximum(period.astype(np.float64), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        installments = np.where(
+            interest_rate > 0, value * interest_rate / (1 - (1 + interest_rate) ** -period), value / period)
+    return np.rint(installments).astype(np.int64)
+
+
+def make_price_installment(value: int, rate: int, period: int) -> int:
+    """
+    make_price_installments of a single loan on python floats, the same
+    operations so the same cents
+    """
+    interest_rate = rate / RATE_SCALE
+    period = max(period, 1)
+    return round(value * interest_rate / (1 - (1 + interest_rate) ** -period) if interest_rate > 0 else value / period)
+
+
 def make_installment(value: Union[Decimal, float], interest_rate: Union[Decimal, float], period: int) -> float:
     """
     fixed installments for price system
     """
-    interest_rate = float(interest_rate)
-
-    data = (1 + interest_rate) ** period
-    data = (data * interest_rate) / (data - 1)
-    return round(float(value) * data, 2)
+    return make_price_installment(to_cents([value]).item(), to_rate([interest_rate]).item(), period) / 100
 
 
 def make_amortization(value: Union[Decimal, float], period: int) -> float:
     """
-    fixed amortization for SAC system
+    fixed amortization for SAC system, the last one takes the remaining cents
     """
-    return round(float(value) / period)
+    return (to_cents([value]).item() // period) / 100
 
 
-def make_amount_due(financing: int, value: float, interest_rate: float, period: int) -> float:
+def make_interest_amounts(balances: np.ndarray, rate: np.ndarray) -> np.ndarray:
+    """
+    interest in cents of the balances in cents, rounded half up
+    """
+    return (balances * rate + RATE_SCALE // 2) // RATE_SCALE
+
+
+def make_schedule_rows(financing: np.ndarray, value: np.ndarray, rate: np.ndarray, period: np.ndarray,
+                       installment: np.ndarray, balances: np.ndarray) -> Schedule:
+    """
+    schedules in cents from the price installments and the outstanding
+    balance before each installment, rows are scenarios and columns are
+    installments padded with zeros. The last installment amortizes the
+    whole remaining balance, so the rounding residual is paid with it and
+    the balance reaches exactly zero.
+    """
+    months = np.arange(balances.shape[1])
+    price = financing == PRICE_SYSTEM
+    paying = (months < period) & (price | (financing == SAC_SYSTEM))
+    last = months == period - 1
+
+    interest_amounts = np.where(paying, make_interest_amounts(balances, rate), 0)
+    fixed = np.where(price, installment - interest_amounts, value // np.maximum(period, 1))
+    amortizations = np.where(paying, np.where(last, balances, fixed), 0)
+    installments = amortizations + interest_amounts
+
+    balances = np.where(paying, value - np.cumsum(amortizations, axis=1), 0)
+    return Schedule(installments, interest_amounts, amortizations, balances, installments.sum(axis=1))
+
+
+def make_period_groups(period: Union[Sequence[int], np.ndarray]) -> List[np.ndarray]:
+    """
+    indexes of the rows grouped by the bit length of their period, so the
+    periods of a group are at most twice as long as each other
+    """
+    groups = np.frexp(np.maximum(np.asarray(period, dtype=np.int64), 1))[1]
+    return [np.flatnonzero(groups == group) for group in np.unique(groups)]
+
+
+def make_period_schedules_cents(financing: np.ndarray, value: np.ndarray, rate: np.ndarray,
+                                period: np.ndarray) -> Schedule:
+    """
+    amortization schedules in integer cents of rows with similar periods,
+    from the columns of cents, fixed point rates and periods
+    """
+    # sac: fixed amortization, the balances in closed form
+    months = np.arange(period.max(initial=0))
+    balances = value - value // np.maximum(period, 1) * months
+
+    # price: fixed installments, each balance depends on the rounded
+    # interest of the previous one so they are computed month by month
+    installment = make_price_installments(value, rate, period)
+    price = (financing == PRICE_SYSTEM)[:, 0] & (period[:, 0] > 0)
+    if price.any():
+        balance, price_installment = value[price, 0], installment[price, 0]
+        price_rate, price_period = rate[price, 0], period[price, 0]
+
+        columns = []
+        for month in range(price_period.max()):
+            columns.append(balance)
+            amortization = price_installment - make_interest_amounts(balance, price_rate)
+            balance = np.where(month < price_period - 1, balance - amortization, balance)
+        balances[price, :len(columns)] = np.stack(columns, axis=1)
+
+    return make_schedule_rows(financing, value, rate, period, installment, balances)
+
+
+def make_schedules_cents(financing: Sequence[int], value: Sequence[Union[Decimal, float]],
+                         interest_rate: Sequence[Union[Decimal, float]], period: Sequence[int]) -> Schedule:
+    """
+    amortization schedules of many scenarios in integer cents, rows are
+    scenarios and columns are installments padded with zeros
+
+    The rows are computed in groups of periods of the same bit length, so
+    a long loan doesn't make the month by month loop and the padding of
+    all the others as long as itself.
+    """
+    financing = np.asarray(financing)[:, None]
+    value = to_cents(value)[:, None]
+    rate = to_rate(interest_rate)[:, None]
+    period = np.asarray(period, dtype=np.int64)[:, None]
+
+    # python integers when the interest products don't fit 64 bits
+    if value.size and int(value.max()) * int(rate.max()) >= 2 ** 62:
+        value, rate = value.astype(object), rate.astype(object)
+
+    groups = make_period_groups(period[:, 0])
+    if len(groups) < 2:
+        return make_period_schedules_cents(financing, value, rate, period)
+
+    shape = (len(period), int(period.max()))
+    schedules = Schedule(*(np.zeros(shape, dtype=value.dtype) for column in range(4)),
+                         np.zeros(len(period), dtype=value.dtype))
+    for rows in groups:
+        schedule = make_period_schedules_cents(financing[rows], value[rows], rate[rows], period[rows])
+        for column, group_column in zip(schedules[:4], schedule[:4]):
+            column[rows, :group_column.shape[1]] = group_column
+        schedules.amount_due[rows] = schedule.amount_due
+    return schedules
+
+
+def make_schedules(financing: Sequence[int], value: Sequence[Union[Decimal, float]],
+                   interest_rate: Sequence[Union[Decimal, float]], period: Sequence[int]) -> Schedule:
+    """
+    amortization schedules of many scenarios computed together, rows are
+    scenarios and columns are installments padded with zeros
+    """
+    schedules = make_schedules_cents(financing, value, interest_rate, period)
+    return Schedule(*(np.asarray(array / 100, dtype=np.float64) for array in schedules))
+
+
+def make_price_balances(value: int, rate: int, installment: int, period: int) -> np.ndarray:
+    """
+    balance in cents before each price installment and after the last one,
+    each balance depends on the rounded interest of the previous one so
+    they are computed month by month. On floats while the products are
+    exact in them, which is faster, otherwise on python integers.
+    """
+    exact = value * rate < 2 ** 53
+    numbers = float if exact else int
+    balance, rate, installment = numbers(value), numbers(rate), numbers(installment)
+    half, scale = numbers(RATE_SCALE // 2), numbers(RATE_SCALE)
+
+    balances = [balance] + [balance := balance + (balance * rate + half) // scale - installment
+                            for month in repeat(None, period)]
+
+    dtype = np.float64 if exact else object if value * rate >= 2 ** 62 else np.int64
+    return np.array(balances, dtype=dtype)
+
+
+def make_schedule(financing: int, value: Union[Decimal, float], interest_rate: Union[Decimal, float],
+                  period: int) -> Schedule:
+    """
+    whole amortization schedule of a single loan, the make_schedules_cents
+    rules on one row without the padding of the batches. The SAC balances
+    and interest are in closed form, the price ones follow the rounded
+    interest month by month, see `make_price_balances`.
+    """
+    if financing not in (PRICE_SYSTEM, SAC_SYSTEM) or period < 1:
+        empty = np.zeros(0)
+        return Schedule(empty, empty, empty, empty, 0)
+
+    # like to_cents and to_rate, rounding half to even
+    value, rate = round(float(value) * 100), round(float(interest_rate) * RATE_SCALE)
+    # python integers when the interest products don't fit 64 bits
+    dtype = object if value * rate >= 2 ** 62 else np.int64
+
     if financing == PRICE_SYSTEM:
-        installment = make_installment(value, interest_rate, period)
+        fixed = make_price_installment(value, rate, period)
+        balances = make_price_balances(value, rate, fixed, period)
+        amortizations = balances[:-1] - balances[1:]
+        interest_amounts = fixed - amortizations
+        balances = balances[1:]
+    else:
+        fixed = value // period
+        balances = value - fixed * np.arange(1, period + 1, dtype=dtype)
+        interest_amounts = make_interest_amounts(balances + fixed, rate)
+        amortizations = np.full(period, fixed, dtype=dtype)
+
+    # the last installment amortizes the remaining balance
+    amortizations[-1] += balances[-1]
+    balances[-1] = 0
+    installments = amortizations + interest_amounts
+
+    columns = np.array((installments, interest_amounts, amortizations, balances), dtype=np.float64) / 100
+    return Schedule(*columns, float(installments.sum() / 100))
+
+
+def make_cached_schedule(financing: int, value: Union[Decimal, float], interest_rate: Union[Decimal, float],
+                         period: int) -> Schedule:
+    """
+    make_schedule memoized in the preview cache, schedules don't depend on
+    dates so they are shared by every request with the same loan terms
+    """
+    def make_frozen_schedule():
+        schedule = make_schedule(financing, value, interest_rate, period)
+        for column in schedule[:4]:
+            column.flags.writeable = False
+        return schedule
+
+    key = (financing, float(value), float(interest_rate), period)
+    return preview_cache.get_or_set(key, make_frozen_schedule)
+
+
+def make_due_dates(start: datetime, period: int) -> List[datetime]:
+    """
+    monthly due dates after start, the day is clamped to the month length
+    """
+    months = np.datetime64(start.date(), 'M') + np.arange(1, period + 1)
+    first_days = months.astype('datetime64[D]')
+    month_days = (months + 1).astype('datetime64[D]') - first_days
+    days = first_days + np.minimum(start.day, month_days.astype(int)) - 1
+
+    time = start.timetz()
+    return [datetime.combine(day, time) for day in days.tolist()]
+
+
+def make_amount_due(financing: int, value: float, interest_rate: float, period: int) -> float:
+    return make_schedule(financing, value, interest_rate, period).amount_due
+
+
+# a packed installment: the amounts in integer cents, the due date in days
+# after the loan creation and the pay and modified dates in microseconds
+# after the epoch, 0 when unset
+PACKED_INSTALLMENT = np.dtype([
+    ('value', '<i8'), ('interest_amount', '<i8'), ('amortization', '<i8'), ('due_days', '<i4'),
+    ('status', 'u1'), ('pay_date', '<i8'), ('modified', '<i8')])
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_microseconds(at: Optional[datetime]) -> int:
+    return (at - EPOCH) // timedelta(microseconds=1) if at else 0
+
+
+def from_microseconds(value: int) -> Optional[datetime]:
+    return EPOCH + timedelta(microseconds=value) if value else None
+
+
+def from_cents(value: int) -> Decimal:
+    return Decimal(value).scaleb(-2)
+
+
+class PackedSchedule:
+    """
+    Installments of a loan packed in one bytes value, a `PACKED_INSTALLMENT`
+    record each in installment order. The buffer is read in place when a
+    field is accessed, eg the paid total only reads the value and status
+    columns, and the changes make a new one.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = bytes(data)
+
+    @classmethod
+    def pack(cls, schedule: Schedule, start: datetime, due_dates: Sequence[datetime]) -> 'PackedSchedule':
+        """
+        installments of `schedule` awaiting payment, due at `due_dates`
+        counted from `start`
+        """
+        records = np.zeros(len(schedule.installments), dtype=PACKED_INSTALLMENT)
+        records['value'] = to_cents(schedule.installments)
+        records['interest_amount'] = to_cents(schedule.interest_amounts)
+        records['amortization'] = to_cents(schedule.amortizations)
+        records['due_days'] = [(due_date.date() - start.date()).days for due_date in due_dates[:len(records)]]
+        records['status'] = AWAITING_PAYMENT
+        records['modified'] = to_microseconds(start)
+        return cls(records.tobytes())
+
+    def __len__(self):
+        return len(self.data) // PACKED_INSTALLMENT.itemsize
+
+    @cached_property
+    def records(self) -> np.ndarray:
+        # read-only view of the buffer, nothing is decoded yet
+        return np.frombuffer(self.data, dtype=PACKED_INSTALLMENT)
+
+    def get_paid_total(self) -> Decimal:
+        return from_cents(int(self.records['value'][self.records['status'] == PAID].sum()))
 
-        return round(installment * period, 2)
+    def get_due_before(self, start: datetime, until: datetime, status: int = AWAITING_PAYMENT,
+                       since: Optional[datetime] = None) -> List[int]:
+        """
+        indexes of the installments with `status` due before `until`, and
+        from `since` if set, the due dates counted from `start`
+        """
+        due = to_microseconds(start) + self.records['due_days'].astype(np.int64) * (24 * 3600 * 10 ** 6)
+        matches = (self.records['status'] == status) & (due < to_microseconds(until))
+        if since is not None:
+            matches &= due >= to_microseconds(since)
+        return np.flatnonzero(matches).tolist()
 
-    elif financing == SAC_SYSTEM:
-        amount_due = 0
-        amortization = make_amortization(value, period)
+    def get_value_total(self, indexes: Sequence[int]) -> Decimal:
+        return from_cents(int(self.records['value'][list(indexes)].sum()))
 
-        for p in range(period):
-            interest_amount = round(value * interest_rate, 2)
-            installment = amortization + interest_amount
-            value -= amortization
-            amount_due += installment
-        return round(amount_due, 2)
+    def get_rows(self, start: datetime, indexes: Optional[Sequence[int]] = None) -> List[dict]:
+        """
+        decoded installments at `indexes`, all by default, with their
+        number and their due date counted from `start`
+        """
+        indexes = range(len(self)) if indexes is None else indexes
+        return [{
+            'installment': index + 1,
+            'value': from_cents(value),
+            'interest_amount': from_cents(interest_amount),
+            'amortization': from_cents(amortization),
+            'due_date': start + timedelta(days=due_days),
+            'status': status,
+            'pay_date': from_microseconds(pay_date),
+            'modified': from_microseconds(modified)}
+            for index, (value, interest_amount, amortization, due_days, status, pay_date, modified)
+            in zip(indexes, self.records[list(indexes)].tolist())]
 
-    return 0
+    def replace(self, indexes: Sequence[int], **fields) -> 'PackedSchedule':
+        """
+        copy with the `status`, `pay_date` or `modified` of the installments
+        at `indexes` changed
+        """
+        records = self.records.copy()
+        for name, value in fields.items():
+            records[name][list(indexes)] = to_microseconds(value) if name in ('pay_date', 'modified') else value
+        return PackedSchedule(records.tobytes())
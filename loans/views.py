@@ -1,14 +1,34 @@
 # python
 import logging
+from bisect import bisect_left
+from bisect import bisect_right
+from itertools import chain
+from datetime import datetime
+from datetime import time
+from decimal import Decimal
 
 # django
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models import Q
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+from django.utils.timezone import get_default_timezone
+from django.utils.timezone import make_aware
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 
 # third party
-from dateutil.relativedelta import relativedelta
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import status
+from rest_framework.exceptions import NotFound
 from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.generics import CreateAPIView
+from rest_framework.generics import GenericAPIView
 from rest_framework.generics import ListAPIView
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.generics import UpdateAPIView
@@ -20,31 +40,54 @@ from rest_framework.views import APIView
 
 # project
 from core.utils import get_ip_address
+from core.utils import make_etag
 
 # local
+from .constants import AWAITING_PAYMENT
+from .constants import DUE
 from .constants import LOAN_FINANCING_MAP
-from .constants import PRICE_SYSTEM
-from .constants import SAC_SYSTEM
+from .constants import MAX_PERIOD
+from .constants import PACKED_STORAGE
+from .constants import PAID
+from .constants import PAYMENT_OPEN_STATUSES
+from .filters import FullTextSearchFilter
 from .filters import LoanFilterSet
+from .filters import PaymentAnalyticsFilterSet
 from .filters import PaymentFilterSet
+from .mixins import ConditionalGetMixin
+from .mixins import ExportMixin
 from .mixins import LoanMixin
 from .mixins import PaymentMixin
+from .mixins import ReplicaMixin
 from .models import Loan
 from .models import Payment
+from .models import PaymentSummary
+from .models import get_packed_loan_range
+from .models import make_month
+from .models import summarize_payments
+from .models import summarize_schedules
 from .permissions import LoanPermission
+from .serializers import LoanBulkCreateSerializer
 from .serializers import LoanCreateSerializer
+from .serializers import LoanListSerializer
 from .serializers import LoanSerializer
+from .serializers import PaymentBulkUpdateSerializer
+from .serializers import PaymentListSerializer
 from .serializers import PaymentSerializer
 from .serializers import PaymentUpdateSerializer
-from .utils import make_amortization
-from .utils import make_installment
+from .services import create_loans
+from .utils import Schedule
+from .utils import make_cached_schedule
+from .utils import make_due_dates
+from .utils import make_schedules
+from .utils import preview_cache
 
 logger = logging.getLogger(__name__)
 
 
 # Loan
 
-class LoanCreateAPIView(CreateAPIView):
+class LoanCreateAPIView(ReplicaMixin, CreateAPIView):
     """
     Loan Create
 
@@ -62,36 +105,133 @@ class LoanCreateAPIView(CreateAPIView):
         serializer.save(ip_address=ip_address)
 
 
-class LoanListAPIView(LoanMixin, ListAPIView):
+class LoanBulkCreateAPIView(ReplicaMixin, GenericAPIView):
+    """
+    Loan Bulk Create
+
+    * Requires authentication
+    * Only admin users can access this view
+    * Receives a list of `loans`, each one with the loan create fields. The
+      valid ones are created together with their payments in one
+      transaction, and the results are listed in the same order, with the
+      errors of the invalid ones
+    """
+
+    queryset = Loan.objects.all()
+    serializer_class = LoanBulkCreateSerializer
+    permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, IsAdminUser]
+    error_loans = _('Deve ser uma lista com 1 a {max_loans} empréstimos')
+
+    # Set to an integer to limit the number of loans per request.
+    max_loans = 1000
+
+    def post(self, request, *args, **kwargs):
+        items = request.data.get('loans')
+        if not isinstance(items, list) or not 0 < len(items) <= self.max_loans:
+            raise ValidationError({'loans': self.error_loans.format(max_loans=self.max_loans)})
+
+        loans, results = self.make_loans(items)
+        create_loans(loans)
+
+        return Response({'created': len(loans), 'results': results}, status=status.HTTP_201_CREATED)
+
+    def make_loans(self, items):
+        """
+        unsaved loans of the valid items, the clients are looked up in one
+        query
+        """
+        client_ids = set(User.objects.filter(pk__in=[
+            item['client'] for item in items if isinstance(item, dict) and str(item.get('client', '')).isdigit()
+        ]).values_list('pk', flat=True))
+        ip_address = get_ip_address(self.request)
+
+        loans = []
+        results = []
+        context = {**self.get_serializer_context(), 'client_ids': client_ids}
+        for item in items:
+            serializer = self.get_serializer_class()(data=item, context=context)
+            if not serializer.is_valid():
+                results.append({'errors': serializer.errors})
+                continue
+
+            data = serializer.validated_data
+            loan = Loan(client_id=data.pop('client'), ip_address=ip_address, **data)
+            loans.append(loan)
+            results.append({'id': str(loan.pk)})
+        return loans, results
+
+
+class LoanListAPIView(ReplicaMixin, LoanMixin, ListAPIView):
     """
     Loan List
 
     * Requires authentication
     * Only client or admin users can access this view
+    * `?search=` matches the words of the bank and client username starting
+      with the terms, ordered by rank
     """
 
     queryset = Loan.objects.all()
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filter_class = LoanFilterSet
-    serializer_class = LoanSerializer
+    serializer_class = LoanListSerializer
     search_fields = [
         'client__username', 'bank']
     ordering_fields = [
         'created', 'modified']
 
+    def get_queryset(self):
+        return self.get_serializer_class().get_values(super().get_queryset())
+
+
+class LoanExportAPIView(ReplicaMixin, LoanMixin, ExportMixin, GenericAPIView):
+    """
+    Loan Export
+
+    * Requires authentication
+    * Only client or admin users can access this view
+    * Streams the loans as csv or ndjson, with the loan list filters
+    """
+
+    queryset = Loan.objects.all()
+    filter_backends = LoanListAPIView.filter_backends
+    filter_class = LoanFilterSet
+    search_fields = LoanListAPIView.search_fields
+    ordering_fields = LoanListAPIView.ordering_fields
+    export_filename = 'loans'
 
-class LoanRetrieveAPIView(LoanMixin, RetrieveAPIView):
+
+class LoanRetrieveAPIView(ReplicaMixin, LoanMixin, ConditionalGetMixin, RetrieveAPIView):
     """
     Loan Retrieve
 
     * Requires authentication
     * Only client or admin users can access this view
+    * Supports conditional requests with `If-None-Match` and
+      `If-Modified-Since`, the loan `modified` changes with its balances
     """
 
     queryset = Loan.objects.all()
     serializer_class = LoanSerializer
 
+    # fetched once for the validators and the response
+    object = None
+
+    def get_object(self):
+        if self.object is None:
+            self.object = super().get_object()
+        return self.object
+
+    def get_validators(self):
+        loan = self.get_object()
+        client = loan.client
+        etag = make_etag(
+            self.request.accepted_renderer.format, loan.pk, loan.modified, client.username, client.email,
+            client.first_name, client.last_name, client.is_staff, client.is_superuser)
+        return etag, loan.modified
 
-class LoanPreviewAPIView(APIView):
+
+class LoanPreviewAPIView(ReplicaMixin, APIView):
     """
     Loan Preview
 
@@ -106,103 +246,512 @@ class LoanPreviewAPIView(APIView):
         'period': _('Não pode ser vazio, deve ser um inteiro positivo')}
 
     def get(self, request, *args, **kwargs):
-        data = request.GET
-
         # validation get data
         try:
-            financing = int(data.get('financing'))
-            assert financing in LOAN_FINANCING_MAP
-
-            value = float(data.get('value'))
-            interest_rate = float(data.get('interest_rate')) / 100.0
-            period = int(data.get('period'))
-        except (TypeError, AssertionError) as err:
+            financing, value, interest_rate, period = self.parse_scenario(request.GET)
+        except (AttributeError, TypeError, ValueError, AssertionError) as err:
             logger.error("LoanPreviewAPIView", err)
             raise ValidationError(self.error_exception)
 
-        # loan preview payments
-        due_date = now()
-        loan_value = value
-        amount_due = 0
-        pyment_order = 1
-        payments = []
-
-        if financing == PRICE_SYSTEM:
-            installment = make_installment(value, interest_rate, period)
-
-            for p in range(period):
-                due_date += relativedelta(months=1)
-                interest_amount = round(value * interest_rate, 2)
-                amortization = round(installment - interest_amount, 2)
-                value -= amortization
-                amount_due += installment
-
-                payment = {
-                    'payment': pyment_order,
-                    'value': installment,
-                    'due_date': due_date,
-                    'interest_amount': interest_amount,
-                    'amortization': amortization}
-                payments.append(payment)
-                pyment_order += 1
-
-        elif financing == SAC_SYSTEM:
-            amortization = make_amortization(value, period)
-
-            for p in range(period):
-                due_date += relativedelta(months=1)
-                interest_amount = round(value * interest_rate, 2)
-                installment = amortization + interest_amount
-                value -= amortization
-                amount_due += installment
-
-                payment = {
-                    'payment': pyment_order,
-                    'value': installment,
-                    'due_date': due_date,
-                    'interest_amount': interest_amount,
-                    'amortization': amortization}
-                payments.append(payment)
-                pyment_order += 1
+        # loan preview payments, only the due dates depend on the request
+        schedule = make_cached_schedule(financing, value, interest_rate, period)
+        due_dates = make_due_dates(now(), period)
 
         loan_preview = {
-            'loan': {
-                'financing': LOAN_FINANCING_MAP[financing],
-                'value': loan_value,
-                'interest_rate': interest_rate,
-                'period': period,
-                'amount_due': round(amount_due, 2)},
-            'payments': payments}
+            'loan': self.make_loan(financing, value, interest_rate, period, schedule.amount_due),
+            'payments': self.make_payments(schedule, due_dates)}
         return Response(loan_preview)
 
+    def parse_scenario(self, data):
+        financing = int(data.get('financing'))
+        assert financing in LOAN_FINANCING_MAP
+
+        value = float(data.get('value'))
+        interest_rate = float(data.get('interest_rate')) / 100.0
+        period = int(data.get('period'))
+        assert value > 0 and interest_rate > 0 and 0 < period <= MAX_PERIOD
+
+        return financing, value, interest_rate, period
+
+    def make_loan(self, financing, value, interest_rate, period, amount_due):
+        return {
+            'financing': LOAN_FINANCING_MAP[financing],
+            'value': value,
+            'interest_rate': interest_rate,
+            'period': period,
+            'amount_due': amount_due}
+
+    def make_payments(self, schedule, due_dates):
+        return [
+            {'payment': payment_order,
+             'value': installment,
+             'due_date': due_date,
+             'interest_amount': interest_amount,
+             'amortization': amortization}
+            for payment_order, (installment, interest_amount, amortization, due_date) in enumerate(zip(
+                schedule.installments.tolist(), schedule.interest_amounts.tolist(),
+                schedule.amortizations.tolist(), due_dates), start=1)]
+
+
+class LoanPreviewBatchAPIView(LoanPreviewAPIView):
+    """
+    Loan Preview Batch
+
+    * Any users can access this view
+    * Receives a list of `scenarios`, each one with the loan preview params,
+      the payments are only listed when `payments` is true
+    """
+
+    http_method_names = [u'post', u'options']
+    error_scenarios = _('Deve ser uma lista com 1 a {max_scenarios} cenários')
+
+    # Set to an integer to limit the number of scenarios per request.
+    max_scenarios = 5000
+
+    # Scenarios computed together, bounds the memory of the schedule arrays.
+    batch_size = 500
+
+    def post(self, request, *args, **kwargs):
+        scenarios = request.data.get('scenarios')
+        if not isinstance(scenarios, list) or not 0 < len(scenarios) <= self.max_scenarios:
+            raise ValidationError({'scenarios': self.error_scenarios.format(max_scenarios=self.max_scenarios)})
+
+        # validation post data
+        rows = []
+        errors = []
+        for scenario in scenarios:
+            try:
+                rows.append(self.parse_scenario(scenario))
+                errors.append({})
+            except (AttributeError, TypeError, ValueError, AssertionError):
+                errors.append(self.error_exception)
+
+        if any(errors):
+            raise ValidationError({'scenarios': errors})
+
+        # loan previews, computed batch by batch
+        with_payments = str(request.data.get('payments')).lower() in ('1', 'true')
+        financing, value, interest_rate, period = zip(*rows)
+        due_dates = make_due_dates(now(), max(period)) if with_payments else []
+
+        results = []
+        for start in range(0, len(rows), self.batch_size):
+            batch = slice(start, start + self.batch_size)
+            schedules = make_schedules(financing[batch], value[batch], interest_rate[batch], period[batch])
+
+            for index, row in enumerate(rows[batch]):
+                loan_preview = {'loan': self.make_loan(*row, float(schedules.amount_due[index]))}
+                if with_payments:
+                    schedule = Schedule(*(array[index, :row[3]] for array in schedules[:4]), None)
+                    loan_preview['payments'] = self.make_payments(schedule, due_dates)
+                results.append(loan_preview)
+
+        return Response({'results': results})
+
+
+class LoanPreviewCacheAPIView(APIView):
+    """
+    Loan Preview Cache
+
+    * Requires authentication
+    * Only admin users can access this view
+    * Shows the preview cache counters of the process serving the request
+    """
+
+    permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(preview_cache.stats())
+
 
 # Payments
 
-class PaymentListAPIView(PaymentMixin, ListAPIView):
+class PaymentListAPIView(ReplicaMixin, PaymentMixin, ConditionalGetMixin, ListAPIView):
     """
     Payment List
 
     * Requires authentication
     * Only client or admin users can access this view
+    * Loans with a schedule window store only the upcoming installments,
+      the ones entering the window are stored by the `advance_schedules`
+      command and the later ones are listed with `?projected=true`,
+      generated from the loan terms
+    * The installments of the packed loans are listed as the stored
+      payments, with the same filters, ordering and page number pagination
+    * Supports conditional requests with `If-None-Match` and
+      `If-Modified-Since`, validated by the last modified payment and the
+      payment count of the loan
     """
 
     queryset = Payment.objects.all()
     filter_class = PaymentFilterSet
-    serializer_class = PaymentSerializer
+    serializer_class = PaymentListSerializer
     permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, LoanPermission]
     ordering_fields = [
         'created', 'modified', 'status']
 
+    def get_queryset(self):
+        return self.get_serializer_class().get_values(super().get_queryset())
+
+    def get_validators(self):
+        # the packed installments change with the loan
+        if self.loan.storage == PACKED_STORAGE:
+            etag = make_etag(
+                self.request.accepted_renderer.format, self.request.get_full_path(), self.loan.modified)
+            return etag, self.loan.modified
+
+        payments = self.get_queryset().order_by().aggregate(last_modified=Max('modified'), count=Count('pk'))
+        last_modified = max(filter(None, [payments['last_modified'], self.loan.modified]))
+        etag = make_etag(
+            self.request.accepted_renderer.format, self.request.get_full_path(), self.loan.modified,
+            payments['last_modified'], payments['count'])
+        return etag, last_modified
+
+    def list(self, request, *args, **kwargs):
+        if self.loan.storage == PACKED_STORAGE:
+            return self.list_packed(request)
+
+        if self.loan.schedule_window:
+            if request.query_params.get('projected') in ('1', 'true'):
+                serializer = PaymentSerializer(
+                    self.loan.make_projected_payments(), many=True, context=self.get_serializer_context())
+                return Response(serializer.data)
+
+        return super().list(request, *args, **kwargs)
+
+    def list_packed(self, request):
+        filterset = self.filter_class(request.query_params, queryset=Payment.objects.none(), request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        filters = filterset.get_row_filters()
+        rows = [row for row in self.loan.get_packed_payments()
+                if all(row[name] == value for name, value in filters.items())]
+
+        # sorted one field at a time from the last one, the ties keep the
+        # creation order of the stored payments, the installment order
+        ordering = OrderingFilter().get_ordering(request, Payment.objects.none(), self) or Payment._meta.ordering
+        for field in reversed(ordering):
+            name = field.lstrip('-')
+            rows.sort(key=lambda row: (row[name], row['installment']) if name == 'created' else row[name],
+                      reverse=field.startswith('-'))
+
+        page = self.paginate_queryset(rows)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class PaymentExportAPIView(ReplicaMixin, ExportMixin, GenericAPIView):
+    """
+    Payment Export
 
-class PaymentUpdateAPIView(PaymentMixin, UpdateAPIView):
+    * Requires authentication
+    * Only client or admin users can access this view
+    * Streams the payments of all loans as csv or ndjson, with the payment
+      list filters
+    * The installments of the packed loans follow the stored payments, in
+      installment order by loan
+    """
+
+    queryset = Payment.objects.all()
+    filter_class = PaymentFilterSet
+    ordering_fields = PaymentListAPIView.ordering_fields
+    export_filename = 'payments'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not self.request.user.is_staff:
+            return queryset.filter(client=self.request.user)
+        return queryset
+
+    def get_export_rows(self, queryset, fields):
+        loans = Loan.objects.using(queryset.db)
+        if not self.request.user.is_staff:
+            loans = loans.filter(client=self.request.user)
+        filterset = self.filter_class(self.request.query_params, queryset=queryset, request=self.request)
+        filterset.is_valid()
+        return chain(
+            super().get_export_rows(queryset, fields),
+            loans.packed_payment_values(fields, **filterset.get_row_filters()))
+
+
+class PaymentUpdateAPIView(ReplicaMixin, PaymentMixin, UpdateAPIView):
     """
     Payment Update
 
     * Requires authentication
     * Only admin users can access this view
+    * The installments of the packed loans are updated in the loan row,
+      with the loan locked
     """
 
     queryset = Payment.objects.all()
     serializer_class = PaymentUpdateSerializer
     http_method_names = [u'patch', u'head', u'options', u'trace']
     permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, IsAdminUser]
+
+    def update(self, request, *args, **kwargs):
+        if self.loan.storage != PACKED_STORAGE:
+            return super().update(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            loan = Loan.objects.select_for_update().get(pk=self.loan.pk)
+            index = loan.get_packed_index(kwargs['pk'])
+            if index is None:
+                raise NotFound()
+            loan.update_packed([index], **serializer.validated_data)
+
+        payment = loan.make_packed_payments([index])[0]
+        return Response(self.get_serializer(payment).data)
+
+
+class PaymentBulkUpdateAPIView(ReplicaMixin, GenericAPIView):
+    """
+    Payment Bulk Update
+
+    * Requires authentication
+    * Only admin users can access this view
+    * Receives a list of `payments`, each one with the payment `id`, its
+      `status` and optionally its `pay_date`. The valid ones are updated
+      together in one transaction and the results are listed in the same
+      order, with the errors of the invalid ones
+    * The installments of the packed loans are updated in the loan rows,
+      with the loans locked
+    """
+
+    queryset = Payment.objects.all()
+    serializer_class = PaymentBulkUpdateSerializer
+    permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, IsAdminUser]
+    error_payments = _('Deve ser uma lista com 1 a {max_payments} pagamentos')
+    error_duplicated = _('Pagamento repetido na lista')
+
+    # Set to an integer to limit the number of payments per request.
+    max_payments = 5000
+
+    # Payments per update statement.
+    batch_size = 500
+
+    def post(self, request, *args, **kwargs):
+        items = request.data.get('payments')
+        if not isinstance(items, list) or not 0 < len(items) <= self.max_payments:
+            raise ValidationError({'payments': self.error_payments.format(max_payments=self.max_payments)})
+
+        with transaction.atomic():
+            payments, packed, results = self.make_payments(items)
+            self.get_queryset().bulk_update(payments, ['status', 'pay_date', 'modified'], batch_size=self.batch_size)
+            # one update per loan and change
+            updated = sum(loan.update_packed(indexes, **dict(fields)) for (loan, fields), indexes in packed.items())
+
+        return Response({'updated': len(payments) + updated, 'results': results})
+
+    def get_packed_indexes(self, payment_ids):
+        """
+        locked packed loan and installment index of the `payment_ids` not
+        stored as payments, the loans are looked up in one query
+        """
+        if not payment_ids:
+            return {}
+
+        loans = list(Loan.objects.filter_packed_payments(payment_ids).select_for_update().order_by('pk'))
+        loan_ids = [loan.pk for loan in loans]
+        indexes = {}
+        for pk in payment_ids:
+            start, end = get_packed_loan_range(pk)
+            for loan in loans[bisect_left(loan_ids, start):bisect_right(loan_ids, end)]:
+                index = loan.get_packed_index(pk)
+                if index is not None:
+                    indexes[pk] = (loan, index)
+        return indexes
+
+    def make_payments(self, items):
+        """
+        unsaved payments with the changes of the valid items and the packed
+        installment indexes to change by loan and change, the payments are
+        looked up in one query
+        """
+        item_serializers = [self.get_serializer(data=item) for item in items]
+        valid = [serializer.validated_data for serializer in item_serializers if serializer.is_valid()]
+        pay_dates = dict(self.get_queryset().select_for_update().filter(
+            pk__in=[data['id'] for data in valid]).values_list('pk', 'pay_date'))
+        packed_indexes = self.get_packed_indexes([data['id'] for data in valid if data['id'] not in pay_dates])
+
+        modified = now()
+        payments = {}
+        packed = {}
+        results = []
+        for serializer in item_serializers:
+            if serializer.errors:
+                results.append({'errors': serializer.errors})
+                continue
+
+            data = serializer.validated_data
+            pk = data['id']
+            if pk not in pay_dates and pk not in packed_indexes:
+                results.append({'id': str(pk), 'errors': {'id': [NotFound.default_detail]}})
+            elif pk in payments or pk in packed_indexes and packed_indexes[pk] is None:
+                results.append({'id': str(pk), 'errors': {'id': [self.error_duplicated]}})
+            elif pk in packed_indexes:
+                loan, index = packed_indexes[pk]
+                packed_indexes[pk] = None
+                fields = tuple((name, data[name]) for name in ('status', 'pay_date') if name in data)
+                packed.setdefault((loan, fields), []).append(index)
+                results.append({'id': str(pk), 'updated': True})
+            else:
+                payments[pk] = Payment(
+                    pk=pk, status=data['status'], pay_date=data.get('pay_date', pay_dates[pk]), modified=modified)
+                results.append({'id': str(pk), 'updated': True})
+        return list(payments.values()), packed, results
+
+
+class PaymentAnalyticsAPIView(ReplicaMixin, GenericAPIView):
+    """
+    Payment Analytics
+
+    * Requires authentication
+    * Only admin users can access this view
+    * Shows the expected and paid inflow by due month, the outstanding
+      principal by financing type and the overdue totals
+    * Filters by due date with `start` and `end`, and by `financing`,
+      `bank` and `client`
+    * Reads the payment summary, one row per month, financing and status,
+      which has the stored payments, the packed installments and the ones
+      the windowed loans have not stored yet. The overdue totals are the
+      open rows of the past months, the due rows of the current one and
+      its stored payments awaiting payment past their due date, so the
+      packed installments count once the `mark_overdue` job marks them due
+    * The filters needing the payments: a bank, a client or a due date
+      range not on month boundaries, read the payments instead, the packed
+      and the windowed installments of the matching loans are generated
+    """
+
+    queryset = Payment.objects.all()
+    filter_class = PaymentAnalyticsFilterSet
+    permission_classes = [*api_settings.DEFAULT_PERMISSION_CLASSES, IsAdminUser]
+    pagination_class = None
+
+    def get(self, request, *args, **kwargs):
+        filterset = self.filter_class(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        data = filterset.form.cleaned_data
+        summary = self.get_summary(data)
+        if summary is not None:
+            rows = summary.values('month', 'status', 'financing', 'count', 'value', 'amortization')
+            overdue = self.get_summary_overdue(filterset, summary)
+        else:
+            loans = self.get_loans(data)
+            projected, projected_overdue = self.get_projected(loans, data)
+            rows = chain(filterset.qs.summarize(), summarize_payments(
+                self.filter_due_date(loans.packed_payments(), data)), projected)
+            overdue = self.get_overdue(filterset, loans, projected_overdue)
+
+        inflow = {}
+        outstanding = {financing: {'payments': 0, 'principal': 0} for financing in LOAN_FINANCING_MAP}
+        for row in rows:
+            month = inflow.setdefault(make_month(row['month']), {'payments': 0, 'expected': 0, 'paid': 0})
+            if row['status'] in PAYMENT_OPEN_STATUSES:
+                month['payments'] += row['count']
+                month['expected'] += row['value']
+                outstanding[row['financing']]['payments'] += row['count']
+                outstanding[row['financing']]['principal'] += row['amortization']
+            elif row['status'] == PAID:
+                month['paid'] += row['value']
+
+        return Response({
+            'inflow': [
+                {'month': month.strftime('%Y-%m'), 'payments': totals['payments'],
+                 'expected': f'{totals["expected"]:.2f}', 'paid': f'{totals["paid"]:.2f}'}
+                for month, totals in sorted(inflow.items()) if totals['payments'] or totals['paid']],
+            'outstanding': [
+                {'financing': financing, 'name': LOAN_FINANCING_MAP[financing], 'payments': totals['payments'],
+                 'principal': f'{totals["principal"]:.2f}'}
+                for financing, totals in outstanding.items()],
+            'overdue': {'payments': overdue['count'], 'total': f'{overdue["total"]:.2f}'}})
+
+    def get_loans(self, data):
+        """
+        the loans matching the loan filters
+        """
+        loans = Loan.objects.all()
+        for name in ('financing', 'bank', 'client'):
+            if data.get(name):
+                loans = loans.filter(**{name: data[name]})
+        return loans
+
+    def filter_due_date(self, payments, data):
+        """
+        the unsaved `payments` in the due date range
+        """
+        for payment in payments:
+            if data.get('start') and payment.due_date < data['start']:
+                continue
+            if data.get('end') and payment.due_date >= data['end']:
+                continue
+            yield payment
+
+    def get_projected(self, loans, data):
+        """
+        summary rows, and overdue count and total, of the installments in
+        the due date range the windowed `loans` have not stored yet
+        """
+        at = now()
+        schedules = []
+        overdue = {'count': 0, 'total': Decimal('0.00')}
+        for loan, schedule, due_dates in loans.projected_schedules():
+            start = max(loan.stored, bisect_left(due_dates, data['start']) if data.get('start') else 0)
+            stop = max(start, bisect_left(due_dates, data['end']) if data.get('end') else loan.period)
+            schedules.append((loan.financing, schedule, due_dates, start, stop))
+
+            due = schedule.installments[start:max(start, min(stop, bisect_left(due_dates, at)))].tolist()
+            overdue['count'] += len(due)
+            overdue['total'] += Decimal(sum(round(value * 100) for value in due)).scaleb(-2)
+        return summarize_schedules(schedules), overdue
+
+    def get_overdue(self, filterset, loans, projected):
+        """
+        overdue count and total of the stored payments, the packed
+        installments and the `projected` ones
+        """
+        at = now()
+        data = filterset.form.cleaned_data
+        overdue = filterset.qs.overdue(at)
+        packed = loans.packed_overdue(min(filter(None, [at, data.get('end')])), data.get('start'))
+        return {
+            'count': overdue['count'] + packed['count'] + projected['count'],
+            'total': overdue['total'] + packed['total'] + projected['total']}
+
+    def get_summary_overdue(self, filterset, summary):
+        """
+        overdue count and total from the `summary` rows, and the stored
+        payments of the current month awaiting payment past their due date
+        """
+        at = now()
+        month = make_month(at)
+        overdue = summary.filter(
+            Q(month__lt=month, status__in=[AWAITING_PAYMENT, DUE]) | Q(month=month, status=DUE)).aggregate(
+            count=Coalesce(Sum('count'), 0), total=Coalesce(Sum('value'), Value(Decimal('0.00'))))
+        month_start = make_aware(datetime.combine(month, time()), get_default_timezone())
+        stored = filterset.qs.filter(due_date__gte=month_start, status=AWAITING_PAYMENT).overdue(at)
+        return {'count': overdue['count'] + stored['count'], 'total': overdue['total'] + stored['total']}
+
+    def get_summary(self, data):
+        """
+        summary for the filters, `None` when they need the payments
+        """
+        if data.get('bank') or data.get('client'):
+            return None
+
+        summary = PaymentSummary.objects.all()
+        for name, lookup in (('start', 'month__gte'), ('end', 'month__lt')):
+            if data.get(name):
+                month = make_month(data[name])
+                if data[name] != make_aware(datetime.combine(month, time()), get_default_timezone()):
+                    return None
+                summary = summary.filter(**{lookup: month})
+
+        if data.get('financing'):
+            summary = summary.filter(financing=data['financing'])
+        return summary
@@ -67,6 +67,21 @@ DATABASES = {
     }
 }
 
+# read replicas, as `host[:port]` comma separated, they get the safe method
+# requests of the views with `loans.mixins.ReplicaMixin`. The replica database
+# name defaults to the primary one, eg set it to use another local database
+for index, replica in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica{index + 1}'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('POSTGRES_REPLICA_DB') or DATABASES['default']['NAME'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        # tests read the primary database
+        'TEST': {'MIRROR': 'default'}}
+
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
 
 # ### EMAIL ###
 
@@ -107,6 +122,9 @@ INSTALLED_APPS = [
 
 # https://docs.djangoproject.com/en/3.1/ref/settings/#middleware
 MIDDLEWARE = [
+    # first, so it measures the whole request
+    'core.middleware.MetricsMiddleware',
+
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -375,7 +393,7 @@ REST_FRAMEWORK = {
     # session auth is adequate for ajax requests
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
+        'core.authentication.CachedJWTAuthentication'
     ],
 
     # by default, only authenticated users may use the API
@@ -394,6 +412,67 @@ SIMPLE_JWT = {
 }
 
 
+# ### PRINCIPAL CACHE ###
+
+PRINCIPAL_CACHE = {
+    # number of token users kept in-process, least recently used are evicted
+    'MAX_SIZE': int(os.getenv('PRINCIPAL_CACHE_MAX_SIZE', 4096)),
+
+    # seconds before a cached user expires, bounds how long the other
+    # processes see a changed or deactivated user
+    'TIMEOUT': int(os.getenv('PRINCIPAL_CACHE_TIMEOUT', 30)),
+
+    # alias in CACHES shared between processes, None keeps it in-process only
+    'BACKEND': os.getenv('PRINCIPAL_CACHE_BACKEND') or None
+}
+
+
+# ### READ REPLICAS ###
+
+REPLICAS = {
+    # database aliases the reads may go to, one is picked per request
+    'DATABASES': [alias for alias in DATABASES if alias != 'default'],
+
+    # seconds the reads of a user stay on the primary after one of its
+    # writes, so it reads what it wrote despite the replication lag
+    'PIN_SECONDS': int(os.getenv('REPLICAS_PIN_SECONDS', 5)),
+
+    # alias in CACHES shared between processes, required with replicas,
+    # None keeps the pins in-process only
+    'PIN_BACKEND': os.getenv('REPLICAS_PIN_BACKEND') or None
+}
+
+
+# ### LOAN PREVIEW CACHE ###
+
+LOAN_PREVIEW_CACHE = {
+    # number of schedules kept in-process, least recently used are evicted
+    'MAX_SIZE': int(os.getenv('LOAN_PREVIEW_CACHE_MAX_SIZE', 1024)),
+
+    # seconds before a cached schedule expires
+    'TIMEOUT': 60 * 60,
+
+    # alias in CACHES shared between processes, None keeps it in-process only
+    'BACKEND': os.getenv('LOAN_PREVIEW_CACHE_BACKEND') or None
+}
+
+
+# ### METRICS ###
+
+METRICS = {
+    # records the request metrics, see core.middleware.MetricsMiddleware
+    'ENABLED': ast.literal_eval(os.getenv('METRICS_ENABLED', 'True')),
+
+    # bearer token of the prometheus scraper, admin users can always read them
+    'TOKEN': os.getenv('METRICS_TOKEN') or None,
+
+    # histogram buckets of the request latency in seconds and of the
+    # database queries per request
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    'QUERY_BUCKETS': (0, 1, 2, 5, 10, 20, 50, 100, 200)
+}
+
+
 # ### DJANGO JS REVERSE ###
 # https://django-js-reverse.readthedocs.io/en/stable/#options
 
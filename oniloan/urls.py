@@ -24,6 +24,9 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.views import TokenRefreshView
 from rest_framework_simplejwt.views import TokenVerifyView
 
+# project
+from core.views import metrics_view
+
 
 urlpatterns = [
     # admin
@@ -35,7 +38,10 @@ urlpatterns = [
     path('api/token/verify/', TokenVerifyView.as_view(), name='token_verify'),
 
     # loans
-    path('api/', include(('loans.urls', 'loans'), namespace='loans'))
+    path('api/', include(('loans.urls', 'loans'), namespace='loans')),
+
+    # request metrics in the prometheus text format
+    path('metrics/', metrics_view, name='metrics')
 ]
 
 if settings.DEBUG: